@@ -0,0 +1,114 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset, RandomSampler
+from transformers import GPT2Config, VisionEncoderDecoderConfig, VisionEncoderDecoderModel, ViTConfig
+
+from to_latex_converter.dataset import DynamicPaddingCollator, LengthGroupedSampler
+
+
+# Сэмплы в формате кэша: метки дополнены -100 до max_length
+class SyntheticDataset(Dataset):
+    def __init__(self, size, image_size, max_length, vocab_size, seed=0):
+        rng = np.random.default_rng(seed)
+        # Длины меток с длинным хвостом, как у реальных: большинство короче 100 токенов
+        self.lengths = np.clip(rng.lognormal(4.0, 0.6, size).astype(int), 4, max_length)
+        self.image_size = image_size
+        self.max_length = max_length
+        self.vocab_size = vocab_size
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(idx)
+        labels = torch.full((self.max_length,), -100, dtype=torch.long)
+        length = int(self.lengths[idx])
+        labels[:length] = torch.randint(3, self.vocab_size, (length,), generator=generator)
+        pixel_values = torch.randn(3, self.image_size, self.image_size, generator=generator)
+        return {"pixel_values": pixel_values, "labels": labels}
+
+    def target_lengths(self):
+        return self.lengths
+
+
+def make_model(image_size, max_length, vocab_size):
+    encoder = ViTConfig(
+        image_size=image_size, patch_size=16, hidden_size=64, num_hidden_layers=2,
+        num_attention_heads=2, intermediate_size=128,
+    )
+    decoder = GPT2Config(
+        vocab_size=vocab_size, n_positions=max_length, n_embd=64, n_layer=2, n_head=2,
+        bos_token_id=1, eos_token_id=2, add_cross_attention=True,
+    )
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id = 1
+    config.pad_token_id = 0
+    torch.manual_seed(0)
+    return VisionEncoderDecoderModel(config)
+
+
+def run(dataset, model, batch_size, dynamic, grouped, workers, prefetch_factor, steps):
+    if grouped:
+        sampler = LengthGroupedSampler(dataset.target_lengths(), batch_size)
+    else:
+        sampler = RandomSampler(dataset, generator=torch.Generator().manual_seed(0))
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        sampler=sampler,
+        collate_fn=DynamicPaddingCollator() if dynamic else None,
+        num_workers=workers,
+        prefetch_factor=prefetch_factor if workers else None,
+        pin_memory=torch.cuda.is_available(),
+    )
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    model.train()
+    tokens = padded = 0
+    start = time.perf_counter()
+    for step, batch in enumerate(loader):
+        if step == steps:
+            break
+        loss = model(pixel_values=batch["pixel_values"], labels=batch["labels"]).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        tokens += int((batch["labels"] != -100).sum())
+        padded += batch["labels"].numel()
+    elapsed = time.perf_counter() - start
+    return tokens / elapsed, tokens / padded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare training throughput in target tokens/s')
+    parser.add_argument('--samples', type=int, default=4096)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--max-length', type=int, default=296)
+    parser.add_argument('--image-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--prefetch-factor', type=int, default=2)
+    args = parser.parse_args()
+
+    vocab_size = 1000
+    dataset = SyntheticDataset(args.samples, args.image_size, args.max_length, vocab_size)
+    variants = [
+        ('fixed padding', False, False),
+        ('dynamic padding', True, False),
+        ('dynamic padding + length groups', True, True),
+    ]
+    for workers in args.workers:
+        for name, dynamic, grouped in variants:
+            model = make_model(args.image_size, args.max_length, vocab_size)
+            tokens_per_s, density = run(
+                dataset, model, args.batch_size, dynamic, grouped, workers,
+                args.prefetch_factor, args.steps,
+            )
+            print(f'{name}, workers={workers}: {tokens_per_s:,.0f} tokens/s, '
+                  f'{density:.0%} of label positions are real tokens')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from to_latex_converter.inference import OCRInference, benchmark, export_onnx
+from to_latex_converter.testing import save_random_model
+
+
+def load_images(paths, count, seed=0):
+    if paths:
+        images = [Image.open(path) for path in paths]
+        return [images[i % len(images)] for i in range(count)]
+    # Белая строка с шумными «символами», похожая по размеру на рендер формулы
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = np.full((64, 384), 255, dtype=np.uint8)
+        pixels[16:48, 8:376] = rng.integers(0, 256, (32, 368), dtype=np.uint8)
+        images.append(Image.fromarray(pixels))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare PyTorch, ONNX and int8 ONNX inference')
+    parser.add_argument('--model-dir', type=Path, default=None,
+                        help='model saved by train.py; a tiny random model if not given')
+    parser.add_argument('--images', type=Path, nargs='*', default=[])
+    parser.add_argument('--count', type=int, default=64)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--num-beams', type=int, default=1)
+    parser.add_argument('--max-new-tokens', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir or save_random_model(Path(tmp) / 'model')
+        onnx_dir = Path(tmp) / 'onnx'
+        int8_dir = export_onnx(model_dir, onnx_dir, quantize=True)
+        images = load_images(args.images, args.count)
+        # Случайная модель сразу выдаёт </s>; фиксируем длину, чтобы сравнение было честным
+        extra = {} if args.model_dir else {'min_new_tokens': args.max_new_tokens}
+        for name, path, backend in [('torch', model_dir, 'torch'), ('onnx', onnx_dir, 'onnx'),
+                                    ('onnx int8', int8_dir, 'onnx')]:
+            engine = OCRInference(path, backend, args.threads)
+            result = benchmark(engine, images, args.batch_size, args.num_beams,
+                               args.max_new_tokens, **extra)
+            print(f"{name}: {result['images_per_s']:.1f} images/s, "
+                  f"p50 {result['latency_p50_ms']:.0f} ms, p90 {result['latency_p90_ms']:.0f} ms, "
+                  f"p99 {result['latency_p99_ms']:.0f} ms per batch of {args.batch_size}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pymupdf
+
+from to_latex_converter.tools.tex2png import make_raster_pool, rasterize_pdf
+
+
+# Function to create a small one-page PDF similar to a rendered standalone sample
+# Input:
+#   path (str): Where to save the PDF
+# Output:
+#   None
+def make_sample_pdf(path):
+    doc = pymupdf.open()
+    page = doc.new_page(width=420, height=60)
+    page.insert_text((10, 35), 'f(x) = x^2 + 2x + 1, sum_{i=1}^{n} i = n(n+1)/2', fontsize=14)
+    doc.save(path)
+    doc.close()
+
+
+def bench_backend(backend, pdf_path, out_dir, n, dpi, colorspace):
+    start = time.perf_counter()
+    for i in range(n):
+        rasterize_pdf(pdf_path, os.path.join(out_dir, f'{backend}_{i}.png'), dpi, colorspace, backend)
+    return time.perf_counter() - start
+
+
+# Как tex_to_png_parallel: workers потоков, каждый растеризует свои PDF
+def bench_parallel(pdf_path, out_dir, n, dpi, colorspace, workers, raster_pool):
+    def job(i):
+        rasterize_pdf(pdf_path, os.path.join(out_dir, f'parallel_{i}.png'), dpi, colorspace,
+                      'pymupdf', raster_pool=raster_pool)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Прогрев: запуск процессов пула не входит в замер
+        list(pool.map(job, range(workers)))
+        start = time.perf_counter()
+        list(pool.map(job, range(n)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare PyMuPDF and ImageMagick rasterization')
+    parser.add_argument('--pdf', default=None, help='PDF to rasterize (a synthetic one by default)')
+    parser.add_argument('-n', type=int, default=50)
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--colorspace', choices=['rgb', 'gray'], default='rgb')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    out_dir = tempfile.mkdtemp(prefix='bench_rasterize_')
+    try:
+        pdf_path = args.pdf
+        if pdf_path is None:
+            pdf_path = os.path.join(out_dir, 'sample.pdf')
+            make_sample_pdf(pdf_path)
+        for backend in ['pymupdf', 'imagemagick']:
+            if backend == 'imagemagick' and shutil.which('convert') is None:
+                print('imagemagick: skipped, `convert` not found')
+                continue
+            elapsed = bench_backend(backend, pdf_path, out_dir, args.n, args.dpi, args.colorspace)
+            print(f'{backend}: {args.n / elapsed:.1f} images/s ({elapsed / args.n * 1000:.1f} ms/image)')
+        # Потоки без пула упираются в общий замок MuPDF и рендерят по одному
+        elapsed = bench_parallel(pdf_path, out_dir, args.n, args.dpi, args.colorspace, args.workers, None)
+        print(f'pymupdf, {args.workers} threads (serialized): {args.n / elapsed:.1f} images/s')
+        raster_pool = make_raster_pool(args.workers)
+        try:
+            elapsed = bench_parallel(pdf_path, out_dir, args.n, args.dpi, args.colorspace, args.workers,
+                                     raster_pool)
+        finally:
+            raster_pool.shutdown()
+        print(f'pymupdf, {args.workers} threads + {args.workers} processes: {args.n / elapsed:.1f} images/s')
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
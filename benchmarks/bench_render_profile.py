@@ -0,0 +1,82 @@
+import argparse
+import glob
+import io
+import random
+import time
+
+import pymupdf
+from PIL import Image
+from transformers import ViTImageProcessor
+
+from to_latex_converter.tools.render_profile import make_render_profile, processor_input_size, render_page
+
+WORDS = ['функция', 'значение', 'равно', 'при', 'условии', 'где', 'x^2 + y^2 = r^2', '\\int f(x) dx']
+
+
+# Страницы, похожие на вывод standalone: ширина строки 345pt, высота по числу строк
+def make_pdfs(count, seed=0):
+    rng = random.Random(seed)
+    pdfs = []
+    for _ in range(count):
+        lines = rng.randint(1, 6)
+        doc = pymupdf.open()
+        page = doc.new_page(width=345, height=14 * lines + 4)
+        for i in range(lines):
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 8)))
+            page.insert_text((2, 13 + 14 * i), text, fontsize=10, fontname='helv')
+        pdfs.append(doc.tobytes())
+    return pdfs
+
+
+def render_baseline(page):
+    # Как tex2png без профиля: вся страница, 300 DPI, RGB, PNG
+    return page.get_pixmap(dpi=300, colorspace=pymupdf.csRGB, alpha=False).tobytes('png')
+
+
+def measure(pdfs, render, processor):
+    images = []
+    start = time.perf_counter()
+    for data in pdfs:
+        with pymupdf.open(stream=data, filetype='pdf') as doc:
+            images.append(render(doc[0]))
+    render_s = (time.perf_counter() - start) / len(pdfs)
+    # Как MyDataset: открыть, перевести в RGB и прогнать через процессор
+    start = time.perf_counter()
+    for image in images:
+        processor(Image.open(io.BytesIO(image)).convert('RGB'), return_tensors='np')
+    decode_s = (time.perf_counter() - start) / len(images)
+    return sum(map(len, images)) / len(images), render_s, decode_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes per sample and decode time of render profiles')
+    parser.add_argument('--pdf', nargs='*', default=[], help='single-page sample PDFs (glob)')
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--processor', default=None,
+                        help='image processor folder or model id; 448x448 ViT processor by default')
+    args = parser.parse_args()
+
+    processor_config = args.processor or {'size': {'height': 448, 'width': 448}}
+    height, width = processor_input_size(processor_config)
+    processor = ViTImageProcessor(size={'height': height, 'width': width})
+    paths = [path for pattern in args.pdf for path in glob.glob(pattern)]
+    pdfs = [open(path, 'rb').read() for path in paths] if paths else make_pdfs(args.count)
+
+    variants = [('300 dpi rgb png (baseline)', render_baseline)]
+    for fit in ('contain', 'exact'):
+        for image_format, level in (('png', 6), ('png', 9), ('webp', None)):
+            profile = make_render_profile(processor_config, image_format, level or 6, fit)
+            name = f'{fit} {image_format}' + (f' level {level}' if level else ' lossless')
+            variants.append((name, lambda page, profile=profile: render_page(page, profile)))
+    base_bytes = base_decode = None
+    for name, render in variants:
+        size, render_s, decode_s = measure(pdfs, render, processor)
+        if base_bytes is None:
+            base_bytes, base_decode = size, decode_s
+        print(f'{name}: {size / 1024:.1f} KiB/sample ({base_bytes / size:.1f}x smaller), '
+              f'render {render_s * 1000:.1f} ms, decode+preprocess {decode_s * 1000:.1f} ms '
+              f'({base_decode / decode_s:.1f}x faster)')
+
+
+if __name__ == '__main__':
+    main()
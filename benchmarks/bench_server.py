@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import io
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from to_latex_converter.inference import OCRInference
+from to_latex_converter.metrics import Metrics
+from to_latex_converter.server import InferenceServer, MicroBatcher
+from to_latex_converter.testing import save_random_model
+
+
+def make_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = np.full((64, 384), 255, dtype=np.uint8)
+        pixels[16:48, 8:376] = rng.integers(0, 256, (32, 368), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='PNG')
+        images.append(buffer.getvalue())
+    return images
+
+
+async def post(port, body):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'POST /recognize HTTP/1.1\r\nContent-Length: {len(body)}\r\n'
+                 f'Connection: close\r\n\r\n'.encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def run(engine, images, clients, max_batch_size, max_wait_ms, max_new_tokens):
+    metrics = Metrics()
+    # min_new_tokens: случайная модель сразу выдаёт </s>, фиксируем длину вывода
+    batcher = MicroBatcher(engine, max_batch_size, max_wait_ms, metrics=metrics,
+                           max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens)
+    server = InferenceServer(batcher, port=0)
+    await server.start()
+    latencies = []
+    todo = list(images)
+
+    async def client():
+        while todo:
+            body = todo.pop()
+            start = time.perf_counter()
+            response = await post(server.port, body)
+            assert response.startswith(b'HTTP/1.1 200'), response[:100]
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    # Повтор тех же изображений: ответы из кэша
+    cache_start = time.perf_counter()
+    for body in images[:clients]:
+        await batcher.recognize(body)
+    cache_elapsed = time.perf_counter() - cache_start
+    await server.stop()
+    counters = {c['name']: c['value'] for c in metrics.snapshot()['counters'] if not c['labels']}
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {
+        'images_per_s': len(images) / elapsed,
+        'mean_batch': counters['server_batch_images_total'] / counters['server_batches_total'],
+        'p50_ms': p50 * 1000,
+        'p99_ms': p99 * 1000,
+        'cached_ms': cache_elapsed / clients * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-batching server throughput on a tiny random model')
+    parser.add_argument('--count', type=int, default=128)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--max-batch-sizes', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    parser.add_argument('--max-new-tokens', type=int, default=32)
+    args = parser.parse_args()
+
+    images = make_images(args.count)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = OCRInference(save_random_model(Path(tmp) / 'model'))
+        for max_batch_size in args.max_batch_sizes:
+            result = asyncio.run(run(engine, images, args.clients, max_batch_size,
+                                     args.max_wait_ms, args.max_new_tokens))
+            print(f"max_batch_size={max_batch_size}: {result['images_per_s']:.1f} images/s, "
+                  f"mean batch {result['mean_batch']:.1f}, p50 {result['p50_ms']:.0f} ms, "
+                  f"p99 {result['p99_ms']:.0f} ms, cached {result['cached_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from to_latex_converter.tools import data_generator as dg
+from to_latex_converter.tools.formula_index import FormulaIndex, extract_latex_formulas_from_string
+from to_latex_converter.tools.latex_validator import validate_latex
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+WORDS = ['функция', 'значение', 'равно', 'при', 'условии', 'следовательно', 'где', 'точка', 'и', 'в',
+         'множество', 'предел', 'производная', 'интеграл', 'ряд', 'сходится']
+FORMULAS = [
+    'x^2 + y^2 = r^2',
+    '\\frac{a}{b} + \\sqrt{c}',
+    '\\sum_{i=1}^{n} i = \\frac{n(n+1)}{2}',
+    '\\int_0^1 f(x) dx',
+    '\\mathbb{R}^n \\to \\mathbb{R}',
+    'a_{ij} b_{jk}',
+    'a+b',
+    '\\lim_{n \\to \\infty} \\left( 1 + \\frac{1}{n} \\right)^n = e \\tag{1}',
+]
+
+
+# Function to build a synthetic Russian corpus: one paragraph per line
+# Input:
+#   n_sentences (int): Number of sentences
+#   seed (int, optional): Random seed
+# Output:
+#   text (str)
+def make_corpus(n_sentences, seed=0):
+    rng = random.Random(seed)
+    lines, line = [], []
+    for _ in range(n_sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+        line.append(' '.join(words) + rng.choice(['.', '.', ',', '!', '?']))
+        if rng.random() < 0.2:
+            lines.append(' '.join(line))
+            line = []
+    lines.append(' '.join(line))
+    return '\n'.join(lines) + '\n'
+
+
+# Function to build a synthetic formula corpus in the format extract_latex_formulas reads
+# Input:
+#   n_formulas (int): Number of formulas
+#   seed (int, optional): Random seed
+# Output:
+#   tex (str): \[ ... \] and align* environments
+def make_formula_tex(n_formulas, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    for i in range(n_formulas):
+        formula = rng.choice(FORMULAS).replace('n', 'n' * (1 + i % 3))
+        if rng.random() < 0.5:
+            parts.append('\\[' + formula + '\\]\n')
+        else:
+            parts.append('\\begin{align*}\n' + formula + '\n\\end{align*}\n')
+    return ''.join(parts)
+
+
+def legacy_checks(s):
+    return (
+        dg.check_braces_balance(s)
+        and dg.check_parentheses_balance(s)
+        and dg.check_latex_commands_and_braces(s)
+        and dg.check_latex_math_delimiters(s)
+    )
+
+
+# Каждый случай готовит данные и возвращает (run, обработанные байты);
+# run() выполняет измеряемый шаг и возвращает число сэмплов
+def case_process_text(work_dir, corpus_path, formulas, size):
+    def run():
+        random.seed(0)
+        dg.process_text(corpus_path, os.path.join(work_dir, 'out.txt'), list(formulas.formulas))
+        return size
+    return run, os.path.getsize(corpus_path)
+
+
+def case_process_text_stream(work_dir, corpus_path, formulas, size):
+    def run():
+        dg.process_text_stream(corpus_path, os.path.join(work_dir, 'out.txt'), formulas,
+                               rng=random.Random(0))
+        return size
+    return run, os.path.getsize(corpus_path)
+
+
+def _words(corpus_path, formulas):
+    processed = os.path.join(os.path.dirname(corpus_path), 'processed.txt')
+    dg.process_text_stream(corpus_path, processed, formulas, rng=random.Random(0))
+    with open(processed, 'r', encoding='utf-8') as f:
+        text = dg.remove_empty_brackets(dg.remove_symbols(f.read()))
+    return dg.TOKENIZERS['regex'](text), text
+
+
+def _lines(corpus_path):
+    with open(corpus_path, 'r', encoding='utf-8') as f:
+        return dg.sample_lines([f.read()], rng=random.Random(0))
+
+
+def _latex_content(corpus_path, formulas):
+    words, _ = _words(corpus_path, formulas)
+    return dg.format_text_with_latex(words, formulas, _lines(corpus_path), rng=random.Random(0),
+                                     progress=False)
+
+
+def case_format_text_with_latex(work_dir, corpus_path, formulas, size):
+    words, text = _words(corpus_path, formulas)
+    lines = _lines(corpus_path)
+    n_sentences = sum(1 for _ in dg.iter_word_sentences(words))
+
+    def run():
+        dg.format_text_with_latex(words, formulas, lines, rng=random.Random(0), progress=False)
+        return n_sentences
+    return run, len(text.encode('utf-8'))
+
+
+def case_split_latex_blocks(work_dir, corpus_path, formulas, size):
+    content = _latex_content(corpus_path, formulas)
+    return lambda: len(dg.split_latex_blocks(content)), len(content.encode('utf-8'))
+
+
+def case_iter_latex_blocks(work_dir, corpus_path, formulas, size):
+    content = _latex_content(corpus_path, formulas)
+    # Фрагменты примерно по предложению, как у iter_latex_fragments
+    fragments = [content[i:i + 120] for i in range(0, len(content), 120)]
+    return lambda: sum(1 for _ in dg.iter_latex_blocks(fragments)), len(content.encode('utf-8'))
+
+
+def _groups(corpus_path, formulas):
+    blocks = dg.split_latex_blocks(_latex_content(corpus_path, formulas))
+    return ['\n'.join(blocks[i:i + 3]) for i in range(0, len(blocks), 3)]
+
+
+def case_check_legacy(work_dir, corpus_path, formulas, size):
+    groups = _groups(corpus_path, formulas)
+
+    def run():
+        for group in groups:
+            legacy_checks(group)
+        return len(groups)
+    return run, sum(len(g.encode('utf-8')) for g in groups)
+
+
+def case_validate_latex(work_dir, corpus_path, formulas, size):
+    groups = _groups(corpus_path, formulas)
+
+    def run():
+        for group in groups:
+            validate_latex(group, check_math_commands=True)
+        return len(groups)
+    return run, sum(len(g.encode('utf-8')) for g in groups)
+
+
+def case_write_blocks_to_files(work_dir, corpus_path, formulas, size):
+    blocks = dg.split_latex_blocks(_latex_content(corpus_path, formulas))
+    out_dir = os.path.join(work_dir, 'tex')
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return dg.write_blocks_to_files(blocks, 3, out_dir)
+    run()
+    n_bytes = sum(entry.stat().st_size for entry in os.scandir(out_dir))
+    return run, n_bytes
+
+
+def case_tex_to_png(work_dir, corpus_path, formulas, size):
+    from to_latex_converter.tools.tex2png import tex_to_png_parallel
+
+    blocks = dg.split_latex_blocks(_latex_content(corpus_path, formulas))
+    out_dir = os.path.join(work_dir, 'tex')
+    # pdflatex на порядки медленнее остальных шагов — рендерим только часть сэмплов
+    with contextlib.redirect_stdout(io.StringIO()):
+        dg.write_blocks_to_files(blocks[:3 * max(1, size // 100)], 3, out_dir)
+    n_bytes = sum(entry.stat().st_size for entry in os.scandir(out_dir))
+
+    def run():
+        return tex_to_png_parallel(out_dir, progress=False, use_format=True, batch_size=8)['ok']
+    return run, n_bytes
+
+
+CASES = {
+    'process_text': case_process_text,
+    'process_text_stream': case_process_text_stream,
+    'format_text_with_latex': case_format_text_with_latex,
+    'split_latex_blocks': case_split_latex_blocks,
+    'iter_latex_blocks': case_iter_latex_blocks,
+    'check_legacy': case_check_legacy,
+    'validate_latex': case_validate_latex,
+    'write_blocks_to_files': case_write_blocks_to_files,
+    'tex_to_png': case_tex_to_png,
+}
+
+
+# Один случай в отдельном процессе: результаты прошлых случаев не влияют на замер
+def run_case(name, size, min_time=1.0):
+    work_dir = tempfile.mkdtemp(prefix='bench_suite_')
+    try:
+        corpus_path = os.path.join(work_dir, 'corpus.txt')
+        with open(corpus_path, 'w', encoding='utf-8') as f:
+            f.write(make_corpus(size))
+        formulas = FormulaIndex.from_formulas(
+            extract_latex_formulas_from_string(make_formula_tex(max(100, size // 10)))
+        )
+        run, n_bytes = CASES[name](work_dir, corpus_path, formulas, size)
+        # Лучшее из нескольких повторов, но не меньше min_time секунд измерений
+        elapsed, total, repeats = float('inf'), 0.0, 0
+        while repeats < 3 or total < min_time:
+            start = time.perf_counter()
+            samples = run()
+            took = time.perf_counter() - start
+            elapsed, total, repeats = min(elapsed, took), total + took, repeats + 1
+        # Пик памяти — отдельным прогоном вне замера времени: tracemalloc замедляет код.
+        # Считаются только выделения самого шага, без подготовки данных и интерпретатора
+        # (память дочерних процессов, например pdflatex, сюда не входит)
+        tracemalloc.start()
+        try:
+            run()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'samples': samples,
+        'seconds': elapsed,
+        'repeats': repeats,
+        'samples_per_s': samples / elapsed if elapsed else 0.0,
+        'mb_per_s': n_bytes / elapsed / 1e6 if elapsed else 0.0,
+        'peak_mem_mb': peak_bytes / 2 ** 20,
+    }
+
+
+def spawn_case(name, size, min_time):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-case', name, '--sizes', str(size),
+         '--min-time', str(min_time)],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+# Function to compare results with the baseline
+# Input:
+#   results (dict): {case@size: metrics}
+#   baseline (dict): The same structure from an earlier run
+#   tolerance (float): Allowed relative slowdown of samples/s
+# Output:
+#   regressions (list): Names of cases slower than the baseline by more than tolerance
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"{'case':40} {'samples/s':>12} {'MB/s':>8} {'peak, MB':>8} {'vs base':>8}")
+    for key, metrics in results.items():
+        if 'error' in metrics:
+            print(f'{key:40} {metrics["error"]}')
+            continue
+        base = baseline.get(key)
+        ratio = ''
+        if base and base.get('samples_per_s'):
+            speedup = metrics['samples_per_s'] / base['samples_per_s']
+            ratio = f'{speedup:7.2f}x'
+            if speedup < 1 - tolerance:
+                regressions.append(key)
+                ratio += ' !'
+        print(f'{key:40} {metrics["samples_per_s"]:12.1f} {metrics["mb_per_s"]:8.2f} '
+              f'{metrics["peak_mem_mb"]:8.1f} {ratio:>8}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the generator and render hot paths')
+    parser.add_argument('--cases', nargs='+', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[2000, 20000],
+                        help='corpus sizes in sentences')
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='seconds to repeat each case for; the fastest run is reported')
+    parser.add_argument('--output', default=None, help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='allowed relative slowdown before the run fails')
+    parser.add_argument('--run-case', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.sizes[0], args.min_time)))
+        return
+
+    results = {}
+    for size in args.sizes:
+        for name in args.cases:
+            if name == 'tex_to_png' and shutil.which('pdflatex') is None:
+                results[f'{name}@{size}'] = {'error': 'skipped: pdflatex not found'}
+                continue
+            results[f'{name}@{size}'] = spawn_case(name, size, args.min_time)
+
+    report = {
+        'meta': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'cpu_count': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': results,
+    }
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if regressions and not args.save_baseline:
+        print(f'Regressions against {args.baseline}: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
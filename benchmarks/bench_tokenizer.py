@@ -0,0 +1,57 @@
+import argparse
+import random
+import subprocess
+import sys
+import time
+
+from to_latex_converter.tools.data_generator import TOKENIZERS
+
+WORDS = ['функция', 'значение', 'равно', 'при', 'условии', 'следовательно', 'где', 'точка', 'и', 'в']
+
+
+def make_text(n_words, seed=0):
+    rng = random.Random(seed)
+    parts = []
+    for i in range(n_words):
+        parts.append(rng.choice(WORDS))
+        parts.append(rng.choice([' ', ' ', ' ', ', ', '. ', '? ']))
+    return ''.join(parts)
+
+
+# Время запуска: импорт модуля и первый вызов в новом процессе
+def startup_time(name):
+    code = (
+        'import time; start = time.perf_counter(); '
+        'from to_latex_converter.tools.data_generator import TOKENIZERS; '
+        f'TOKENIZERS[{name!r}]("тест строки"); '
+        'print(time.perf_counter() - start)'
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare word tokenizers of data_generator')
+    parser.add_argument('--words', type=int, default=200000)
+    parser.add_argument('--tokenizers', nargs='+', default=list(TOKENIZERS))
+    args = parser.parse_args()
+
+    text = make_text(args.words)
+    reference = None
+    for name in args.tokenizers:
+        startup = startup_time(name)
+        tokenize = TOKENIZERS[name]
+        tokenize('тест')  # прогрев (словарь jieba)
+        start = time.perf_counter()
+        tokens = tokenize(text)
+        elapsed = time.perf_counter() - start
+        assert ''.join(tokens) == text
+        sentences = [t for t in tokens if t in '.,!?']
+        if reference is None:
+            reference = sentences
+        print(f'{name}: startup {startup:.2f} s, {args.words / elapsed:,.0f} words/s, '
+              f'same sentence split: {sentences == reference}')
+
+
+if __name__ == '__main__':
+    main()
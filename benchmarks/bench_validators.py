@@ -0,0 +1,104 @@
+import argparse
+import random
+import re
+import time
+
+from to_latex_converter.tools import data_generator as dg
+from to_latex_converter.tools.latex_validator import MATH_COMMANDS, check_latex_math_commands, validate_latex
+
+WORDS = ['функция', 'значение', 'равно', 'при', 'условии', 'следовательно', 'где', 'точка']
+FORMULAS = [
+    'x^2 + y^2 = r^2',
+    '\\frac{a}{b} + \\sqrt{c}',
+    '\\sum_{i=1}^{n} i = \\frac{n(n+1)}{2}',
+    '\\int_0^1 f(x) dx',
+    '\\mathbb{R}^n \\to \\mathbb{R}',
+    'a_{ij} b_{jk}',
+]
+LEGACY_ENVS = ['align\\*', 'align', 'array', 'gather\\*', 'gather', 'equation\\*', 'equation']
+
+
+# Старая реализация (до таблицы команд) — для сравнения.
+# '\\|' исправлено на '\\\|': в исходном списке шаблон совпадал с пустой строкой.
+def legacy_check_latex_math_commands(s, patterns):
+    for cmd in patterns:
+        if re.search(cmd, s):
+            return True
+    if re.search(r'[\\^_{}]', s):
+        return False
+    return True
+
+
+def legacy_fix_unclosed_environments(tex_content):
+    for env in LEGACY_ENVS:
+        open_count = len(re.findall(r'\\begin\{' + env + r'\}', tex_content))
+        close_count = len(re.findall(r'\\end\{' + env + r'\}', tex_content))
+        if open_count > close_count:
+            tex_content += '\n' + ('\\end{' + env + '}\n') * (open_count - close_count)
+    return tex_content
+
+
+def legacy_chain(s, patterns):
+    return (
+        dg.check_braces_balance(s)
+        and dg.check_parentheses_balance(s)
+        and dg.check_latex_math_delimiters(s)
+        and legacy_check_latex_math_commands(s, patterns)
+    )
+
+
+def make_block(rng, n_sentences):
+    parts = []
+    for _ in range(n_sentences):
+        parts.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))))
+        if rng.random() < 0.5:
+            parts.append(' \\( ' + rng.choice(FORMULAS) + ' \\) ')
+        elif rng.random() < 0.2:
+            parts.append('\n \\begin{align*} \n' + rng.choice(FORMULAS) + '\n \\end{align*} \n')
+    return ''.join(parts)
+
+
+def timeit(func, blocks, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for block in blocks:
+            func(block)
+    return (time.perf_counter() - start) / (repeat * len(blocks)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-block cost of the LaTeX checks, before and after')
+    parser.add_argument('--blocks', type=int, default=500)
+    parser.add_argument('--sentences', type=int, default=3, help='sentences per block')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    blocks = [make_block(rng, args.sentences) for _ in range(args.blocks)]
+    patterns = [r'\\' + re.escape(name) + regex for name, regex in MATH_COMMANDS]
+    # Команд в блоке нет -> старый цикл проходит все шаблоны
+    plain = [block.replace('\\', '') for block in blocks]
+
+    for block in blocks + plain:
+        assert legacy_check_latex_math_commands(block, patterns) == check_latex_math_commands(block)
+        assert legacy_fix_unclosed_environments(block) == dg.fix_unclosed_environments(block)
+        assert legacy_chain(block, patterns) == (not validate_latex(block, check_math_commands=True))
+
+    rows = [
+        ('check_latex_math_commands (with commands)',
+         lambda b: legacy_check_latex_math_commands(b, patterns), check_latex_math_commands, blocks),
+        ('check_latex_math_commands (no commands)',
+         lambda b: legacy_check_latex_math_commands(b, patterns), check_latex_math_commands, plain),
+        ('fix_unclosed_environments', legacy_fix_unclosed_environments, dg.fix_unclosed_environments, blocks),
+        ('balance/delimiter checks', lambda b: legacy_chain(b, patterns),
+         lambda b: validate_latex(b, check_math_commands=True), blocks),
+    ]
+    print(f"{'check':45} {'before, us':>12} {'after, us':>12} {'speedup':>8}")
+    for name, before, after, data in rows:
+        t_before = timeit(before, data, args.repeat)
+        t_after = timeit(after, data, args.repeat)
+        print(f'{name:45} {t_before:12.1f} {t_after:12.1f} {t_before / t_after:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+import pytest
+
+from to_latex_converter.tools.data_generator import check_latex_math_delimiters
+from to_latex_converter.tools.latex_validator import check_latex_math_commands
+
+
+@pytest.mark.parametrize(
+    "s, expected",
+    [
+        (r"\(x^2\) и \[y_1\]", True),
+        # Неизвестная команда: строгая проверка команд её отвергает, проверка разделителей — нет
+        (r"\(\foo{x}^2\)", True),
+        (r"\(x^2", False),
+        (r"y_1\]", False),
+    ],
+)
+def test_check_latex_math_delimiters(s, expected):
+    assert check_latex_math_delimiters(s) is expected
+
+
+def test_check_latex_math_commands_is_stricter():
+    assert check_latex_math_commands(r"\frac{a}{b}^2")
+    assert not check_latex_math_commands(r"\foo{x}^2")
@@ -0,0 +1,84 @@
+import json
+import random
+
+from to_latex_converter.tools import formula_index
+from to_latex_converter.tools.formula_index import FormulaIndex
+
+FORMULAS = [
+    "a+b",
+    "x^2 + y^2 = z^2 \\tag{1}",
+    "\\frac{a}{b}",
+    "\\sum_{i=1}^{n} i = \\frac{n(n+1)}{2} \\quad \\text{for every } n",
+    "e = mc^2 + very long plain formula without commands",
+]
+
+
+def test_buckets_match_the_generator_conditions():
+    index = FormulaIndex.from_formulas(FORMULAS)
+    formulas = index.formulas
+
+    assert "x^2 + y^2 = z^2" in formulas  # \tag снят
+    assert formulas == sorted(formulas, key=len)
+    short = {formulas[i] for i in index.buckets["short"]}
+    inline = {formulas[i] for i in index.buckets["inline"]}
+    display = {formulas[i] for i in index.buckets["display"]}
+    assert short == {f for f in formulas if len(f) < 50}
+    assert inline == {f for f in formulas if len(f) < 30 and "\\" not in f}
+    assert display == {f for f in formulas if len(f) > 30 and "\\" in f}
+
+
+def test_sample_respects_max_len():
+    index = FormulaIndex.from_formulas(FORMULAS)
+    rng = random.Random(0)
+
+    assert all(len(index.sample("short", rng, max_len=11)) <= 11 for _ in range(50))
+    assert index.sample("short", rng, max_len=1) is None
+
+
+def write_tex(path):
+    body = "".join(f"\\[ {f} \\]\n" for f in FORMULAS)
+    path.write_text(f"\\begin{{document}}\n{body}\\end{{document}}\n", encoding="utf-8")
+
+
+def test_cache_round_trip(tmp_path):
+    tex = tmp_path / "f.tex"
+    write_tex(tex)
+    cache_dir = tmp_path / "cache"
+
+    built = FormulaIndex.load_or_build(str(tex), str(cache_dir))
+    (cached_file,) = cache_dir.iterdir()
+    loaded = FormulaIndex.load_or_build(str(tex), str(cache_dir))
+
+    assert loaded.formulas == built.formulas
+    assert loaded.buckets == built.buckets
+    assert loaded.source_sha256 == built.source_sha256
+    assert json.loads(cached_file.read_text(encoding="utf-8"))["version"] == formula_index.INDEX_VERSION
+
+
+def test_cache_is_rebuilt_after_a_version_or_bucket_change(tmp_path, monkeypatch):
+    tex = tmp_path / "f.tex"
+    write_tex(tex)
+    cache_dir = tmp_path / "cache"
+    FormulaIndex.load_or_build(str(tex), str(cache_dir))
+
+    monkeypatch.setattr(formula_index, "INDEX_VERSION", formula_index.INDEX_VERSION + 1)
+    FormulaIndex.load_or_build(str(tex), str(cache_dir))
+    buckets = dict(formula_index.BUCKETS, short={"max_len": 10})
+    monkeypatch.setattr(formula_index, "BUCKETS", buckets)
+    index = FormulaIndex.load_or_build(str(tex), str(cache_dir))
+
+    assert len(list(cache_dir.iterdir())) == 3
+    assert all(len(index.formulas[i]) < 10 for i in index.buckets["short"])
+
+
+def test_foreign_cache_file_is_rebuilt(tmp_path):
+    tex = tmp_path / "f.tex"
+    write_tex(tex)
+    cache_dir = tmp_path / "cache"
+    FormulaIndex.load_or_build(str(tex), str(cache_dir))
+    (cached_file,) = cache_dir.iterdir()
+    cached_file.write_text(json.dumps({"version": -1}), encoding="utf-8")
+
+    index = FormulaIndex.load_or_build(str(tex), str(cache_dir))
+
+    assert len(index) == len(FORMULAS)
@@ -0,0 +1,53 @@
+import os
+import random
+
+from to_latex_converter.tools.data_generator import generate_sharded
+
+WORDS = ["функция", "равно", "значение", "точка", "при", "где", "условии", "следовательно", "x", "Hello"]
+
+
+def write_inputs(tmp_path):
+    rng = random.Random(0)
+    lines = []
+    for _ in range(120):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(4, 14))]
+        lines.append(" ".join(words) + rng.choice([".", ",", "!", "?"]))
+    text_file = tmp_path / "corpus.txt"
+    text_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tex_file = tmp_path / "formulas.tex"
+    tex_file.write_text(
+        "".join(f"\\[ x_{{{i}}}^2 + \\frac{{a}}{{b}} = \\sum_{{i=1}}^{{n}} \\alpha_i \\]\n\\[ a+{i} \\]\n"
+                for i in range(20)),
+        encoding="utf-8",
+    )
+    return str(text_file), str(tex_file)
+
+
+def read_tree(folder):
+    tree = {}
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), "rb") as f:
+            tree[name] = f.read()
+    return tree
+
+
+def test_generate_sharded_is_independent_of_workers(tmp_path):
+    text_file, tex_file = write_inputs(tmp_path)
+    trees = []
+    for workers in (1, 2, 3):
+        out = tmp_path / f"out{workers}"
+        written = generate_sharded(text_file, tex_file, str(out), seed=7, num_shards=4,
+                                   workers=workers, index_stride=1000)
+        tree = read_tree(out)
+        assert written == len(tree) > 0
+        trees.append(tree)
+    assert trees[0] == trees[1] == trees[2]
+
+
+def test_generate_sharded_depends_on_seed(tmp_path):
+    text_file, tex_file = write_inputs(tmp_path)
+    generate_sharded(text_file, tex_file, str(tmp_path / "a"), seed=1, num_shards=4, workers=1,
+                     index_stride=1000)
+    generate_sharded(text_file, tex_file, str(tmp_path / "b"), seed=2, num_shards=4, workers=1,
+                     index_stride=1000)
+    assert read_tree(tmp_path / "a") != read_tree(tmp_path / "b")
@@ -0,0 +1,61 @@
+import gzip
+import os
+
+from to_latex_converter.tools.ingest_formulas import FormulaStore, ingest
+
+
+def write_tex(path, *formulas):
+    path.write_text("".join(f"Текст \\[ {formula} \\]\n" for formula in formulas), encoding="utf-8")
+
+
+def store_formulas(store_path):
+    with FormulaStore(store_path) as store:
+        return sorted(store.iter_formulas())
+
+
+def test_ingest_dedups_and_resumes(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    write_tex(src / "a.tex", "x+1", "y \\label{eq:y}")
+    # Пробелы и метки не различают формулы
+    write_tex(src / "b.tex", "x + 1", "z")
+    with gzip.open(src / "c.gz", "wt", encoding="utf-8") as f:
+        f.write("\\[ w \\]")
+    store_path = str(tmp_path / "formulas.sqlite")
+    stats = ingest(str(src), store_path, workers=1)
+    assert stats == {"sources": 3, "skipped": 0, "failed": 0, "added": 4}
+    assert store_formulas(store_path) == ["w", "x+1", "y", "z"]
+
+    stats = ingest(str(src), store_path, workers=1)
+    assert stats == {"sources": 0, "skipped": 3, "failed": 0, "added": 0}
+
+
+def test_ingest_reprocesses_edited_source(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    write_tex(src / "a.tex", "x")
+    store_path = str(tmp_path / "formulas.sqlite")
+    ingest(str(src), store_path, workers=1)
+    write_tex(src / "a.tex", "x", "y^2")
+    # Размер меняется и так, но время правки тоже сдвигаем явно
+    st = os.stat(src / "a.tex")
+    os.utime(src / "a.tex", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    stats = ingest(str(src), store_path, workers=1)
+    assert stats == {"sources": 1, "skipped": 0, "failed": 0, "added": 1}
+    assert store_formulas(store_path) == ["x", "y^2"]
+
+
+def test_ingest_counts_corrupt_gzip_as_failed(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    write_tex(src / "a.tex", "x")
+    data = gzip.compress(("\\[ y \\]" * 1000).encode("utf-8"))
+    # Испорченные данные внутри потока дают zlib.error, а не OSError
+    (src / "bad.gz").write_bytes(data[:20] + bytes(b ^ 0xFF for b in data[20:60]) + data[60:])
+    (src / "cut.gz").write_bytes(data[: len(data) // 2])
+    store_path = str(tmp_path / "formulas.sqlite")
+    stats = ingest(str(src), store_path, workers=1)
+    assert stats == {"sources": 1, "skipped": 0, "failed": 2, "added": 1}
+    # Сбойные источники не отмечаются как обработанные и повторяются при следующем запуске
+    stats = ingest(str(src), store_path, workers=1)
+    assert stats == {"sources": 0, "skipped": 1, "failed": 2, "added": 0}
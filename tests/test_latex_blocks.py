@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+from to_latex_converter.tools.data_generator import iter_latex_blocks, split_latex_blocks
+
+# Кусочки, из которых собираются тексты: все разделители _BLOCK_REGEX и их обрывки
+PIECES = [
+    "слово ", "text ", "x^2", " ", "\n", "{", "}", "\\", "\\[", "\\]", "\\(", "\\)", "$", "$$",
+    "\\begin{align*}", "\\end{align*}", "\\begin{equation}", "\\end{equation}", "\\begin{",
+    "\\end{", "\\beg", "align", "\\frac{a}{b}",
+]
+
+
+def random_text(rng):
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 40)))
+
+
+def random_fragments(rng, text):
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, rng.randint(0, 12))))
+    bounds = [0] + cuts + [len(text)]
+    return [text[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_iter_latex_blocks_matches_split_latex_blocks(seed):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        text = random_text(rng)
+        # Маленькие чанки: граница чанка попадает внутрь блоков и разделителей
+        blocks = iter_latex_blocks(random_fragments(rng, text), chunk_size=rng.randint(1, 32))
+        assert list(blocks) == split_latex_blocks(text), text
+
+
+def test_iter_latex_blocks_one_character_at_a_time():
+    text = "a \\(x\\) b $$y$$ \\begin{align*} z \\\\ w \\end{align*} c \\[ \\frac{1}{2} \\] d $e$"
+    assert list(iter_latex_blocks(text, chunk_size=1)) == split_latex_blocks(text)
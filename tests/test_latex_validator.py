@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from to_latex_converter.tools import data_generator as dg
+from to_latex_converter.tools.latex_validator import check_latex_math_commands, validate_latex
+
+# Куски, на которых старые проверки расходятся сильнее всего: экранированные скобки,
+# команды с аргументами и без, одиночный обратный слеш
+PIECES = ["\\(", "\\)", "\\[", "\\]", "{", "}", "(", ")", "[", "]", "\\frac", "\\sqrt{", "\\\\", "\\",
+          "\\{", "\\}", "x", "ab", " ", "^", "_", "\n"]
+
+
+def legacy_rules(s):
+    return {
+        "braces": not dg.check_braces_balance(s),
+        "parentheses": not dg.check_parentheses_balance(s),
+        "command_argument": not dg.check_latex_commands_and_braces(s),
+        "math_delimiters": not dg.check_latex_math_delimiters(s),
+        "math_commands": not check_latex_math_commands(s),
+    }
+
+
+def validator_rules(s):
+    rules = {d.rule for d in validate_latex(s, check_math_commands=True)}
+    return {
+        "braces": "braces" in rules,
+        "parentheses": "parentheses" in rules,
+        "command_argument": "command_argument" in rules,
+        "math_delimiters": bool(rules & {"inline_math", "display_math"}),
+        "math_commands": "math_commands" in rules,
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_validate_latex_matches_legacy_checks(seed):
+    rng = random.Random(seed)
+    for _ in range(5000):
+        s = "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 12)))
+        assert validator_rules(s) == legacy_rules(s), repr(s)
+
+
+@pytest.mark.parametrize(
+    "s, rules",
+    [
+        (r"\(x^2\) и \[\frac{a}{b}\]", []),
+        (r"\frac{a}{b", ["braces"]),
+        (r"\sqrt{x", ["braces", "command_argument"]),
+        ("a)", ["parentheses"]),
+        (r"\(x", ["parentheses", "inline_math"]),
+        (r"x\]", ["display_math"]),
+    ],
+)
+def test_validate_latex_rules(s, rules):
+    assert [d.rule for d in validate_latex(s)] == rules
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+pymupdf = pytest.importorskip("pymupdf")
+
+from to_latex_converter.tools.pdf_to_image import page_image_path, pdf_to_images
+
+
+def make_pdf(path, pages):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc = pymupdf.open()
+    for i in range(pages):
+        doc.new_page(width=100, height=100).insert_text((10, 50), f"page {i}")
+    doc.save(path)
+    doc.close()
+
+
+def test_pdfs_with_the_same_name_do_not_overwrite_each_other(tmp_path):
+    pdf_dir, out_dir = tmp_path / "pdf", tmp_path / "out"
+    make_pdf(str(pdf_dir / "a" / "paper.pdf"), 3)
+    make_pdf(str(pdf_dir / "b" / "paper.pdf"), 5)
+
+    stats = pdf_to_images(str(pdf_dir), str(out_dir), dpi=20, workers=1)
+
+    assert stats["rendered"] == 8
+    assert len(os.listdir(out_dir / "a" / "paper")) == 3
+    assert len(os.listdir(out_dir / "b" / "paper")) == 5
+    # Повторный запуск ничего не рендерит: все страницы обеих PDF уже на диске
+    stats = pdf_to_images(str(pdf_dir), str(out_dir), dpi=20, workers=1)
+    assert stats["rendered"] == 0
+    assert stats["skipped"] == 8
+
+
+def test_single_file_is_named_after_the_pdf(tmp_path):
+    pdf_file = str(tmp_path / "paper.pdf")
+    make_pdf(pdf_file, 1)
+    assert page_image_path("out", pdf_file, 0, pdf_file) == os.path.join(
+        "out", "paper", "page-00001.png"
+    )
@@ -0,0 +1,45 @@
+import os
+
+from to_latex_converter.tools.render_cache import RenderCache
+
+
+def make_png(path, size):
+    path.write_bytes(b"\x89PNG" + b"\0" * (size - 4))
+    return str(path)
+
+
+def test_key_depends_on_content_and_settings(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    key = cache.key("x", {"density": 300})
+    assert key == cache.key("x", {"density": 300})
+    assert key != cache.key("y", {"density": 300})
+    assert key != cache.key("x", {"density": 200})
+
+
+def test_hit_and_miss(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    key = cache.key("x", {})
+    dest = tmp_path / "out.png"
+    assert not cache.get(key, str(dest))
+    cache.put(key, make_png(tmp_path / "src.png", 100))
+    # Старый файл на месте назначения заменяется
+    dest.write_bytes(b"stale")
+    assert cache.get(key, str(dest))
+    assert dest.read_bytes() == (tmp_path / "src.png").read_bytes()
+    # Кэш переживает перезапуск
+    assert RenderCache(str(tmp_path / "cache")).total_bytes == 100
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), max_bytes=350)
+    keys = [cache.key(str(i), {}) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, make_png(tmp_path / f"src{i}.png", 100))
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    # Попадание обновляет время: самой старой становится запись 1
+    assert cache.get(keys[0], str(tmp_path / "hit.png"))
+    cache.put(cache.key("3", {}), make_png(tmp_path / "src3.png", 100))
+    assert cache.total_bytes <= 350 * 0.9
+    assert cache.get(keys[0], str(tmp_path / "a.png"))
+    assert not cache.get(keys[1], str(tmp_path / "b.png"))
+    assert cache.get(keys[2], str(tmp_path / "c.png"))
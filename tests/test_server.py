@@ -0,0 +1,112 @@
+import asyncio
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("transformers")
+
+from to_latex_converter.inference import OCRInference
+from to_latex_converter.metrics import Metrics
+from to_latex_converter.server import InferenceServer, MicroBatcher
+from to_latex_converter.testing import save_random_model
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    return OCRInference(save_random_model(tmp_path_factory.mktemp("model")))
+
+
+def make_image(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (32, 96), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def counter(metrics, name, **labels):
+    for item in metrics.snapshot()["counters"]:
+        if item["name"] == name and item["labels"] == labels:
+            return item["value"]
+    return 0
+
+
+def run_batcher(engine, metrics, coro_fn, **kwargs):
+    async def run():
+        batcher = MicroBatcher(engine, metrics=metrics, max_new_tokens=4, **kwargs)
+        await batcher.start()
+        try:
+            return await coro_fn(batcher)
+        finally:
+            await batcher.stop()
+
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_are_batched(engine):
+    metrics = Metrics()
+    images = [make_image(seed) for seed in range(8)]
+
+    async def requests(batcher):
+        return await asyncio.gather(*(batcher.recognize(image) for image in images))
+
+    texts = run_batcher(engine, metrics, requests, max_batch_size=8, max_wait_ms=500)
+
+    assert len(texts) == 8
+    assert counter(metrics, "server_batch_images_total") == 8
+    assert counter(metrics, "server_batches_total") < 8
+
+
+def test_repeated_image_is_served_from_cache(engine):
+    metrics = Metrics()
+    image = make_image(0)
+
+    async def requests(batcher):
+        first = await batcher.recognize(image)
+        second = await batcher.recognize(image)
+        return first, second
+
+    first, second = run_batcher(engine, metrics, requests)
+
+    assert first == second
+    assert counter(metrics, "server_requests_total", cache="miss") == 1
+    assert counter(metrics, "server_requests_total", cache="hit") == 1
+    assert counter(metrics, "server_batch_images_total") == 1
+
+
+def test_undecodable_image_fails_alone(engine):
+    metrics = Metrics()
+    image = make_image(1)
+
+    async def requests(batcher):
+        results = await asyncio.gather(
+            batcher.recognize(b"not an image"), batcher.recognize(image), return_exceptions=True
+        )
+        # Цикл батчей жив: следующий запрос тоже обрабатывается
+        results.append(await batcher.recognize(make_image(2)))
+        return results
+
+    broken, good, later = run_batcher(engine, metrics, requests, max_wait_ms=200)
+
+    assert isinstance(broken, Exception)
+    assert isinstance(good, str)
+    assert isinstance(later, str)
+    assert counter(metrics, "server_errors_total") == 1
+
+
+def test_oversized_body_is_rejected(engine):
+    async def run():
+        server = InferenceServer(MicroBatcher(engine, metrics=Metrics()), port=0, max_body_bytes=1024)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"POST /recognize HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\n")
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            return response
+        finally:
+            await server.stop()
+
+    assert asyncio.run(run()).startswith(b"HTTP/1.1 413")
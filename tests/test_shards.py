@@ -0,0 +1,31 @@
+import pickle
+
+from to_latex_converter.shards import ShardReader, ShardWriter
+
+
+def write_shards(out_dir, count, samples_per_shard=3):
+    with ShardWriter(out_dir, samples_per_shard) as writer:
+        for i in range(count):
+            writer.write(f"{i:03d}", f"image-{i}".encode(), f"text {i}", {"i": i})
+
+
+def test_reader_reads_back_every_sample(tmp_path):
+    write_shards(tmp_path, 7)
+    reader = ShardReader(tmp_path)
+
+    assert len(reader) == 7
+    assert reader[4] == {"key": "004", "image": b"image-4", "text": "text 4", "meta": {"i": 4}}
+    assert reader[-1]["key"] == "006"
+    assert [sample["text"] for sample in reader] == [f"text {i}" for i in range(7)]
+
+
+def test_reader_pickles_after_a_read(tmp_path):
+    write_shards(tmp_path, 7)
+    reader = ShardReader(tmp_path)
+    reader[0]
+
+    # Так ридер попадает в воркеры DataLoader при spawn
+    clone = pickle.loads(pickle.dumps(reader))
+
+    assert clone[5]["text"] == "text 5"
+    assert reader[1]["text"] == "text 1"
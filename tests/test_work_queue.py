@@ -0,0 +1,51 @@
+from to_latex_converter.tools.work_queue import WorkQueue
+
+
+def make_queue(tmp_path, ids=("a", "b", "c"), **kwargs):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), **kwargs)
+    queue.add(ids)
+    return queue
+
+
+def test_claim_splits_work_between_owners(tmp_path):
+    with make_queue(tmp_path) as queue:
+        assert queue.add(["a", "d"]) == 1
+        assert queue.claim("w1", 2) == ["a", "b"]
+        assert queue.claim("w2", 10) == ["c", "d"]
+        assert queue.claim("w3", 10) == []
+        queue.done("w1", ["a"])
+        queue.fail("w2", "c", "pdflatex failed")
+        # Чужие id не закрываются
+        queue.done("w1", ["d"])
+        assert queue.counts() == {"pending": 0, "leased": 2, "done": 1, "failed": 1}
+        assert queue.failures() == [("c", "pdflatex failed")]
+
+
+def test_heartbeat_keeps_lease(tmp_path):
+    with make_queue(tmp_path) as queue:
+        assert queue.claim("w1", 3, lease_seconds=-1) == ["a", "b", "c"]
+        assert queue.heartbeat("w1", ["a", "b"], lease_seconds=600) == 2
+        assert queue.heartbeat("w2", ["c"], lease_seconds=600) == 0
+        # Продлённые аренды живы, истёкшую забирает другой воркер
+        assert queue.claim("w2", 3) == ["c"]
+        assert queue.heartbeat("w1", ["c"]) == 0
+
+
+def test_reclaim_expired(tmp_path):
+    with make_queue(tmp_path) as queue:
+        assert queue.claim("w1", 1, lease_seconds=600) == ["a"]
+        assert queue.claim("w1", 2, lease_seconds=-1) == ["b", "c"]
+        assert queue.reclaim_expired() == 2
+        assert queue.counts() == {"pending": 2, "leased": 1, "done": 0, "failed": 0}
+        assert queue.claim("w2", 3) == ["b", "c"]
+
+
+def test_expired_too_many_times_fails(tmp_path):
+    with make_queue(tmp_path, ids=["a"], max_attempts=2) as queue:
+        assert queue.claim("w1", 1, lease_seconds=-1) == ["a"]
+        assert queue.claim("w2", 1, lease_seconds=-1) == ["a"]
+        assert queue.claim("w3", 1) == []
+        assert queue.failed_ids() == ["a"]
+        assert queue.failures() == [("a", "lease expired too many times")]
+        assert queue.retry_failed() == 1
+        assert queue.claim("w3", 1) == ["a"]
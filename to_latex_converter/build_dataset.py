@@ -0,0 +1,296 @@
+import argparse
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from omegaconf import OmegaConf
+from tqdm import tqdm
+
+from to_latex_converter.metrics import METRICS
+from to_latex_converter.shards import ShardWriter
+from to_latex_converter.tools.data_generator import iter_shard_documents, shard_tasks
+from to_latex_converter.tools.extract_tex_text_from_tex_file import extract_tex_text
+from to_latex_converter.tools.formula_index import load_formula_index
+from to_latex_converter.tools.latex_template import split_document
+from to_latex_converter.tools.render_profile import make_render_profile
+from to_latex_converter.tools.tex2png import (
+    build_formats,
+    compile_bodies,
+    make_raster_pool,
+    rasterize_pdf_pages,
+)
+from to_latex_converter.utils import init_basic_logger, load_config
+
+DEFAULT_CONFIG = {
+    "input_text": "to_latex_converter/tools/test.text",
+    "input_tex": "to_latex_converter/tools/formular.tex",
+    "out_dir": "data/shards",
+    "metrics": None,
+    "seed": 0,
+    "group_size": 3,
+    "tokenizer": "regex",
+    "generate": {"workers": 2, "num_shards": 64, "index_stride": 1000000, "queue_size": 1024},
+    "compile": {
+        "workers": 4,
+        "batch_size": 8,
+        "timeout": 30,
+        "use_format": True,
+        "queue_size": 32,
+    },
+    "rasterize": {
+        "workers": 2,
+        "density": 300,
+        "colorspace": "rgb",
+        "backend": "pymupdf",
+        "queue_size": 32,
+        # Профиль render_profile.py: обрезанные серые картинки под вход модели
+        "profile": None,
+    },
+    "write": {"samples_per_shard": 10000, "queue_size": 1024},
+}
+
+# Конец очереди: каждый воркер стадии получает свой
+_DONE = None
+
+
+def _generate_worker(tasks: list, formulas, out_queue) -> None:
+    """Runs data_generator shards in a separate process and streams their documents."""
+    # После fork в METRICS лежат счётчики родителя
+    METRICS.reset()
+    try:
+        for task in tasks:
+            with METRICS.timer("generate_seconds", item=f"shard {task[1]}-{task[2]}"):
+                for file_idx, document in iter_shard_documents(task, formulas):
+                    out_queue.put(("doc", file_idx, document))
+        out_queue.put(("done", METRICS.snapshot()))
+    except BaseException:
+        out_queue.put(("error", traceback.format_exc()))
+
+
+def _start_stage(
+    name: str,
+    work: Callable,
+    inbox: queue.Queue,
+    outbox: Optional[queue.Queue],
+    workers: int,
+    downstream_workers: int,
+    errors: list,
+) -> List[threading.Thread]:
+    """Starts ``workers`` threads calling ``work(item)`` for every item of ``inbox``.
+
+    The last thread to finish sends one ``_DONE`` per downstream worker. After the first
+    error the stage keeps draining its inbox, so upstream stages never block on a full queue.
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def run():
+        try:
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+                if errors:
+                    continue
+                try:
+                    work(item)
+                except Exception as e:
+                    errors.append(e)
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                for _ in range(downstream_workers):
+                    outbox.put(_DONE)
+
+    threads = [
+        threading.Thread(target=run, name=f"{name}-{i}", daemon=True) for i in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def build_dataset(config) -> dict:
+    """Generates, compiles, rasterizes and packs samples into shards in one pipelined run.
+
+    Stages are connected by bounded queues, so a slow stage throttles the ones before it:
+    generation (processes) -> batching -> compilation (threads, pdflatex subprocesses) ->
+    rasterization (threads) -> shard writing (one thread). Nothing but the shards is written
+    to the output. Returns the number of samples per outcome.
+    """
+    config = OmegaConf.merge(OmegaConf.create(DEFAULT_CONFIG), config)
+    gen, comp, rast = config.generate, config.compile, config.rasterize
+    logger = init_basic_logger("build_dataset")
+    stats = {"generated": 0, "written": 0, "compile_error": 0, "convert_error": 0}
+    stats_lock = threading.Lock()
+    errors = []
+
+    def count(key: str, n: int = 1) -> None:
+        with stats_lock:
+            stats[key] += n
+        if key != "generated":
+            status = "ok" if key == "written" else key
+            METRICS.inc("samples_total", n, stage="render", status=status)
+
+    formulas = load_formula_index(config.input_tex)
+    tasks = shard_tasks(
+        config.input_text,
+        None,
+        config.seed,
+        gen.num_shards,
+        gen.index_stride,
+        config.group_size,
+        config.tokenizer,
+    )
+    ctx = multiprocessing.get_context()
+    doc_queue = ctx.Queue(maxsize=gen.queue_size)
+    compile_queue = queue.Queue(maxsize=comp.queue_size)
+    raster_queue = queue.Queue(maxsize=rast.queue_size)
+    write_queue = queue.Queue(maxsize=config.write.queue_size)
+
+    fmt_dir = tempfile.mkdtemp(prefix="build_dataset_fmt_") if comp.use_format else None
+    scratch_dirs = [fmt_dir] if fmt_dir else []
+    formats = build_formats(fmt_dir, batch=True) if fmt_dir else None
+    profile = make_render_profile(**rast.profile) if rast.profile else None
+    image_ext = profile["image_format"] if profile else "png"
+    # Потоки стадии только ждут: страницы рендерят процессы пула, по MuPDF на процесс
+    raster_pool = make_raster_pool(rast.workers, rast.backend)
+    local = threading.local()
+
+    def compile_batch(batch: list) -> None:
+        if not hasattr(local, "work_dir"):
+            local.work_dir = tempfile.mkdtemp(prefix="build_dataset_")
+            with stats_lock:
+                scratch_dirs.append(local.work_dir)
+        bodies = [body for _, body, _ in batch]
+        pdf_path = compile_bodies(
+            bodies, local.work_dir, f"batch-{batch[0][0]}", comp.timeout, formats
+        )
+        if pdf_path is not None:
+            raster_queue.put((pdf_path, batch))
+        elif len(batch) == 1:
+            count("compile_error")
+        else:
+            # Делим пачку пополам, пока битый сэмпл не останется один
+            half = len(batch) // 2
+            compile_batch(batch[:half])
+            compile_batch(batch[half:])
+
+    def rasterize(item: tuple) -> None:
+        pdf_path, batch = item
+        try:
+            images = rasterize_pdf_pages(
+                pdf_path,
+                rast.density,
+                rast.colorspace,
+                rast.backend,
+                comp.timeout,
+                profile,
+                raster_pool,
+            )
+        except Exception:
+            count("convert_error", len(batch))
+            return
+        finally:
+            Path(pdf_path).unlink(missing_ok=True)
+        for (file_idx, _, label), image in zip(batch, images):
+            write_queue.put((file_idx, image, label))
+
+    writer = ShardWriter(Path(config.out_dir), config.write.samples_per_shard)
+
+    def write(item: tuple) -> None:
+        file_idx, image, label = item
+        writer.write(str(file_idx), image, label, {"image_ext": image_ext})
+        METRICS.inc("bytes_written_total", len(image) + len(label.encode("utf-8")), kind="shard")
+        count("written")
+        bar.update(1)
+
+    processes = [
+        ctx.Process(target=_generate_worker, args=(tasks[i :: gen.workers], formulas, doc_queue))
+        for i in range(min(gen.workers, len(tasks)))
+    ]
+    # Процессы запускаем до потоков стадий: fork из многопоточного процесса небезопасен
+    for process in processes:
+        process.start()
+    bar = tqdm(desc="samples")
+    threads = (
+        _start_stage(
+            "compile",
+            compile_batch,
+            compile_queue,
+            raster_queue,
+            comp.workers,
+            rast.workers,
+            errors,
+        )
+        + _start_stage("rasterize", rasterize, raster_queue, write_queue, rast.workers, 1, errors)
+        + _start_stage("write", write, write_queue, None, 1, 0, errors)
+    )
+
+    # Собираем документы генераторов в пачки для pdflatex
+    try:
+        batch, running = [], len(processes)
+        while running:
+            try:
+                message = doc_queue.get(timeout=1)
+            except queue.Empty:
+                if any(p.exitcode not in (None, 0) for p in processes):
+                    raise RuntimeError("a generation process died")
+                continue
+            if message[0] == "done":
+                running -= 1
+                METRICS.merge(message[1])
+            elif message[0] == "error":
+                raise RuntimeError(f"generation failed:\n{message[1]}")
+            elif not errors:
+                _, file_idx, document = message
+                count("generated")
+                batch.append((file_idx, split_document(document)[1], extract_tex_text(document)))
+                if len(batch) == comp.batch_size:
+                    compile_queue.put(batch)
+                    batch = []
+        if batch:
+            compile_queue.put(batch)
+    except BaseException as e:
+        errors.append(e)
+        for process in processes:
+            process.terminate()
+    finally:
+        for _ in range(comp.workers):
+            compile_queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+        for process in processes:
+            process.join()
+        writer.close()
+        bar.close()
+        if raster_pool is not None:
+            raster_pool.shutdown()
+        for work_dir in scratch_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if errors:
+        raise errors[0]
+    logger.info(f"Built {config.out_dir}: {stats}")
+    METRICS.log_summary()
+    if config.metrics:
+        METRICS.export(Path(config.metrics))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the dataset shards end to end")
+    parser.add_argument("--config", type=Path, default=Path("configs/build_dataset.yaml"))
+    args = parser.parse_args()
+    config = load_config(args.config)
+    build_dataset(config.build_dataset)
+
+
+if __name__ == "__main__":
+    main()
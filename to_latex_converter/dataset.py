@@ -0,0 +1,317 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, Sampler
+from tqdm import tqdm
+
+from to_latex_converter.shards import INDEX_FILE, ShardReader
+
+
+def encode_sample(image, target_text, tokenizer, feature_extractor, max_length=296):
+    pixel_values = feature_extractor(image, return_tensors="pt").pixel_values
+    target = tokenizer(target_text, padding="max_length", max_length=max_length, truncation=True).input_ids
+    labels = [label if label != tokenizer.pad_token_id else -100 for label in target]
+    return {"pixel_values": pixel_values.squeeze(), "labels": torch.tensor(labels)}
+
+
+def label_lengths(labels) -> np.ndarray:
+    """Length up to the last non-``-100`` token of every row of padded labels."""
+    lengths = np.empty(len(labels), dtype=np.int32)
+    # Блоками, чтобы не читать весь memmap в память разом
+    for start in range(0, len(labels), 65536):
+        mask = np.asarray(labels[start : start + 65536]) != -100
+        last = mask.shape[1] - np.argmax(mask[:, ::-1], axis=1)
+        lengths[start : start + len(mask)] = np.where(mask.any(axis=1), last, 0)
+    return lengths
+
+
+def target_lengths(texts, tokenizer, max_length=296, batch_size=1024) -> np.ndarray:
+    """Token lengths of target texts, as ``encode_sample`` would truncate them."""
+    lengths = []
+    for start in range(0, len(texts), batch_size):
+        encoded = tokenizer(texts[start : start + batch_size], max_length=max_length, truncation=True)
+        lengths.extend(len(ids) for ids in encoded.input_ids)
+    return np.asarray(lengths, dtype=np.int32)
+
+
+class DynamicPaddingCollator:
+    """Stacks samples and pads labels only to the longest target in the batch.
+
+    Accepts both labels padded to ``max_length`` with ``-100`` (as ``encode_sample`` and the
+    preprocess cache store them) and unpadded ones.
+    """
+
+    def __init__(self, pad_to_multiple_of: Optional[int] = 8, label_pad_token_id: int = -100):
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.label_pad_token_id = label_pad_token_id
+
+    def _length(self, label: torch.Tensor) -> int:
+        # До последнего непаддингового токена: -100 бывает и в середине (pad == eos)
+        positions = torch.nonzero(label != self.label_pad_token_id)
+        return int(positions[-1]) + 1 if len(positions) else 0
+
+    def __call__(self, features: List[dict]) -> dict:
+        labels = [feature["labels"] for feature in features]
+        lengths = [self._length(label) for label in labels]
+        width = max(max(lengths), 1)
+        if self.pad_to_multiple_of:
+            width = -(-width // self.pad_to_multiple_of) * self.pad_to_multiple_of
+        width = min(width, max(len(label) for label in labels))
+        batch_labels = torch.full((len(labels), width), self.label_pad_token_id, dtype=torch.long)
+        for row, (label, length) in enumerate(zip(labels, lengths)):
+            batch_labels[row, :length] = label[:length]
+        return {
+            "pixel_values": torch.stack([feature["pixel_values"] for feature in features]),
+            "labels": batch_labels,
+        }
+
+
+class LengthGroupedSampler(Sampler):
+    """Shuffled order in which neighbouring ``batch_size`` samples have similar target lengths.
+
+    Indices are shuffled, cut into mega-batches of ``batch_size * mega_batch_mult``, sorted by
+    length inside each mega-batch and split into batches; the batches are then shuffled, with
+    the longest one kept first so that an out-of-memory shows up on the first step. Every pass
+    reshuffles with ``seed + epoch``.
+    """
+
+    def __init__(self, lengths, batch_size: int, mega_batch_mult: int = 50, seed: int = 0):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.mega_batch_size = batch_size * mega_batch_mult
+        self.seed = seed
+        self.epoch = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        indices = rng.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(indices), self.mega_batch_size):
+            mega_batch = indices[start : start + self.mega_batch_size]
+            mega_batch = mega_batch[np.argsort(-self.lengths[mega_batch], kind="stable")]
+            batches.extend(
+                mega_batch[i : i + self.batch_size] for i in range(0, len(mega_batch), self.batch_size)
+            )
+        order = rng.permutation(len(batches))
+        longest = int(np.argmax([self.lengths[batches[i]].max() for i in order])) if batches else 0
+        order[0], order[longest] = order[longest], order[0]
+        for i in order:
+            yield from batches[i].tolist()
+
+
+def files_signature(paths) -> str:
+    """Hash of the names, sizes and modification times of files, changes when any is rewritten."""
+    h = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        h.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def preprocess_cache_key(source_id: str, tokenizer, feature_extractor, max_length: int) -> str:
+    config = {
+        "source": source_id,
+        "image_processor": feature_extractor.to_dict(),
+        "tokenizer": {
+            "class": type(tokenizer).__name__,
+            "name_or_path": tokenizer.name_or_path,
+            "vocab_size": len(tokenizer),
+            "added_vocab": tokenizer.get_added_vocab(),
+            "pad_token_id": tokenizer.pad_token_id,
+        },
+        "max_length": max_length,
+    }
+    payload = json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+class PreprocessCache:
+    """Memory-mapped pixel_values/labels arrays produced once from an uncached dataset.
+
+    The cache lives in ``cache_dir/<key>``, where the key hashes the data source (file names,
+    sizes and modification times), the image processor config and the tokenizer config, so
+    any change to them builds a new cache. ``float16`` halves the size of ``pixel_values``.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.pixel_values = np.load(self.path / "pixel_values.npy", mmap_mode="r")
+        self.labels = np.load(self.path / "labels.npy", mmap_mode="r")
+        # Кэши, собранные до появления lengths.npy, досчитываем по labels
+        if (self.path / "lengths.npy").exists():
+            self.lengths = np.load(self.path / "lengths.npy")
+        else:
+            self.lengths = label_lengths(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return {
+            "pixel_values": torch.from_numpy(np.array(self.pixel_values[idx], dtype=np.float32)),
+            "labels": torch.from_numpy(np.array(self.labels[idx])),
+        }
+
+    @classmethod
+    def load_or_build(
+        cls, dataset, cache_dir: Path, dtype: str = "float32"
+    ) -> Optional["PreprocessCache"]:
+        """Opens the cache of a dataset, building it first if needed; None for an empty dataset."""
+        if len(dataset) == 0:
+            return None
+        key = preprocess_cache_key(
+            dataset.source_id(), dataset.tokenizer, dataset.feature_extractor, dataset.max_length
+        )
+        # dtype в имени папки: кэши float32 и float16 одного датасета не затирают друг друга
+        path = Path(cache_dir) / f"{key}-{np.dtype(dtype).name}"
+        if not (path / "manifest.json").exists():
+            cls.build(dataset, path, key, dtype)
+        return cls(path)
+
+    @staticmethod
+    def build(dataset, path: Path, key: str, dtype: str = "float32") -> None:
+        if len(dataset) == 0:
+            raise ValueError("Cannot build a preprocess cache for an empty dataset")
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        first = dataset.encode_item(0)
+        pixel_values = np.lib.format.open_memmap(
+            tmp_path / "pixel_values.npy",
+            mode="w+",
+            dtype=dtype,
+            shape=(len(dataset), *first["pixel_values"].shape),
+        )
+        labels = np.lib.format.open_memmap(
+            tmp_path / "labels.npy",
+            mode="w+",
+            dtype=np.int64,
+            shape=(len(dataset), dataset.max_length),
+        )
+        for idx in tqdm(range(len(dataset)), desc=f"preprocess cache {key}"):
+            item = first if idx == 0 else dataset.encode_item(idx)
+            pixel_values[idx] = item["pixel_values"].numpy()
+            labels[idx] = item["labels"].numpy()
+        pixel_values.flush()
+        labels.flush()
+        np.save(tmp_path / "lengths.npy", label_lengths(labels))
+        del pixel_values, labels
+        with open(tmp_path / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump({"key": key, "size": len(dataset), "dtype": dtype}, f, indent=2)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+
+# --- Датасет для локальных файлов ---
+class MyDataset(Dataset):
+    def __init__(self, img_dir, text_dir, tokenizer, feature_extractor, max_length=296, cache_dir=None,
+                 cache_dtype="float32"):
+        self.img_dir = img_dir
+        self.text_dir = text_dir
+        self.tokenizer = tokenizer
+        self.feature_extractor = feature_extractor
+        self.max_length = max_length
+        # .webp пишет tex2png с профилем рендера --image-format webp
+        self.img_files = sorted([f for f in os.listdir(img_dir) if f.endswith(('.png', '.webp'))])
+        self._target_lengths = None
+        # Кэш: __getitem__ только читает срезы готовых массивов
+        self.cache = PreprocessCache.load_or_build(self, cache_dir, cache_dtype) if cache_dir else None
+
+    def __len__(self):
+        return len(self.img_files)
+
+    def _text_path(self, idx):
+        return os.path.join(self.text_dir, os.path.splitext(self.img_files[idx])[0] + '.txt')
+
+    def source_id(self):
+        # Размер и mtime каждого файла: перегенерированные данные с теми же именами дают новый кэш
+        paths = []
+        for idx, img_name in enumerate(self.img_files):
+            paths.append(os.path.join(self.img_dir, img_name))
+            paths.append(self._text_path(idx))
+        return f"{os.path.abspath(self.img_dir)}:{os.path.abspath(self.text_dir)}:{files_signature(paths)}"
+
+    def encode_item(self, idx):
+        img_name = self.img_files[idx]
+        img_path = os.path.join(self.img_dir, img_name)
+
+        image = Image.open(img_path).convert("RGB")
+        target_text = self.target_text(idx)
+
+        return encode_sample(image, target_text, self.tokenizer, self.feature_extractor, self.max_length)
+
+    def target_text(self, idx):
+        with open(self._text_path(idx), 'r', encoding='utf-8') as f:
+            return f.read().strip()
+
+    def target_lengths(self):
+        """Target token lengths for LengthGroupedSampler, without decoding the images."""
+        if self.cache is not None:
+            return self.cache.lengths
+        if self._target_lengths is None:
+            texts = [self.target_text(idx) for idx in range(len(self))]
+            self._target_lengths = target_lengths(texts, self.tokenizer, self.max_length)
+        return self._target_lengths
+
+    def __getitem__(self, idx):
+        if self.cache is not None:
+            return self.cache[idx]
+        return self.encode_item(idx)
+
+
+# --- Датасет поверх шардов из to_latex_converter/shards.py ---
+class ShardDataset(Dataset):
+    def __init__(self, shard_dir: Path, tokenizer, feature_extractor, max_length=296, cache_dir=None,
+                 cache_dtype="float32"):
+        self.shard_dir = Path(shard_dir)
+        self.reader = ShardReader(shard_dir)
+        self.tokenizer = tokenizer
+        self.feature_extractor = feature_extractor
+        self.max_length = max_length
+        self._target_lengths = None
+        self.cache = PreprocessCache.load_or_build(self, cache_dir, cache_dtype) if cache_dir else None
+
+    def __len__(self):
+        return len(self.reader)
+
+    def source_id(self):
+        # index.json хранит только имена и размеры шардов, поэтому добавляем mtime самих файлов
+        paths = [self.shard_dir / INDEX_FILE]
+        for shard in self.reader.shards:
+            paths.append(self.shard_dir / shard["file"])
+            paths.append(self.shard_dir / shard["index"])
+        return f"{self.shard_dir.resolve()}:{files_signature(paths)}"
+
+    def encode_item(self, idx):
+        sample = self.reader[idx]
+        image = Image.open(io.BytesIO(sample["image"])).convert("RGB")
+        return encode_sample(image, sample["text"], self.tokenizer, self.feature_extractor, self.max_length)
+
+    def target_lengths(self):
+        """Target token lengths for LengthGroupedSampler, without decoding the images."""
+        if self.cache is not None:
+            return self.cache.lengths
+        if self._target_lengths is None:
+            texts = [sample["text"] for sample in self.reader]
+            self._target_lengths = target_lengths(texts, self.tokenizer, self.max_length)
+        return self._target_lengths
+
+    def __getitem__(self, idx):
+        if self.cache is not None:
+            return self.cache[idx]
+        return self.encode_item(idx)
@@ -0,0 +1,186 @@
+import argparse
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image
+
+from to_latex_converter.utils import init_basic_logger
+
+# Куда train.py сохраняет дообученную модель вместе с токенизатором и процессором
+DEFAULT_MODEL_DIR = Path("results/model")
+ONNX_FILES = ("encoder_model.onnx", "decoder_model.onnx", "decoder_with_past_model.onnx")
+
+
+def export_onnx(model_dir: Path, output_dir: Path, quantize: bool = False) -> Path:
+    """Exports a saved VisionEncoderDecoderModel to ONNX with a decoder KV cache.
+
+    The encoder, the first decoder step and the decoder step with past key values become
+    separate graphs; the tokenizer and the image processor are copied next to them. With
+    ``quantize`` the graphs are additionally quantized to int8 (dynamic, per-tensor) into
+    ``<output_dir>-int8``, which is the directory returned then.
+    """
+    from optimum.onnxruntime import ORTModelForVision2Seq
+    from transformers import AutoImageProcessor, AutoTokenizer
+
+    logger = init_basic_logger("inference")
+    output_dir = Path(output_dir)
+    model = ORTModelForVision2Seq.from_pretrained(model_dir, export=True, use_cache=True)
+    model.save_pretrained(output_dir)
+    AutoTokenizer.from_pretrained(model_dir).save_pretrained(output_dir)
+    AutoImageProcessor.from_pretrained(model_dir).save_pretrained(output_dir)
+    logger.info(f"Exported {model_dir} to {output_dir}")
+    if not quantize:
+        return output_dir
+    return quantize_onnx(output_dir, output_dir.with_name(output_dir.name + "-int8"))
+
+
+def quantize_onnx(onnx_dir: Path, output_dir: Path) -> Path:
+    """Quantizes the exported graphs of ``onnx_dir`` to int8 weights with dynamic activations."""
+    import shutil
+
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    onnx_dir, output_dir = Path(onnx_dir), Path(output_dir)
+    # avx2 — самый переносимый из x86-профилей, на arm64 нужен свой
+    config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    for file_name in ONNX_FILES:
+        if not (onnx_dir / file_name).exists():
+            continue
+        quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name=file_name)
+        quantizer.quantize(save_dir=output_dir, quantization_config=config)
+        # ORTQuantizer дописывает суффикс, а ORTModel ищет исходные имена
+        quantized = output_dir / file_name.replace(".onnx", "_quantized.onnx")
+        quantized.replace(output_dir / file_name)
+    for path in onnx_dir.iterdir():
+        if path.is_file() and path.suffix != ".onnx" and not (output_dir / path.name).exists():
+            shutil.copy2(path, output_dir / path.name)
+    init_basic_logger("inference").info(f"Quantized {onnx_dir} to {output_dir}")
+    return output_dir
+
+
+class OCRInference:
+    """Batched image -> LaTeX recognition with a PyTorch or an exported ONNX model.
+
+    ``backend="torch"`` loads a directory saved by ``train.py``; ``backend="onnx"`` loads one
+    written by ``export_onnx`` and runs it with onnxruntime on CPU.
+    """
+
+    def __init__(self, model_dir: Path, backend: str = "torch", threads: Optional[int] = None):
+        from transformers import AutoImageProcessor, AutoTokenizer
+
+        self.backend = backend
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.processor = AutoImageProcessor.from_pretrained(model_dir)
+        if backend == "torch":
+            import torch
+            from transformers import VisionEncoderDecoderModel
+
+            if threads:
+                torch.set_num_threads(threads)
+            self.model = VisionEncoderDecoderModel.from_pretrained(model_dir).eval()
+        elif backend == "onnx":
+            import onnxruntime
+            from optimum.onnxruntime import ORTModelForVision2Seq
+
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            self.model = ORTModelForVision2Seq.from_pretrained(
+                model_dir, use_cache=True, session_options=options, provider="CPUExecutionProvider"
+            )
+        else:
+            raise ValueError(f"Unknown backend {backend!r}")
+
+    def _generate(self, pixel_values, **kwargs):
+        if self.backend == "torch":
+            import torch
+
+            with torch.inference_mode():
+                return self.model.generate(pixel_values=pixel_values, **kwargs)
+        return self.model.generate(pixel_values=pixel_values, **kwargs)
+
+    def recognize(
+        self,
+        images: List[Image.Image],
+        batch_size: int = 8,
+        num_beams: int = 1,
+        max_new_tokens: int = 296,
+        **generate_kwargs,
+    ) -> List[str]:
+        """Greedy (``num_beams=1``) or beam-search decoding of ``images`` in batches."""
+        texts = []
+        for start in range(0, len(images), batch_size):
+            batch = [image.convert("RGB") for image in images[start : start + batch_size]]
+            pixel_values = self.processor(batch, return_tensors="pt").pixel_values
+            output_ids = self._generate(
+                pixel_values,
+                num_beams=num_beams,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                **generate_kwargs,
+            )
+            texts.extend(self.tokenizer.batch_decode(output_ids, skip_special_tokens=True))
+        return texts
+
+
+def benchmark(
+    engine: OCRInference,
+    images: List[Image.Image],
+    batch_size: int = 8,
+    num_beams: int = 1,
+    max_new_tokens: int = 296,
+    warmup: int = 1,
+    **generate_kwargs,
+) -> dict:
+    """Throughput in images/s and per-batch latency percentiles of ``engine.recognize``."""
+    for _ in range(warmup):
+        engine.recognize(images[:batch_size], batch_size, num_beams, max_new_tokens, **generate_kwargs)
+    latencies = []
+    start = time.perf_counter()
+    for offset in range(0, len(images), batch_size):
+        batch = images[offset : offset + batch_size]
+        batch_start = time.perf_counter()
+        engine.recognize(batch, batch_size, num_beams, max_new_tokens, **generate_kwargs)
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    return {
+        "images_per_s": len(images) / elapsed,
+        "latency_p50_ms": float(p50) * 1000,
+        "latency_p90_ms": float(p90) * 1000,
+        "latency_p99_ms": float(p99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and run the image -> LaTeX model")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export", help="export a trained model to ONNX")
+    export.add_argument("--model-dir", type=Path, default=DEFAULT_MODEL_DIR)
+    export.add_argument("--output-dir", type=Path, default=Path("results/onnx"))
+    export.add_argument("--quantize", action="store_true", help="also write an int8 copy")
+    predict = subparsers.add_parser("predict", help="recognize images")
+    predict.add_argument("images", type=Path, nargs="+")
+    predict.add_argument("--model-dir", type=Path, default=DEFAULT_MODEL_DIR)
+    predict.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    predict.add_argument("--batch-size", type=int, default=8)
+    predict.add_argument("--num-beams", type=int, default=1)
+    predict.add_argument("--max-new-tokens", type=int, default=296)
+    predict.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model_dir, args.output_dir, args.quantize)
+        return
+    engine = OCRInference(args.model_dir, args.backend, args.threads)
+    images = [Image.open(path) for path in args.images]
+    texts = engine.recognize(images, args.batch_size, args.num_beams, args.max_new_tokens)
+    for path, text in zip(args.images, texts):
+        print(f"{path}\t{text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+from to_latex_converter.utils import init_basic_logger
+
+PREFIX = "to_latex_converter"
+# Границы корзин гистограмм времени, секунды
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Thread-safe counters, gauges, timing histograms and the slowest items of the pipeline.
+
+    ``METRICS`` is the process-wide instance the tools record into. Worker processes send
+    ``snapshot()`` back and the parent ``merge()``s it. ``export`` writes a JSON snapshot, or a
+    Prometheus textfile if the path ends with ``.prom``.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, slowest: int = 20):
+        self.buckets = tuple(buckets)
+        self.max_slowest = slowest
+        self.logger = init_basic_logger(PREFIX + ".metrics")
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._histograms = {}
+            self._slowest = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Sets a gauge: a current value such as a queue depth."""
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, item: Optional[str] = None, **labels) -> None:
+        """Adds a duration to a histogram; ``item`` also competes for the slowest list."""
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {
+                    "counts": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            i = 0
+            while i < len(self.buckets) and seconds > self.buckets[i]:
+                i += 1
+            hist["counts"][i] += 1
+            hist["sum"] += seconds
+            hist["count"] += 1
+            if item is not None:
+                slowest = self._slowest.setdefault(name, [])
+                entry = (seconds, item)
+                if len(slowest) < self.max_slowest:
+                    heapq.heappush(slowest, entry)
+                elif entry > slowest[0]:
+                    heapq.heapreplace(slowest, entry)
+
+    @contextmanager
+    def timer(self, name: str, item: Optional[str] = None, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, item, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "gauges": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._gauges.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **hist,
+                     "counts": list(hist["counts"])}
+                    for (name, labels), hist in sorted(self._histograms.items())
+                ],
+                "slowest": {
+                    name: [{"seconds": s, "item": item} for s, item in sorted(entries, reverse=True)]
+                    for name, entries in sorted(self._slowest.items())
+                },
+            }
+
+    def merge(self, snapshot: dict) -> None:
+        for counter in snapshot["counters"]:
+            self.inc(counter["name"], counter["value"], **counter["labels"])
+        with self._lock:
+            for gauge in snapshot["gauges"]:
+                self._gauges[_key(gauge["name"], gauge["labels"])] = gauge["value"]
+            for hist in snapshot["histograms"]:
+                key = _key(hist["name"], hist["labels"])
+                own = self._histograms.setdefault(
+                    key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                )
+                own["counts"] = [a + b for a, b in zip(own["counts"], hist["counts"])]
+                own["sum"] += hist["sum"]
+                own["count"] += hist["count"]
+            for name, entries in snapshot["slowest"].items():
+                slowest = self._slowest.setdefault(name, [])
+                for entry in entries:
+                    heapq.heappush(slowest, (entry["seconds"], entry["item"]))
+                    if len(slowest) > self.max_slowest:
+                        heapq.heappop(slowest)
+
+    def to_prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+
+        def labels_str(labels: dict, extra: Optional[dict] = None) -> str:
+            items = {**labels, **(extra or {})}
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items.items()) + "}"
+
+        for counter in snapshot["counters"]:
+            name = f"{PREFIX}_{counter['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{labels_str(counter['labels'])} {counter['value']}")
+        for gauge in snapshot["gauges"]:
+            name = f"{PREFIX}_{gauge['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{labels_str(gauge['labels'])} {gauge['value']}")
+        for hist in snapshot["histograms"]:
+            name = f"{PREFIX}_{hist['name']}"
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for le, count in zip(list(self.buckets) + ["+Inf"], hist["counts"]):
+                cumulative += count
+                lines.append(
+                    f"{name}_bucket{labels_str(hist['labels'], {'le': le})} {cumulative}"
+                )
+            lines.append(f"{name}_sum{labels_str(hist['labels'])} {hist['sum']}")
+            lines.append(f"{name}_count{labels_str(hist['labels'])} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path) -> None:
+        """Atomically writes the snapshot: Prometheus textfile for ``.prom``, JSON otherwise."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if path.suffix == ".prom":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def log_summary(self) -> None:
+        snapshot = self.snapshot()
+        for counter in snapshot["counters"]:
+            self.logger.info(f"{counter['name']} {counter['labels']}: {counter['value']}")
+        for gauge in snapshot["gauges"]:
+            self.logger.info(f"{gauge['name']} {gauge['labels']}: {gauge['value']}")
+        for hist in snapshot["histograms"]:
+            mean = hist["sum"] / hist["count"] if hist["count"] else 0.0
+            self.logger.info(
+                f"{hist['name']} {hist['labels']}: n={hist['count']} "
+                f"total={hist['sum']:.2f}s mean={mean:.3f}s"
+            )
+        for name, entries in snapshot["slowest"].items():
+            if entries:
+                top = ", ".join(f"{e['item']} {e['seconds']:.2f}s" for e in entries[:5])
+                self.logger.info(f"slowest {name}: {top}")
+
+
+METRICS = Metrics()
@@ -0,0 +1,152 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from to_latex_converter.utils import init_basic_logger, load_config
+
+MANIFEST_FILE = "manifest.json"
+DEFAULT_BASE_MODEL = "MixTex/ZhEn-Latex-OCR"
+# Русские буквы, которых нет в словаре MixTex
+RUSSIAN_CHARS = (
+    [chr(code) for code in range(ord("а"), ord("я") + 1)]
+    + [chr(code) for code in range(ord("А"), ord("Я") + 1)]
+    + ["ё", "Ё"]
+)
+
+
+def _file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def prepare_artifact(
+    base_model: str = DEFAULT_BASE_MODEL,
+    output_dir: Path = Path("artifacts/model"),
+    extra_tokens: Optional[List[str]] = None,
+    force: bool = False,
+) -> dict:
+    """Saves the image processor, the extended tokenizer and the resized model in one folder.
+
+    Everything ``train.py`` used to do on every start happens here once: the base model is
+    loaded, missing tokens are added to the tokenizer and the decoder embeddings are resized.
+    ``manifest.json`` is written last, so a folder with a manifest is always complete. An
+    artifact already prepared from the same model and tokens is kept unless ``force``.
+    """
+    logger = init_basic_logger("prepare")
+    extra_tokens = RUSSIAN_CHARS if extra_tokens is None else extra_tokens
+    output_dir = Path(output_dir)
+    if not force and (output_dir / MANIFEST_FILE).exists():
+        manifest = read_manifest(output_dir)
+        if manifest["base_model"] == base_model and manifest["extra_tokens"] == extra_tokens:
+            logger.info(f"{output_dir} is up to date")
+            return manifest
+
+    from transformers import AutoImageProcessor, AutoTokenizer, VisionEncoderDecoderModel
+
+    start = time.perf_counter()
+    processor = AutoImageProcessor.from_pretrained(base_model)
+    tokenizer = AutoTokenizer.from_pretrained(base_model)
+    model = VisionEncoderDecoderModel.from_pretrained(base_model)
+
+    # Один проход по словарю вместо convert_tokens_to_ids на каждый символ
+    vocab = tokenizer.get_vocab()
+    added_tokens = [token for token in extra_tokens if token not in vocab]
+    if added_tokens:
+        tokenizer.add_tokens(added_tokens)
+        model.decoder.resize_token_embeddings(len(tokenizer))
+    logger.info(f"Added {len(added_tokens)} tokens to {base_model}")
+
+    manifest_path = output_dir / MANIFEST_FILE
+    manifest_path.unlink(missing_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    processor.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    model.save_pretrained(output_dir)
+
+    import transformers
+
+    manifest = {
+        "base_model": base_model,
+        "base_revision": getattr(model.config, "_commit_hash", None),
+        "extra_tokens": extra_tokens,
+        "added_tokens": added_tokens,
+        "vocab_size": len(tokenizer),
+        "transformers_version": transformers.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": {
+            path.name: _file_digest(path)
+            for path in sorted(output_dir.iterdir())
+            if path.is_file() and path.name != MANIFEST_FILE
+        },
+    }
+    tmp_path = manifest_path.with_name(MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+    logger.info(f"Prepared {output_dir} in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+
+def read_manifest(artifact_dir: Path, base_model: Optional[str] = None) -> dict:
+    """Reads the manifest of a prepared artifact; fails if it is missing or for another model."""
+    manifest_path = Path(artifact_dir) / MANIFEST_FILE
+    if not manifest_path.exists():
+        raise FileNotFoundError(
+            f"{artifact_dir} is not a prepared artifact, run `make prepare` "
+            f"(python -m to_latex_converter.prepare) first"
+        )
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if base_model is not None and manifest["base_model"] != base_model:
+        raise ValueError(
+            f"{artifact_dir} was prepared from {manifest['base_model']}, not {base_model}; "
+            f"run prepare again"
+        )
+    return manifest
+
+
+def load_tokenizer_and_processor(artifact_dir: Path) -> tuple:
+    """Loads the tokenizer and the image processor of an artifact from local files only."""
+    from transformers import AutoImageProcessor, AutoTokenizer
+
+    manifest = read_manifest(artifact_dir)
+    tokenizer = AutoTokenizer.from_pretrained(artifact_dir, local_files_only=True)
+    if len(tokenizer) != manifest["vocab_size"]:
+        raise ValueError(
+            f"Tokenizer in {artifact_dir} has {len(tokenizer)} tokens, the manifest says "
+            f"{manifest['vocab_size']}; run prepare again"
+        )
+    processor = AutoImageProcessor.from_pretrained(artifact_dir, local_files_only=True)
+    return tokenizer, processor
+
+
+def load_model(artifact_dir: Path):
+    from transformers import VisionEncoderDecoderModel
+
+    return VisionEncoderDecoderModel.from_pretrained(artifact_dir, local_files_only=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare the model artifact used by train.py")
+    parser.add_argument("--config", type=Path, default=Path("configs/train.yaml"))
+    parser.add_argument("--base-model", default=None, help="overrides train.base_model")
+    parser.add_argument("--output-dir", type=Path, default=None, help="overrides train.artifact")
+    parser.add_argument("--force", action="store_true", help="prepare again even if up to date")
+    args = parser.parse_args()
+    config = load_config(args.config).train
+    prepare_artifact(
+        args.base_model or config.base_model,
+        args.output_dir or Path(config.artifact),
+        force=args.force,
+    )
+
+
+if __name__ == "__main__":
+    main()
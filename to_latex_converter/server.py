@@ -0,0 +1,302 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+from PIL import Image
+
+from to_latex_converter.inference import DEFAULT_MODEL_DIR, OCRInference
+from to_latex_converter.metrics import METRICS, Metrics
+from to_latex_converter.utils import init_basic_logger
+
+
+class LRUCache:
+    """Recognized texts keyed by the SHA-256 of the image bytes, least recently used evicted."""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[str]:
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key: str, value: str) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class MicroBatcher:
+    """Collects concurrent recognition requests into micro-batches for one model.
+
+    A batch is sent to the model when it has ``max_batch_size`` images or ``max_wait_ms``
+    after its first request arrived, whichever comes first. The model runs in a single
+    worker thread, so the event loop keeps accepting requests during ``generate``. Results
+    are cached by image hash; identical images requested concurrently share one slot.
+    """
+
+    def __init__(
+        self,
+        engine: OCRInference,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10.0,
+        cache_size: int = 4096,
+        metrics: Metrics = METRICS,
+        **generate_kwargs,
+    ):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache = LRUCache(cache_size)
+        self.metrics = metrics
+        self.generate_kwargs = generate_kwargs
+        self._queue = None
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self._task = None
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def recognize(self, image_bytes: bytes) -> str:
+        key = hashlib.sha256(image_bytes).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics.inc("server_requests_total", cache="hit")
+            return cached
+        if key in self._inflight:
+            self.metrics.inc("server_requests_total", cache="inflight")
+            return await asyncio.shield(self._inflight[key])
+        self.metrics.inc("server_requests_total", cache="miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        await self._queue.put((key, image_bytes, future, time.perf_counter()))
+        self.metrics.set("server_queue_depth", self._queue.qsize())
+        return await asyncio.shield(future)
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _recognize_batch(self, payloads: List[bytes]) -> list:
+        # Битое изображение не должно валить остальную пачку
+        results = [None] * len(payloads)
+        images, positions = [], []
+        for i, payload in enumerate(payloads):
+            try:
+                images.append(Image.open(io.BytesIO(payload)).convert("RGB"))
+                positions.append(i)
+            except Exception as e:
+                results[i] = e
+        if images:
+            texts = self.engine.recognize(
+                images, batch_size=len(images), **self.generate_kwargs
+            )
+            for i, text in zip(positions, texts):
+                results[i] = text
+        return results
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            self.metrics.set("server_queue_depth", self._queue.qsize())
+            self.metrics.set("server_batch_size", len(batch))
+            self.metrics.inc("server_batches_total")
+            self.metrics.inc("server_batch_images_total", len(batch))
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._recognize_batch, [payload for _, payload, _, _ in batch]
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+            self.metrics.observe("server_batch_seconds", time.perf_counter() - start)
+            for (key, _, future, queued), result in zip(batch, results):
+                self._inflight.pop(key, None)
+                if isinstance(result, Exception):
+                    self.metrics.inc("server_errors_total")
+                    if not future.done():
+                        future.set_exception(result)
+                    continue
+                self.cache.put(key, result)
+                self.metrics.observe("server_request_seconds", time.perf_counter() - queued)
+                if not future.done():
+                    future.set_result(result)
+
+
+class InferenceServer:
+    """Minimal HTTP/1.1 front end of a MicroBatcher on asyncio streams.
+
+    ``POST /recognize`` takes the image bytes as the body and answers ``{"text": ...}``;
+    ``GET /metrics`` returns the Prometheus text format, ``GET /health`` returns ``ok``.
+    Bodies larger than ``max_body_bytes`` are rejected with 413 before they are read.
+    """
+
+    def __init__(
+        self,
+        batcher: MicroBatcher,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        max_body_bytes: int = 16 << 20,
+    ):
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self.logger = init_basic_logger("server")
+        self._server = None
+
+    async def start(self) -> None:
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.logger.info(f"Listening on http://{self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _respond(self, method: str, path: str, body: bytes) -> tuple:
+        if method == "GET" and path == "/health":
+            return 200, "text/plain", b"ok"
+        if method == "GET" and path == "/metrics":
+            return 200, "text/plain; version=0.0.4", self.batcher.metrics.to_prometheus().encode()
+        if method == "POST" and path == "/recognize":
+            try:
+                text = await self.batcher.recognize(body)
+            except Exception as e:
+                payload = json.dumps({"error": str(e)}).encode()
+                return 400, "application/json", payload
+            return 200, "application/json", json.dumps({"text": text}, ensure_ascii=False).encode()
+        return 404, "text/plain", b"not found"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # keep-alive: читаем запросы, пока клиент не закроет соединение
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if not 0 <= length <= self.max_body_bytes:
+                    # Тело не читаем: клиент не должен заставить сервер выделить сколько угодно памяти
+                    status, content_type, payload = 413, "text/plain", b"request body too large"
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    status, content_type, payload = await self._respond(method, path, body)
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve image -> LaTeX recognition over HTTP")
+    parser.add_argument("--model-dir", type=Path, default=DEFAULT_MODEL_DIR)
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument(
+        "--random-model",
+        action="store_true",
+        help="development only: serve a tiny random model (its output is noise), no download needed",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--cache-size", type=int, default=4096)
+    parser.add_argument("--max-body-mb", type=float, default=16.0)
+    parser.add_argument("--num-beams", type=int, default=1)
+    parser.add_argument("--max-new-tokens", type=int, default=296)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = args.model_dir
+        if args.random_model:
+            from to_latex_converter.testing import save_random_model
+
+            logger = init_basic_logger("server")
+            logger.warning("Serving a random model: for development only, its predictions are noise")
+            model_dir = save_random_model(Path(tmp) / "model")
+        engine = OCRInference(model_dir, args.backend, args.threads)
+        batcher = MicroBatcher(
+            engine,
+            args.max_batch_size,
+            args.max_wait_ms,
+            args.cache_size,
+            num_beams=args.num_beams,
+            max_new_tokens=args.max_new_tokens,
+        )
+        server = InferenceServer(batcher, args.host, args.port, int(args.max_body_mb * (1 << 20)))
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import bisect
+import io
+import json
+import mmap
+import os
+import tarfile
+from pathlib import Path
+from typing import Iterator, Optional
+
+INDEX_FILE = "index.json"
+
+
+class ShardWriter:
+    """Packs (image bytes, target text, metadata) samples into uncompressed tar shards.
+
+    Every shard ``shard-XXXXX.tar`` gets an offset index ``shard-XXXXX.idx.json`` so that
+    members can be sliced straight out of a memory map; ``index.json`` lists the shards.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        samples_per_shard: int = 10000,
+        max_shard_bytes: int = 1 << 30,
+    ):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.samples_per_shard = samples_per_shard
+        self.max_shard_bytes = max_shard_bytes
+        self.shards = []
+        self._tar = None
+        self._entries = []
+
+    def _open_shard(self) -> None:
+        name = f"shard-{len(self.shards):05d}.tar"
+        self._tar = tarfile.open(self.out_dir / name, "w", format=tarfile.GNU_FORMAT)
+        self._entries = []
+        self.shards.append({"file": name, "index": name.replace(".tar", ".idx.json"), "size": 0})
+
+    def _close_shard(self) -> None:
+        if self._tar is None:
+            return
+        self._tar.close()
+        shard = self.shards[-1]
+        shard["size"] = len(self._entries)
+        with open(self.out_dir / shard["index"], "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        self._tar = None
+
+    def _add_member(self, name: str, data: bytes) -> list:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        header = info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors)
+        offset = self._tar.offset + len(header)
+        self._tar.addfile(info, io.BytesIO(data))
+        return [offset, len(data)]
+
+    def write(self, key: str, image: bytes, text: str, meta: Optional[dict] = None) -> None:
+        if (
+            self._tar is None
+            or len(self._entries) >= self.samples_per_shard
+            or self._tar.offset >= self.max_shard_bytes
+        ):
+            self._close_shard()
+            self._open_shard()
+        meta = dict(meta or {})
+        ext = meta.get("image_ext", "png")
+        self._entries.append(
+            {
+                "key": key,
+                "image": self._add_member(f"{key}.{ext}", image),
+                "text": self._add_member(f"{key}.txt", text.encode("utf-8")),
+                "meta": self._add_member(f"{key}.json", json.dumps(meta).encode("utf-8")),
+            }
+        )
+
+    def close(self) -> None:
+        self._close_shard()
+        with open(self.out_dir / INDEX_FILE, "w", encoding="utf-8") as f:
+            json.dump({"shards": self.shards}, f, indent=2)
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ShardReader:
+    """Random access and streaming over shards written by ShardWriter via mmap.
+
+    Memory maps are opened lazily and per process, so the reader can be shared with
+    DataLoader workers.
+    """
+
+    def __init__(self, shard_dir: Path):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / INDEX_FILE, "r", encoding="utf-8") as f:
+            self.shards = json.load(f)["shards"]
+        self._offsets = []
+        total = 0
+        for shard in self.shards:
+            self._offsets.append(total)
+            total += shard["size"]
+        self._len = total
+        self._entries = {}
+        self._maps = {}
+        self._pid = None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getstate__(self) -> dict:
+        # mmap не сериализуется: при spawn воркеры DataLoader откроют шарды заново
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        state["_pid"] = None
+        return state
+
+    def _shard(self, shard_idx: int):
+        if self._pid != os.getpid():
+            # После fork отображения родителя не используем
+            self._maps = {}
+            self._pid = os.getpid()
+        if shard_idx not in self._maps:
+            shard = self.shards[shard_idx]
+            with open(self.shard_dir / shard["file"], "rb") as f:
+                self._maps[shard_idx] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if shard_idx not in self._entries:
+                with open(self.shard_dir / shard["index"], "r", encoding="utf-8") as f:
+                    self._entries[shard_idx] = json.load(f)
+        return self._maps[shard_idx], self._entries[shard_idx]
+
+    def __getitem__(self, idx: int) -> dict:
+        if idx < 0:
+            idx += self._len
+        if not 0 <= idx < self._len:
+            raise IndexError(idx)
+        shard_idx = bisect.bisect_right(self._offsets, idx) - 1
+        data, entries = self._shard(shard_idx)
+        entry = entries[idx - self._offsets[shard_idx]]
+        return self._decode(data, entry)
+
+    @staticmethod
+    def _decode(data: mmap.mmap, entry: dict) -> dict:
+        def member(name):
+            offset, size = entry[name]
+            return data[offset : offset + size]
+
+        return {
+            "key": entry["key"],
+            "image": member("image"),
+            "text": member("text").decode("utf-8"),
+            "meta": json.loads(member("meta")),
+        }
+
+    def __iter__(self) -> Iterator[dict]:
+        for shard_idx in range(len(self.shards)):
+            data, entries = self._shard(shard_idx)
+            for entry in entries:
+                yield self._decode(data, entry)
+            # Прочитанный шард больше не держим
+            self._maps.pop(shard_idx).close()
+            self._entries.pop(shard_idx)
+
+
+def pack_dir(
+    img_dir: Path, text_dir: Path, out_dir: Path, samples_per_shard: int = 10000
+) -> int:
+    """Packs data/img/*.png + data/txt/*.txt pairs into shards, returns the sample count."""
+    count = 0
+    names = sorted(
+        entry.name for entry in os.scandir(img_dir) if entry.name.endswith((".png", ".webp"))
+    )
+    with ShardWriter(out_dir, samples_per_shard) as writer:
+        for name in names:
+            key, ext = os.path.splitext(name)
+            text_path = os.path.join(text_dir, key + ".txt")
+            if not os.path.exists(text_path):
+                continue
+            with open(os.path.join(img_dir, name), "rb") as f:
+                image = f.read()
+            with open(text_path, "r", encoding="utf-8") as f:
+                text = f.read().strip()
+            writer.write(key, image, text, {"source": name, "image_ext": ext[1:]})
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack image/text pairs into tar shards")
+    parser.add_argument("--img-dir", type=Path, default=Path("data/img"))
+    parser.add_argument("--text-dir", type=Path, default=Path("data/txt"))
+    parser.add_argument("--out-dir", type=Path, default=Path("data/shards"))
+    parser.add_argument("--samples-per-shard", type=int, default=10000)
+    args = parser.parse_args()
+    count = pack_dir(args.img_dir, args.text_dir, args.out_dir, args.samples_per_shard)
+    print(f"Packed {count} samples into {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
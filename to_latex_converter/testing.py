@@ -0,0 +1,60 @@
+# Фикстуры для тестов и бенчмарков: в обучении и инференсе не используются
+from pathlib import Path
+
+
+def save_random_model(output_dir: Path, image_size: int = 64, seed: int = 0) -> Path:
+    """Saves a tiny randomly initialized ViT + GPT-2 model with a char-level tokenizer.
+
+    It has the layout of a ``train.py`` result, so export, inference and serving can be
+    checked and benchmarked offline. Its output is noise: use it only in tests, benchmarks
+    and local development, never as a served model.
+    """
+    import string
+
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import (
+        GPT2Config,
+        PreTrainedTokenizerFast,
+        VisionEncoderDecoderConfig,
+        VisionEncoderDecoderModel,
+        ViTConfig,
+        ViTImageProcessor,
+    )
+
+    output_dir = Path(output_dir)
+    special = ["<pad>", "<s>", "</s>", "<unk>"]
+    chars = sorted(set(string.printable.strip()) | {chr(c) for c in range(ord("а"), ord("я") + 1)})
+    vocab = {token: i for i, token in enumerate(special + chars)}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend, pad_token="<pad>", bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+    encoder = ViTConfig(
+        image_size=image_size,
+        patch_size=16,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+    )
+    decoder = GPT2Config(
+        vocab_size=len(vocab),
+        n_positions=512,
+        n_embd=64,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        add_cross_attention=True,
+    )
+    config = VisionEncoderDecoderConfig.from_encoder_decoder_configs(encoder, decoder)
+    config.decoder_start_token_id = tokenizer.bos_token_id
+    config.eos_token_id = tokenizer.eos_token_id
+    config.pad_token_id = tokenizer.pad_token_id
+    torch.manual_seed(seed)
+    VisionEncoderDecoderModel(config).save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    ViTImageProcessor(size={"height": image_size, "width": image_size}).save_pretrained(output_dir)
+    return output_dir
@@ -1,10 +1,28 @@
+import io
 import re
+import math
+import codecs
 import random
 import string
+import hashlib
+import argparse
+import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-import jieba
 import os
 
+from to_latex_converter.metrics import METRICS
+from to_latex_converter.utils import init_basic_logger
+from to_latex_converter.tools.latex_template import wrap_document
+from to_latex_converter.tools.formula_index import as_formula_index, extract_latex_formulas, load_formula_index
+from to_latex_converter.tools.latex_validator import DEFAULT_TABLE, check_latex_math_commands, validate_latex
+
+# Размер блока (в байтах) для потокового чтения корпуса
+CHUNK_SIZE = 1 << 20
+
+logger = init_basic_logger('data_generator')
+
 # Function to remove non-English characters from a text file
 # Input:
 #   input_file_path (str): Path to the input text file
@@ -20,28 +38,6 @@ def remove_non_english_characters(input_file_path, output_file_path):
     with open(output_file_path, 'w', encoding='utf-8') as file:
         file.write(cleaned_content)
 
-# Function to extract LaTeX formulas from a .tex file
-# Input:
-#   tex_file_path (str): Path to the LaTeX (.tex) file
-# Output:
-#   formula_list (list): List of extracted LaTeX formulas
-def extract_latex_formulas(tex_file_path):
-    with open(tex_file_path, 'r', encoding='utf-8') as f:
-        tex_content = f.read()
-    pattern = r'\\\[(.+?)\\\]|\\begin\{align\*\}(.+?)\\end\{align\*\}'
-    formulas = re.findall(pattern, tex_content)
-    formula_list = [
-        re.sub(r'\\eqref\{(.*?)\}', r'', group).strip()
-        for tuples in formulas for group in tuples if group
-    ]
-    # Улучшенная фильтрация: удаляем формулы, которые содержат только спецсимволы, пробелы или пустые
-    bad_formulas = {'\\end{align*}', '\\begin{align*}', '', '\\[', '\\]'}
-    def is_bad_formula(f):
-        f_clean = f.replace('\n', '').replace('\r', '').replace(' ', '')
-        return f_clean in {s.replace(' ', '') for s in bad_formulas} or re.fullmatch(r'\\end\{.*?\}|\\begin\{.*?\}', f_clean)
-    formula_list = [f for f in formula_list if f and not is_bad_formula(f)]
-    return formula_list
-
 # Function to process text by inserting LaTeX formulas randomly
 # Input:
 #   input_file (str): Path to the input text file
@@ -73,6 +69,131 @@ def process_text(input_file, output_file, formulas):
             if len(output) > 300:
                 output = ''
 
+# Function to read a text file lazily in fixed-size chunks
+# Input:
+#   input_file (str): Path to the input text file
+#   chunk_size (int, optional): Number of bytes read at once
+#   start (int, optional): Byte offset to start reading from
+#   end (int, optional): Byte offset to stop at (end of file by default)
+# Output:
+#   generator of str chunks (memory is bounded by chunk_size)
+def iter_chunks(input_file, chunk_size=CHUNK_SIZE, start=0, end=None):
+    # Декодер сам склеивает UTF-8 символы и \r\n, разрезанные границей блока
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        remaining = None if end is None else end - start
+        while True:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            data = f.read(size) if size > 0 else b''
+            if remaining is not None:
+                remaining -= len(data)
+            chunk = decoder.decode(data, final=not data)
+            if chunk:
+                yield chunk
+            if not data:
+                break
+
+# Function to remove non-Russian characters from a stream of chunks
+# Input:
+#   chunks (iterable of str): Raw text chunks
+# Output:
+#   generator of cleaned chunks
+def clean_chunks(chunks):
+    # Регулярка работает посимвольно, поэтому границы блоков ей не мешают
+    russian_regex = re.compile(r'[^а-яА-ЯёЁ\s.,?!\'"()]+')
+    for chunk in chunks:
+        yield russian_regex.sub('', chunk)
+
+# Streaming version of remove_non_english_characters
+# Input:
+#   input_file_path (str): Path to the input text file
+#   output_file_path (str): Path to save the cleaned text file
+#   chunk_size (int, optional): Number of bytes read at once
+# Output:
+#   None (writes the cleaned content to output_file_path chunk by chunk)
+def remove_non_english_characters_stream(input_file_path, output_file_path, chunk_size=CHUNK_SIZE):
+    with open(output_file_path, 'w', encoding='utf-8') as file:
+        for chunk in clean_chunks(iter_chunks(input_file_path, chunk_size)):
+            file.write(chunk)
+
+# Function to split a stream of text chunks into sentences
+# Input:
+#   chunks (iterable of str): Text chunks
+# Output:
+#   generator of sentences (same split as process_text: newlines dropped, split on '.' and ',')
+def iter_sentences(chunks):
+    splitter = re.compile(r'[.,]')
+    tail = ''
+    for chunk in chunks:
+        parts = splitter.split(tail + chunk.replace('\n', ''))
+        # Последний кусок может продолжиться в следующем блоке
+        tail = parts.pop()
+        yield from parts
+    yield tail
+
+# Function to draw the distance (in characters) to the next formula insertion
+# Input:
+#   p (float): Per-character insertion probability
+#   rng (random.Random): Random generator
+# Output:
+#   skip (int): Number of characters until the next insertion, >= 1
+def geometric_skip(p, rng):
+    # Геометрическое распределение: одна случайная величина вместо монетки на каждый символ
+    return int(math.log(1.0 - rng.random()) / math.log(1.0 - p)) + 1
+
+# Function to insert LaTeX formulas into a stream of sentences
+# Input:
+#   sentences (iterable of str): Sentences without the trailing delimiter
+#   formulas (FormulaIndex or list): LaTeX formulas to insert
+#   p (float, optional): Per-character insertion probability
+#   rng (random.Random, optional): Random generator, the global one by default
+# Output:
+#   generator of output lines, each ending with '.\n'
+def insert_formulas(sentences, formulas, p=0.02, rng=None):
+    rng = rng or random
+    index = as_formula_index(formulas)
+    pieces = []
+    length = 0
+    skip = geometric_skip(p, rng)
+    for sentence in sentences:
+        pos = 0
+        while skip <= len(sentence) - pos:
+            pieces.append(sentence[pos:pos + skip])
+            length += skip
+            pos += skip
+            formula = index.sample('short', rng)
+            if formula is not None:
+                inserted = ' \\(' + formula + '\\) '
+                pieces.append(inserted)
+                length += len(inserted)
+            skip = geometric_skip(p, rng)
+        pieces.append(sentence[pos:])
+        length += len(sentence) - pos
+        skip -= len(sentence) - pos
+        if 30 < length < 300:
+            yield ''.join(pieces) + '.\n'
+            pieces = []
+            length = 0
+        if length > 300:
+            pieces = []
+            length = 0
+
+# Streaming version of process_text
+# Input:
+#   input_file (str): Path to the input text file
+#   output_file (str): Path to save the processed text file
+#   formulas (FormulaIndex or list): LaTeX formulas to insert
+#   chunk_size (int, optional): Number of bytes read at once
+#   rng (random.Random, optional): Random generator, the global one by default
+# Output:
+#   None (writes the processed content to output_file line by line)
+def process_text_stream(input_file, output_file, formulas, chunk_size=CHUNK_SIZE, rng=None):
+    sentences = iter_sentences(iter_chunks(input_file, chunk_size))
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for line in insert_formulas(sentences, formulas, rng=rng):
+            f.write(line)
+
 # Function to remove unwanted symbols from text
 # Input:
 #   text (str): The input text string
@@ -97,57 +218,115 @@ def remove_empty_brackets(text):
         text = re.sub(pat, '', text)
     return text
 
-# Function to format words with LaTeX commands and randomly insert formulas and numbers
+# Токены: слова, пробельные промежутки и отдельные знаки; склейка токенов даёт исходный текст
+_TOKEN_REGEX = re.compile(r'\w+|\s+|[^\w\s]')
+
+# Function to split Russian text into words, whitespace and punctuation
 # Input:
-#   words (list): List of words to format
-#   formulas (list): List of LaTeX formulas to insert
-#   lines (list): List of lines from the original text for random insertion
+#   text (str): The input text string
 # Output:
-#   output (str): The formatted LaTeX string
-def format_text_with_latex(words, formulas, lines):
-    output = ''
-    count = 0
-    # Объединяем слова в предложения
-    sentences = []
-    current_sentence = ''
+#   tokens (list): Tokens in the same format as jieba.lcut ('.', ',', '!' and '?' are separate tokens)
+def regex_tokenize(text):
+    return _TOKEN_REGEX.findall(text)
+
+# Function to tokenize text with jieba (imported only when this tokenizer is chosen)
+# Input:
+#   text (str): The input text string
+# Output:
+#   tokens (list): jieba.lcut result
+def jieba_tokenize(text):
+    import jieba
+    return jieba.lcut(text)
+
+TOKENIZERS = {'regex': regex_tokenize, 'jieba': jieba_tokenize}
+
+# Function to tokenize a stream of text chunks
+# Input:
+#   chunks (iterable of str): Text chunks
+#   tokenizer (str, optional): Name from TOKENIZERS
+# Output:
+#   generator of tokens; a token cut by a chunk boundary is joined with the next chunk
+def iter_tokens(chunks, tokenizer='regex'):
+    tokenize = TOKENIZERS[tokenizer]
+    tail = ''
+    for chunk in chunks:
+        tokens = tokenize(tail + chunk)
+        tail = tokens.pop() if tokens else ''
+        yield from tokens
+    if tail:
+        yield tail
+
+# Function to join word tokens into sentences
+# Input:
+#   words (iterable of str): Word tokens
+# Output:
+#   generator of sentences; a sentence ends with a '.', ',', '!' or '?' token
+def iter_word_sentences(words):
+    current_sentence = []
     for word in words:
-        current_sentence += word
+        current_sentence.append(word)
         if word in '.,!?':
-            sentences.append(current_sentence.strip())
-            current_sentence = ''
-    # Добавляем последнее предложение, если оно есть
+            yield ''.join(current_sentence).strip()
+            current_sentence = []
+    # Последнее предложение, если оно есть
     if current_sentence:
-        sentences.append(current_sentence.strip())
-    for sentence in tqdm(sentences):
-        count += 1
+        yield ''.join(current_sentence).strip()
+
+# Function to format sentences with LaTeX commands, one fragment per sentence
+# Input:
+#   sentences (iterable of str): Sentences from iter_word_sentences
+#   formulas (FormulaIndex or list): LaTeX formulas to insert
+#   lines (list): List of lines from the original text for random insertion
+#   rng (random.Random, optional): Random generator, the global one by default
+# Output:
+#   generator of LaTeX fragments; their concatenation is the formatted document
+def iter_latex_fragments(sentences, formulas, lines, rng=None):
+    rng = rng or random
+    index = as_formula_index(formulas)
+    for count, sentence in enumerate(sentences, 1):
+        output = []
         words_in_sentence = sentence.split()
         formula_inserted = False
-        if len(words_in_sentence) > 1 and random.random() < 0.9:
-            insert_pos = random.randint(1, len(words_in_sentence)-1)
+        if len(words_in_sentence) > 1 and rng.random() < 0.9:
+            insert_pos = rng.randint(1, len(words_in_sentence)-1)
             for i, word in enumerate(words_in_sentence):
-                output += word + ' '
+                output.append(word + ' ')
                 if i == insert_pos and not formula_inserted:
-                    if random.random() < 0.2:
-                        formula = random.sample(formulas, 1)[0]
-                        if len(formula) > 30 and formula.strip() and '\\' in formula:
-                            output += '\n \\begin{align*} \n' + formula + '\n \\end{align*} \n'
+                    # Формулу берём сразу из подходящей корзины индекса, без отбраковки
+                    if rng.random() < 0.2:
+                        formula = index.sample('display', rng)
+                        if formula is not None:
+                            output.append('\n \\begin{align*} \n' + formula + '\n \\end{align*} \n')
                             formula_inserted = True
                     else:
-                        formula = random.sample(formulas, 1)[0]
-                        if len(formula) < 30 and formula.strip() and '\\' not in formula:
-                            output += ' \\( ' + re.sub(r'\\tag\{.*?\}', '', formula) + ' \\) '
+                        formula = index.sample('inline', rng)
+                        if formula is not None:
+                            output.append(' \\( ' + formula + ' \\) ')
                             formula_inserted = True
         else:
-            output += sentence + ' '
+            output.append(sentence + ' ')
         if count % 10 == 0:  # Каждые 10 предложений
-            output += '\n \\newpage \n'
-        if random.random() < 0.0005:
-            line = random.sample(lines, 1)[0].replace('\n', '')
-            if random.random() < 0.5:
-                output += ' \\textbf{' + line + '} '
+            output.append('\n \\newpage \n')
+        if rng.random() < 0.0005:
+            line = rng.sample(lines, 1)[0].replace('\n', '')
+            if rng.random() < 0.5:
+                output.append(' \\textbf{' + line + '} ')
             else:
-                output += ' \\textit{' + line + '} '
-    return output
+                output.append(' \\textit{' + line + '} ')
+        yield ''.join(output)
+
+# Function to format words with LaTeX commands and randomly insert formulas and numbers
+# Input:
+#   words (list): List of words to format
+#   formulas (FormulaIndex or list): LaTeX formulas to insert
+#   lines (list): List of lines from the original text for random insertion
+#   rng (random.Random, optional): Random generator, the global one by default
+#   progress (bool, optional): Show a tqdm progress bar
+# Output:
+#   output (str): The formatted LaTeX string
+def format_text_with_latex(words, formulas, lines, rng=None, progress=True):
+    sentences = list(iter_word_sentences(words))
+    return ''.join(iter_latex_fragments(tqdm(sentences, disable=not progress), formulas, lines, rng))
 
 # Function to write LaTeX formatted strings into separate .tex files
 # Input:
@@ -201,45 +380,49 @@ def write_strings_to_files(strings, group_size, folder_name):
 # Main function to connect all steps
 # Input:
 #   input_text_file (str): Path to the input text file
-#   input_tex_file (str): Path to the input LaTeX (.tex) file containing formulas
+#   input_tex_file (str): Path to the input LaTeX (.tex) file or formula store with formulas
 #   output_folder (str): Folder name to save the output .tex files
+#   tokenizer (str, optional): Word tokenizer from TOKENIZERS ('regex' or 'jieba')
+#   background (bool, optional): Write files from a BackgroundWriter thread
 # Output:
 #   None (executes the entire processing pipeline and writes output files)
-def main(input_text_file, input_tex_file, output_folder):
-    # Step 1: Clean the input text file by removing non-English characters
-    cleaned_text_file = 'en_only.txt'
-    remove_non_english_characters(input_text_file, cleaned_text_file)
-
-    # Step 2: Extract LaTeX formulas from the input LaTeX file
-    formulas = extract_latex_formulas(input_tex_file)
-
-    # Step 3: Process the cleaned text and insert LaTeX formulas randomly
-    processed_text_file = 'en_line.txt'
-    process_text(cleaned_text_file, processed_text_file, formulas)
-
-    # Step 4: Read in the processed text and further format it with LaTeX commands
-    with open(processed_text_file, 'r', encoding='utf-8') as f:
-        txt_content = f.read()
-    with open(cleaned_text_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    txt_content = remove_symbols(txt_content)
-    txt_content = remove_empty_brackets(txt_content)
-    words = jieba.lcut(txt_content)
-    latex_content = format_text_with_latex(words, formulas, lines)
-
-    # Step 5: Write the formatted LaTeX strings into .tex files in the specified folder
-    blocks = split_latex_blocks(latex_content)
-    write_blocks_to_files(blocks, group_size=3, folder_name=output_folder)
+def main(input_text_file, input_tex_file, output_folder, tokenizer='regex', background=True):
+    # Step 1: Extract LaTeX formulas from the input LaTeX file (cached index keyed by file hash)
+    formulas = load_formula_index(input_tex_file)
+
+    # Step 2: Pick lines of the cleaned text for random \textbf / \textit insertion
+    lines = sample_lines(clean_chunks(iter_chunks(input_text_file)))
+
+    # Step 3: Clean the text, insert formulas, format with LaTeX and split into blocks lazily
+    blocks = iter_generated_blocks(input_text_file, formulas, lines, tokenizer=tokenizer,
+                                   progress=True)
+
+    # Step 4: Validate and write every group of blocks as soon as it is ready
+    if background:
+        with BackgroundWriter() as writer:
+            write_blocks_to_files(blocks, group_size=3, folder_name=output_folder, writer=writer.write)
+    else:
+        write_blocks_to_files(blocks, group_size=3, folder_name=output_folder)
+
+# Формульные блоки: окружения, \[ \], \( \), $$ $$ и $ $
+_BLOCK_REGEX = re.compile(
+    r'(\\begin\{[a-zA-Z*]+\}.*?\\end\{[a-zA-Z*]+\}|\\\[.*?\\\]|\\\(.*?\\\)|\$\$.*?\$\$|\$.*?\$)',
+    re.DOTALL
+)
+
+# Разделители альтернатив _BLOCK_REGEX: окружения ищем регулярками, остальные — просто строки
+_BEGIN_REGEX = re.compile(r'\\begin\{[a-zA-Z*]+\}')
+_END_REGEX = re.compile(r'\\end\{[a-zA-Z*]+\}')
+_LITERAL_DELIMITERS = [('\\[', '\\]'), ('\\(', '\\)'), ('$$', '$$'), ('$', '$')]
+
+# Начало \begin{...}, обрезанное концом буфера
+_PARTIAL_BEGIN_REGEX = re.compile(r'\\(?:b(?:e(?:g(?:i(?:n(?:\{[a-zA-Z*]*)?)?)?)?)?)?\Z')
 
 def split_latex_blocks(text):
     # Находим все формульные и текстовые блоки
-    pattern = re.compile(
-        r'(\\begin\{[a-zA-Z*]+\}.*?\\end\{[a-zA-Z*]+\}|\\\[.*?\\\]|\\\(.*?\\\)|\$\$.*?\$\$|\$.*?\$)',
-        re.DOTALL
-    )
     blocks = []
     last_end = 0
-    for m in pattern.finditer(text):
+    for m in _BLOCK_REGEX.finditer(text):
         # Добавляем текст между формулами как отдельный блок
         if m.start() > last_end:
             blocks.append(text[last_end:m.start()])
@@ -251,12 +434,97 @@ def split_latex_blocks(text):
     # Убираем пустые блоки
     return [b for b in blocks if b.strip()]
 
-def fix_unclosed_environments(tex_content):
-    # Список окружений, которые нужно проверять
-    envs = ['align\\*', 'align', 'array', 'gather\\*', 'gather', 'equation\\*', 'equation']
-    for env in envs:
-        open_count = len(re.findall(r'\\begin\{' + env + r'\}', tex_content))
-        close_count = len(re.findall(r'\\end\{' + env + r'\}', tex_content))
+def _safe_block_limit(buf, start):
+    # Позиция, до которой совпадения _BLOCK_REGEX уже не изменятся от дописанного текста:
+    # первый разделитель без закрывающей пары или обрезанный \begin в конце буфера
+    limit = len(buf)
+    i = buf.rfind('\\', start)
+    if i >= 0 and _PARTIAL_BEGIN_REGEX.match(buf, i):
+        limit = i
+    last_closer = buf.rfind('\\end{', start)
+    while last_closer >= 0 and not _END_REGEX.match(buf, last_closer):
+        last_closer = buf.rfind('\\end{', start, last_closer)
+    for m in _BEGIN_REGEX.finditer(buf, start):
+        if m.start() >= limit:
+            break
+        if m.end() > last_closer:
+            limit = m.start()
+            break
+    for opener, closer in _LITERAL_DELIMITERS:
+        # Незакрытый — первый открывающий, который кончается после последнего закрывающего
+        last_closer = buf.rfind(closer, start)
+        j = buf.find(opener, max(start, last_closer - len(opener) + 1))
+        if 0 <= j < limit:
+            limit = j
+    return limit
+
+# Streaming version of split_latex_blocks
+# Input:
+#   fragments (iterable of str): Pieces of the LaTeX document in order
+#   chunk_size (int, optional): Fragments are joined into chunks of about this many characters
+#       before they are scanned
+# Output:
+#   generator of blocks, exactly the blocks split_latex_blocks returns for ''.join(fragments)
+# Memory holds one chunk plus the unfinished tail of the previous one. Scanning every small
+# fragment on its own costs a _safe_block_limit pass each and was ~5x slower than
+# split_latex_blocks; chunks amortize it.
+def iter_latex_blocks(fragments, chunk_size=1 << 16):
+    buf = ''
+    scan = 0
+    pending, pending_size = [], 0
+    fragments = iter(fragments)
+    while True:
+        for fragment in fragments:
+            pending.append(fragment)
+            pending_size += len(fragment)
+            if pending_size >= chunk_size:
+                break
+        if not pending:
+            break
+        buf += ''.join(pending)
+        pending, pending_size = [], 0
+        last_end = 0
+        while True:
+            limit = _safe_block_limit(buf, scan)
+            consumed = last_end
+            for m in _BLOCK_REGEX.finditer(buf, scan):
+                if m.start() >= limit:
+                    break
+                if buf[last_end:m.start()].strip():
+                    yield buf[last_end:m.start()]
+                yield m.group()
+                last_end = m.end()
+            # Блок мог закончиться за limit: незакрытый разделитель оказался внутри него
+            scan = max(limit, last_end)
+            if last_end <= limit or last_end == consumed:
+                break
+        # В буфере остаются только текст после последнего блока и незакрытые разделители
+        buf = buf[last_end:]
+        scan -= last_end
+    yield from split_latex_blocks(buf)
+
+# Function to group blocks for one .tex file each
+# Input:
+#   blocks (iterable of str): LaTeX blocks
+#   group_size (int): Number of blocks per file
+# Output:
+#   generator of lists of blocks
+def iter_block_groups(blocks, group_size):
+    group = []
+    for block in blocks:
+        group.append(block)
+        if len(group) == group_size:
+            yield group
+            group = []
+    if group:
+        yield group
+
+def fix_unclosed_environments(tex_content, table=None):
+    # Окружения берём из таблицы и считаем \begin/\end за один проход
+    table = table or DEFAULT_TABLE
+    counts = table.count_environments(tex_content)
+    for env in table.environments:
+        open_count, close_count = counts[env]
         if open_count > close_count:
             tex_content += '\n' + ('\\end{' + env + '}\n') * (open_count - close_count)
     return tex_content
@@ -328,54 +596,6 @@ def check_latex_commands_and_braces(s):
             i += 1
     return True
 
-def check_latex_math_commands(s):
-    # Проверяем корректность математических команд
-    math_commands = [
-        r'\\mathbb\{[a-zA-Z]\}',  # \mathbb{R}
-        r'\\mathcal\{[a-zA-Z]\}',  # \mathcal{R}
-        r'\\mathfrak\{[a-zA-Z]\}',  # \mathfrak{R}
-        r'\\mathrm\{[a-zA-Z]\}',  # \mathrm{R}
-        r'\\mathbf\{[a-zA-Z]\}',  # \mathbf{R}
-        r'\\mathit\{[a-zA-Z]\}',  # \mathit{R}
-        r'\\mathsf\{[a-zA-Z]\}',  # \mathsf{R}
-        r'\\mathtt\{[a-zA-Z]\}',  # \mathtt{R}
-        r'\\mathnormal\{[a-zA-Z]\}',  # \mathnormal{R}
-        r'\\mathscr\{[a-zA-Z]\}',  # \mathscr{R}
-        r'\\text\{[^}]*\}',  # \text{...}
-        r'\\operatorname\{[^}]*\}',  # \operatorname{...}
-        r'\\lim', r'\\sum', r'\\prod', r'\\int',  # операторы
-        r'\\sin', r'\\cos', r'\\tan', r'\\log', r'\\ln',  # функции
-        r'\\alpha', r'\\beta', r'\\gamma', r'\\delta',  # греческие буквы
-        r'\\infty', r'\\partial', r'\\nabla',  # специальные символы
-        r'\\left', r'\\right',  # скобки
-        r'\\frac\{[^}]*\}\{[^}]*\}',  # дроби
-        r'\\sqrt\{[^}]*\}',  # корни
-        r'\\overline\{[^}]*\}', r'\\underline\{[^}]*\}',  # черты
-        r'\\hat\{[^}]*\}', r'\\bar\{[^}]*\}', r'\\vec\{[^}]*\}',  # акценты
-        r'\\dot\{[^}]*\}', r'\\ddot\{[^}]*\}',  # точки
-        r'\\prime', r'\\backprime',  # штрихи
-        r'\\langle', r'\\rangle',  # угловые скобки
-        r'\\lceil', r'\\rceil', r'\\lfloor', r'\\rfloor',  # потолок и пол
-        r'\\|', r'\\|',  # двойные вертикальные линии
-        r'\\ldots', r'\\cdots', r'\\vdots', r'\\ddots',  # многоточия
-        r'\\boxed\{[^}]*\}',  # рамка
-        r'\\tag\{[^}]*\}',  # теги
-        r'\\label\{[^}]*\}',  # метки
-        r'\\ref\{[^}]*\}',  # ссылки
-        r'\\eqref\{[^}]*\}'  # ссылки на уравнения
-    ]
-    
-    # Проверяем, что все команды в тексте являются корректными
-    for cmd in math_commands:
-        if re.search(cmd, s):
-            return True
-            
-    # Если нет ни одной корректной команды, но есть математические символы
-    if re.search(r'[\\^_{}]', s):
-        return False
-        
-    return True
-
 def check_latex_math_delimiters(s):
     # Проверяем баланс \( и \)
     inline_math_open = len(re.findall(r'\\\(', s))
@@ -396,39 +616,310 @@ def check_latex_math_delimiters(s):
     # Проверяем, что нет одиночных \[ или \]
     if re.search(r'\\\[[^\]]*$', s) or re.search(r'^[^\[]*\\\]', s):
         return False
-        
-    # Проверяем корректность математических команд
-    if not check_latex_math_commands(s):
-        return False
-        
+
+    # Команды здесь не проверяем: старый список шаблонов с r'\\|' пропускал всё.
+    # Строгая проверка — отдельно, check_latex_math_commands из latex_validator.
     return True
 
-def write_blocks_to_files(blocks, group_size, folder_name):
-    os.makedirs(folder_name, exist_ok=True)
-    file_idx = 1
-    for i in range(0, len(blocks), group_size):
-        content = '\n'.join(blocks[i:i+group_size])
+# Writes files from a background thread so formatting and disk I/O overlap
+# Input:
+#   max_pending (int, optional): Size of the write queue; write() blocks while it is full
+# Errors of the writer thread are raised from the next write() or from close()
+class BackgroundWriter:
+    def __init__(self, max_pending=256):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue  # После ошибки только разгружаем очередь
+            file_name, content = item
+            try:
+                with open(file_name, 'w', encoding='utf-8') as file:
+                    file.write(content)
+            except Exception as e:
+                self.error = e
+
+    def write(self, file_name, content):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((file_name, content))
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Не маскируем исходную ошибку ошибкой записи
+            try:
+                self.close()
+            except Exception:
+                pass
+
+# Function to write a file in the calling thread (the default writer)
+def _write_file(file_name, content):
+    with open(file_name, 'w', encoding='utf-8') as file:
+        file.write(content)
+
+# Function to validate groups of blocks and turn them into numbered .tex documents
+# Input:
+#   blocks (iterable): LaTeX blocks from split_latex_blocks or iter_latex_blocks
+#   group_size (int): Number of blocks per file
+#   start_idx (int, optional): Number of the first file
+#   max_files (int, optional): Raise ValueError instead of producing more groups than this
+# Output:
+#   generator of (file_idx, document) for the groups that pass validate_latex
+def iter_tex_documents(blocks, group_size, start_idx=1, max_files=None):
+    file_idx = start_idx
+    for group_idx, group in enumerate(iter_block_groups(blocks, group_size)):
+        if max_files is not None and group_idx >= max_files:
+            raise ValueError(f'more than {max_files} files starting at {start_idx}')
+        content = '\n'.join(group)
         content = fix_unclosed_environments(content)
-        if not check_braces_balance(content) or not check_parentheses_balance(content) or not check_latex_math_delimiters(content):
-            print(f"Skip file {file_idx}.tex: unbalanced braces, parentheses, math delimiters or invalid LaTeX commands")
+        diagnostics = validate_latex(content)
+        if diagnostics:
+            rules = ', '.join(f"{d.rule}@{d.offset}" for d in diagnostics)
+            logger.debug(f"Skip file {file_idx}.tex: {rules}")
+            METRICS.inc('samples_total', stage='generate', status='invalid')
+            METRICS.inc('invalid_total', rule=diagnostics[0].rule)
             continue
-        file_name = f"{folder_name}/{file_idx}.tex"
-        with open(file_name, 'w', encoding='utf-8') as file:
-            file.write(
-                '\\documentclass[preview]{standalone}\n'
-                '\\usepackage[utf8]{inputenc}\n'
-                '\\usepackage[T2A]{fontenc}\n'
-                '\\usepackage[russian]{babel}\n'
-                '\\usepackage{amssymb}\n'
-                '\\usepackage{amsmath}\n'
-                '\\usepackage{stmaryrd}\n'
-                '\\begin{document}\n'
-            )
-            file.write(content)
-            file.write('\n\\end{document}\n')
+        METRICS.inc('samples_total', stage='generate', status='ok')
+        yield file_idx, wrap_document(content)
         file_idx += 1
 
+# Function to validate groups of blocks and write them into numbered .tex files
+# Input:
+#   blocks (iterable): LaTeX blocks from split_latex_blocks or iter_latex_blocks
+#   group_size (int): Number of blocks per file
+#   folder_name (str): Name of the folder to save .tex files
+#   start_idx (int, optional): Number of the first file
+#   writer (callable, optional): writer(file_name, content), e.g. BackgroundWriter().write
+#   max_files (int, optional): Raise ValueError instead of writing more groups than this
+# Output:
+#   written (int): Number of files written
+# Every group is validated and written as soon as its blocks arrive.
+def write_blocks_to_files(blocks, group_size, folder_name, start_idx=1, writer=None, max_files=None):
+    os.makedirs(folder_name, exist_ok=True)
+    writer = writer or _write_file
+    written = 0
+    for file_idx, document in iter_tex_documents(blocks, group_size, start_idx, max_files):
+        writer(f"{folder_name}/{file_idx}.tex", document)
+        METRICS.inc('bytes_written_total', len(document.encode('utf-8')), kind='tex')
+        written += 1
+    return written
+
+# Function to split a stream of text chunks into lines
+# Input:
+#   chunks (iterable of str): Text chunks
+# Output:
+#   generator of lines, the same as io.StringIO(''.join(chunks)).readlines()
+def iter_lines(chunks):
+    tail = ''
+    for chunk in chunks:
+        parts = (tail + chunk).split('\n')
+        tail = parts.pop()
+        for line in parts:
+            yield line + '\n'
+    if tail:
+        yield tail
+
+# Function to pick random lines of the cleaned text in one pass (reservoir sampling)
+# Input:
+#   chunks (iterable of str): Cleaned text chunks
+#   k (int): Number of lines to keep
+#   rng (random.Random, optional): Random generator, the global one by default
+# Output:
+#   lines (list): Up to k lines with their '\n'
+def sample_lines(chunks, k=10000, rng=None):
+    rng = rng or random
+    lines = []
+    seen = 0
+    for line in iter_lines(chunks):
+        seen += 1
+        if len(lines) < k:
+            lines.append(line)
+        else:
+            j = rng.randrange(seen)
+            if j < k:
+                lines[j] = line
+    return lines
+
+# Function to build the generator chain from the text corpus to LaTeX blocks
+# Input:
+#   input_text_file (str): Path to the input text file
+#   formulas (FormulaIndex): Formula index
+#   lines (list): Lines for random \textbf / \textit insertion
+#   rng (random.Random, optional): Seeds the insertion and formatting stages, the global one by default
+#   tokenizer (str, optional): Word tokenizer from TOKENIZERS
+#   start, end (int, optional): Byte range of the input file
+#   progress (bool, optional): Show a tqdm progress bar over the sentences
+# Output:
+#   generator of LaTeX blocks
+def iter_generated_blocks(input_text_file, formulas, lines, rng=None, tokenizer='regex',
+                          start=0, end=None, progress=False):
+    # Стадии работают поочерёдно, поэтому у каждой свой генератор: иначе результат
+    # зависел бы от того, как буферизуются промежуточные генераторы
+    insert_rng = format_rng = None
+    if rng is not None:
+        insert_rng = random.Random(rng.getrandbits(64))
+        format_rng = random.Random(rng.getrandbits(64))
+    chunks = clean_chunks(iter_chunks(input_text_file, start=start, end=end))
+    processed = (remove_empty_brackets(remove_symbols(piece))
+                 for piece in insert_formulas(iter_sentences(chunks), formulas, rng=insert_rng))
+    sentences = iter_word_sentences(iter_tokens(processed, tokenizer))
+    fragments = iter_latex_fragments(tqdm(sentences, disable=not progress), formulas, lines, format_rng)
+    return iter_latex_blocks(fragments)
+
+# Function to split a text file into byte ranges that start at line boundaries
+# Input:
+#   input_file (str): Path to the input text file
+#   num_shards (int): Number of shards
+# Output:
+#   ranges (list): (start, end) byte offsets, one per shard (possibly empty)
+def shard_ranges(input_file, num_shards):
+    size = os.path.getsize(input_file)
+    bounds = [0]
+    with open(input_file, 'rb') as f:
+        for k in range(1, num_shards):
+            f.seek(max(size * k // num_shards, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+
+# Function to derive an independent seed for a shard
+# Input:
+#   seed (int): Global seed
+#   shard_idx (int): Shard number
+# Output:
+#   shard_seed (int)
+def derive_seed(seed, shard_idx):
+    digest = hashlib.sha256(f'{seed}:{shard_idx}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+_WORKER_FORMULAS = None
+
+def _init_worker(formulas):
+    global _WORKER_FORMULAS
+    _WORKER_FORMULAS = formulas
+
+# Function to build the shard tasks of generate_sharded
+# Input:
+#   input_text_file (str): Path to the input text file
+#   output_folder (str or None): Folder name to save the output .tex files
+#   seed, num_shards, index_stride, group_size, tokenizer: see generate_sharded
+# Output:
+#   tasks (list): One task tuple per shard, see _generate_shard
+def shard_tasks(input_text_file, output_folder, seed=0, num_shards=64, index_stride=1000000,
+                group_size=3, tokenizer='regex'):
+    return [
+        (input_text_file, start, end, derive_seed(seed, shard_idx), output_folder,
+         shard_idx * index_stride + 1, index_stride, group_size, tokenizer)
+        for shard_idx, (start, end) in enumerate(shard_ranges(input_text_file, num_shards))
+    ]
+
+# Function to generate the numbered documents of one shard of the corpus
+# Input:
+#   task (tuple): (input_text_file, start, end, shard_seed, output_folder, start_idx,
+#                  index_stride, group_size, tokenizer), see shard_tasks
+#   formulas (FormulaIndex): Formula index
+# Output:
+#   generator of (file_idx, document)
+def iter_shard_documents(task, formulas):
+    (input_text_file, start, end, shard_seed, _, start_idx,
+     index_stride, group_size, tokenizer) = task
+    rng = random.Random(shard_seed)
+    lines = sample_lines(clean_chunks(iter_chunks(input_text_file, start=start, end=end)), rng=rng)
+    blocks = iter_generated_blocks(input_text_file, formulas, lines, rng=rng, tokenizer=tokenizer,
+                                   start=start, end=end)
+    return iter_tex_documents(blocks, group_size, start_idx=start_idx, max_files=index_stride)
+
+# Function to run all generation steps for one shard of the corpus
+# Input:
+#   task (tuple): see shard_tasks
+# Output:
+#   (written, metrics): Number of .tex files written and the METRICS snapshot of the shard
+def _generate_shard(task):
+    output_folder = task[4]
+    # Процесс пула переиспользуется: метрики каждого шарда отдаём отдельно
+    METRICS.reset()
+    with METRICS.timer('generate_seconds', item=f'shard {task[1]}-{task[2]}'):
+        written = 0
+        with BackgroundWriter() as writer:
+            for file_idx, document in iter_shard_documents(task, _WORKER_FORMULAS):
+                writer.write(f"{output_folder}/{file_idx}.tex", document)
+                METRICS.inc('bytes_written_total', len(document.encode('utf-8')), kind='tex')
+                written += 1
+    return written, METRICS.snapshot()
+
+# Function to generate the dataset in deterministic shards with a process pool
+# Input:
+#   input_text_file (str): Path to the input text file
+#   input_tex_file (str): Path to the input LaTeX (.tex) file or formula store with formulas
+#   output_folder (str): Folder name to save the output .tex files
+#   seed (int, optional): Global seed; every shard uses derive_seed(seed, shard_idx)
+#   num_shards (int, optional): Number of corpus shards (fixes the output, unlike workers)
+#   workers (int, optional): Number of processes, os.cpu_count() by default
+#   index_stride (int, optional): Shard k writes files k * index_stride + 1, ...
+#   group_size (int, optional): Number of blocks per file
+#   tokenizer (str, optional): Word tokenizer from TOKENIZERS
+#   metrics (str, optional): Export the merged METRICS of all shards here (.prom or .json)
+# Output:
+#   written (int): Total number of .tex files written
+# The same seed and num_shards give byte-identical files for any number of workers.
+def generate_sharded(input_text_file, input_tex_file, output_folder, seed=0, num_shards=64,
+                     workers=None, index_stride=1000000, group_size=3, tokenizer='regex',
+                     metrics=None):
+    formulas = load_formula_index(input_tex_file)
+    tasks = shard_tasks(input_text_file, output_folder, seed, num_shards, index_stride,
+                        group_size, tokenizer)
+    os.makedirs(output_folder, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(formulas,)) as pool:
+        written = 0
+        for shard_written, snapshot in tqdm(pool.map(_generate_shard, tasks), total=len(tasks)):
+            written += shard_written
+            METRICS.merge(snapshot)
+    if metrics:
+        METRICS.export(metrics)
+    return written
+
 # Example usage
 if __name__ == "__main__":
-    main('to_latex_converter/tools/test.text', 'to_latex_converter/tools/formular.tex', 'data/raw/ru')
+    parser = argparse.ArgumentParser(description='Generate LaTeX samples from text and formulas')
+    parser.add_argument('--input-text', default='to_latex_converter/tools/test.text')
+    parser.add_argument('--input-tex', default='to_latex_converter/tools/formular.tex')
+    parser.add_argument('--output', default='data/raw/ru')
+    parser.add_argument('--tokenizer', choices=list(TOKENIZERS), default='regex')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='deterministic sharded mode: seed shared by all shards')
+    parser.add_argument('--shards', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--metrics', default=None,
+                        help='write a metrics snapshot here (.prom for a Prometheus textfile, else JSON)')
+    args = parser.parse_args()
+    if args.seed is None:
+        main(args.input_text, args.input_tex, args.output, tokenizer=args.tokenizer)
+        if args.metrics:
+            METRICS.export(args.metrics)
+    else:
+        generate_sharded(args.input_text, args.input_tex, args.output, seed=args.seed,
+                         num_shards=args.shards, workers=args.workers, tokenizer=args.tokenizer,
+                         metrics=args.metrics)
+    METRICS.log_summary()
 
@@ -1,21 +1,81 @@
 import os
-import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from to_latex_converter.tools.latex_template import split_document
 
 TEX_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'raw', 'ru'))
 TEXT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data', 'txt'))
 
-os.makedirs(TEXT_DIR, exist_ok=True)
-
-for filename in os.listdir(TEX_DIR):
-    if filename.endswith('.tex'):
-        tex_path = os.path.join(TEX_DIR, filename)
-        with open(tex_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        # Извлекаем текст между \begin{document} и \end{document}
-        match = re.search(r'\\begin\{document\}(.*?)\\end\{document\}', content, re.DOTALL)
-        if match:
-            extracted_text = match.group(1).strip()
-            text_filename = os.path.splitext(filename)[0] + '.txt'
-            text_path = os.path.join(TEXT_DIR, text_filename)
-            with open(text_path, 'w', encoding='utf-8') as out_f:
-                out_f.write(extracted_text)
+# Function to extract the target text of a sample from its .tex source
+# Input:
+#   content (str): Full .tex source
+# Output:
+#   text (str or None): Stripped text between \begin{document} and \end{document}
+def extract_tex_text(content):
+    _, body = split_document(content)
+    return body.strip() if body is not None else None
+
+# Function to write the label of one sample from its in-memory .tex source
+# Input:
+#   tex_path (str): Path to the .tex file (only its name is used)
+#   content (str): Full .tex source
+#   text_dir (str): Folder for the .txt labels
+# Output:
+#   text_path (str or None): Path to the written label, None if there is no document body
+def write_tex_label(tex_path, content, text_dir):
+    extracted_text = extract_tex_text(content)
+    if extracted_text is None:
+        return None
+    text_filename = os.path.splitext(os.path.basename(tex_path))[0] + '.txt'
+    text_path = os.path.join(text_dir, text_filename)
+    with open(text_path, 'w', encoding='utf-8') as out_f:
+        out_f.write(extracted_text)
+    return text_path
+
+# Function to remove the label of a sample that did not render
+# Input:
+#   tex_path (str): Path to the .tex file (only its name is used)
+#   text_dir (str): Folder for the .txt labels
+# Output:
+#   None
+def remove_tex_label(tex_path, text_dir):
+    text_path = os.path.join(text_dir, os.path.splitext(os.path.basename(tex_path))[0] + '.txt')
+    if os.path.exists(text_path):
+        os.remove(text_path)
+
+def _extract_file(args):
+    tex_path, text_dir = args
+    with open(tex_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    return write_tex_label(tex_path, content, text_dir)
+
+# Function to write labels for all .tex files in a folder in parallel
+# Input:
+#   tex_dir (str): Folder with .tex files
+#   text_dir (str): Folder for the .txt labels
+#   workers (int, optional): Number of threads, os.cpu_count() by default
+# Output:
+#   written (int): Number of labels written
+# tex2png --text-dir writes the same labels right after rendering; this pass is
+# only needed for samples rendered without it.
+def extract_tex_texts_parallel(tex_dir, text_dir, workers=None):
+    os.makedirs(text_dir, exist_ok=True)
+    tasks = [
+        (os.path.join(tex_dir, filename), text_dir)
+        for filename in sorted(os.listdir(tex_dir)) if filename.endswith('.tex')
+    ]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        return sum(1 for text_path in pool.map(_extract_file, tasks) if text_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract target texts from .tex files')
+    parser.add_argument('--tex-dir', default=TEX_DIR)
+    parser.add_argument('--text-dir', default=TEXT_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    written = extract_tex_texts_parallel(args.tex_dir, args.text_dir, args.workers)
+    print(f"[DONE] {written} labels")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+
+INDEX_VERSION = 1
+
+# Function to extract LaTeX formulas from a .tex file
+# Input:
+#   tex_file_path (str): Path to the LaTeX (.tex) file
+# Output:
+#   formula_list (list): List of extracted LaTeX formulas
+def extract_latex_formulas(tex_file_path):
+    with open(tex_file_path, 'r', encoding='utf-8') as f:
+        tex_content = f.read()
+    return extract_latex_formulas_from_string(tex_content)
+
+# Function to extract LaTeX formulas from LaTeX source text
+# Input:
+#   tex_content (str): LaTeX source
+# Output:
+#   formula_list (list): List of extracted LaTeX formulas
+def extract_latex_formulas_from_string(tex_content):
+    pattern = r'\\\[(.+?)\\\]|\\begin\{align\*\}(.+?)\\end\{align\*\}'
+    formulas = re.findall(pattern, tex_content)
+    formula_list = [
+        re.sub(r'\\eqref\{(.*?)\}', r'', group).strip()
+        for tuples in formulas for group in tuples if group
+    ]
+    # Улучшенная фильтрация: удаляем формулы, которые содержат только спецсимволы, пробелы или пустые
+    bad_formulas = {'\\end{align*}', '\\begin{align*}', '', '\\[', '\\]'}
+    def is_bad_formula(f):
+        f_clean = f.replace('\n', '').replace('\r', '').replace(' ', '')
+        return f_clean in {s.replace(' ', '') for s in bad_formulas} or re.fullmatch(r'\\end\{.*?\}|\\begin\{.*?\}', f_clean)
+    formula_list = [f for f in formula_list if f and not is_bad_formula(f)]
+    return formula_list
+
+_TAG_REGEX = re.compile(r'\\tag\{.*?\}|\\eqref\{.*?\}')
+
+# Buckets and the conditions the generator used to check after every random draw
+# Rules are data rather than lambdas, so they are part of the cache key of load_or_build:
+#   min_len / max_len: exclusive length bounds; command: formula must (True) or must not
+#   (False) contain a backslash
+BUCKETS = {
+    # process_text / insert_formulas: короткие формулы внутри \( \)
+    'short': {'max_len': 50},
+    # format_text_with_latex: строчные формулы без команд
+    'inline': {'max_len': 30, 'command': False},
+    # format_text_with_latex: выключные формулы в align*
+    'display': {'min_len': 30, 'command': True},
+}
+
+# Function to check a formula against a bucket rule from BUCKETS
+def bucket_accepts(rule, formula):
+    if 'min_len' in rule and not len(formula) > rule['min_len']:
+        return False
+    if 'max_len' in rule and not len(formula) < rule['max_len']:
+        return False
+    if 'command' in rule and ('\\' in formula) != rule['command']:
+        return False
+    return True
+
+# Function to build the cache key of an index
+# Input:
+#   source_sha256 (str): Hash of the .tex source
+# Output:
+#   key (str): Changes with the source, INDEX_VERSION and the BUCKETS rules
+def index_cache_key(source_sha256):
+    payload = json.dumps({'version': INDEX_VERSION, 'buckets': BUCKETS, 'source': source_sha256},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Index of formulas grouped into buckets, so sampling never rejects a draw
+# Formulas are stored without \tag{...}/\eqref{...}, sorted by length; every bucket
+# keeps ascending positions into that list, so a length limit is one bisect.
+class FormulaIndex:
+    def __init__(self, formulas, buckets=None, source_sha256=None):
+        self.formulas = formulas
+        self.source_sha256 = source_sha256
+        self.buckets = buckets
+        if self.buckets is None:
+            self.buckets = {
+                name: [i for i, f in enumerate(formulas) if bucket_accepts(rule, f)]
+                for name, rule in BUCKETS.items()
+            }
+        self._lengths = {
+            name: [len(formulas[i]) for i in positions] for name, positions in self.buckets.items()
+        }
+
+    # Function to build an index from raw formulas
+    # Input:
+    #   formulas (iterable of str): Formulas, e.g. the output of extract_latex_formulas
+    #   source_sha256 (str, optional): Hash of the source they were extracted from
+    # Output:
+    #   index (FormulaIndex)
+    @classmethod
+    def from_formulas(cls, formulas, source_sha256=None):
+        cleaned = (_TAG_REGEX.sub('', f).strip() for f in formulas)
+        return cls(sorted((f for f in cleaned if f), key=len), source_sha256=source_sha256)
+
+    # Function to build an index from a formula store filled by ingest_formulas.py
+    # Input:
+    #   store_path (str): Path to the SQLite formula store
+    # Output:
+    #   index (FormulaIndex)
+    @classmethod
+    def from_store(cls, store_path):
+        from to_latex_converter.tools.ingest_formulas import FormulaStore
+        with FormulaStore(store_path) as store:
+            return cls.from_formulas(store.iter_formulas())
+
+    # Function to load the index of a .tex file from the cache or build and save it
+    # Input:
+    #   tex_file_path (str): Path to the LaTeX (.tex) file with formulas
+    #   cache_dir (str, optional): Folder with saved indexes
+    # Output:
+    #   index (FormulaIndex)
+    # A new INDEX_VERSION or new BUCKETS rules give a new cache key; an unreadable or
+    # foreign cached file is rebuilt rather than raised.
+    @classmethod
+    def load_or_build(cls, tex_file_path, cache_dir='.cache/formula_index'):
+        with open(tex_file_path, 'rb') as f:
+            source_sha256 = hashlib.sha256(f.read()).hexdigest()
+        index_path = os.path.join(cache_dir, index_cache_key(source_sha256) + '.json')
+        if os.path.exists(index_path):
+            try:
+                return cls.load(index_path)
+            except (ValueError, KeyError):
+                pass
+        index = cls.from_formulas(extract_latex_formulas(tex_file_path), source_sha256)
+        index.save(index_path)
+        return index
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': INDEX_VERSION,
+                'source_sha256': self.source_sha256,
+                'formulas': self.formulas,
+                'buckets': self.buckets,
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != INDEX_VERSION:
+            raise ValueError(f'{path}: unsupported formula index version {data.get("version")}')
+        return cls(data['formulas'], data['buckets'], data['source_sha256'])
+
+    def __len__(self):
+        return len(self.formulas)
+
+    # Function to draw a random formula from a bucket
+    # Input:
+    #   bucket (str): Bucket name from BUCKETS
+    #   rng (random.Random): Random generator
+    #   max_len (int, optional): Only formulas not longer than max_len
+    # Output:
+    #   formula (str or None): None if no formula fits
+    def sample(self, bucket, rng, max_len=None):
+        positions = self.buckets[bucket]
+        hi = len(positions) if max_len is None else bisect.bisect_right(self._lengths[bucket], max_len)
+        if hi == 0:
+            return None
+        return self.formulas[positions[rng.randrange(hi)]]
+
+# Function to accept either a ready index or a plain list of formulas
+# Input:
+#   formulas (FormulaIndex or list): Formulas
+# Output:
+#   index (FormulaIndex)
+def as_formula_index(formulas):
+    if isinstance(formulas, FormulaIndex):
+        return formulas
+    return FormulaIndex.from_formulas(formulas)
+
+# Function to load formulas from a .tex file or from a formula store
+# Input:
+#   path (str): .tex file (cached by load_or_build) or SQLite store (.sqlite/.db)
+# Output:
+#   index (FormulaIndex)
+def load_formula_index(path):
+    if path.endswith(('.sqlite', '.db')):
+        return FormulaIndex.from_store(path)
+    return FormulaIndex.load_or_build(path)
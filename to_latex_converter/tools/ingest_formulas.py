@@ -0,0 +1,202 @@
+import os
+import re
+import gzip
+import zlib
+import sqlite3
+import hashlib
+import tarfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from tqdm import tqdm
+
+from to_latex_converter.tools.formula_index import extract_latex_formulas_from_string
+
+# Метки и номера не меняют формулу: убираем их перед дедупликацией
+_LABEL_REGEX = re.compile(r'\\(?:label|tag|eqref)\{[^}]*\}|\\(?:nonumber|notag)\b')
+_SPACE_REGEX = re.compile(r'\s+')
+
+_TEX_SUFFIXES = ('.tex',)
+_ARCHIVE_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.gz')
+
+# Function to normalize a formula and compute its deduplication hash
+# Input:
+#   formula (str): Raw formula
+# Output:
+#   (hash, formula): sha1 of the formula without whitespace and labels, and the formula
+#   with labels removed and whitespace collapsed
+def normalize_formula(formula):
+    formula = _SPACE_REGEX.sub(' ', _LABEL_REGEX.sub('', formula)).strip()
+    key = hashlib.sha1(_SPACE_REGEX.sub('', formula).encode('utf-8')).hexdigest()
+    return key, formula
+
+# Persistent SQLite store of unique formulas and of already ingested sources
+class FormulaStore:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS formulas (hash TEXT PRIMARY KEY, formula TEXT NOT NULL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, found INTEGER, added INTEGER,'
+            ' size INTEGER, mtime INTEGER)'
+        )
+        # Хранилища, созданные до появления size/mtime: такие источники будут обработаны заново
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(sources)')}
+        for column in ('size', 'mtime'):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE sources ADD COLUMN {column} INTEGER')
+        self.conn.commit()
+
+    # Function to check whether a source was ingested in its current version
+    # Input:
+    #   source (str): Source id (file or archive path)
+    #   size (int): Current size of the source in bytes
+    #   mtime (int): Current modification time of the source, in ns
+    # Output:
+    #   done (bool): False if the source is new or was changed since it was ingested
+    def is_done(self, source, size, mtime):
+        return self.conn.execute(
+            'SELECT 1 FROM sources WHERE source = ? AND size = ? AND mtime = ?', (source, size, mtime)
+        ).fetchone() is not None
+
+    # Function to add the formulas of one source in a single transaction
+    # Input:
+    #   source (str): Source id (file or archive path)
+    #   items (list): (hash, formula) pairs from normalize_formula
+    #   size (int, optional): Size of the source, see is_done
+    #   mtime (int, optional): Modification time of the source in ns, see is_done
+    # Output:
+    #   added (int): Number of formulas that were not in the store yet
+    def add(self, source, items, size=None, mtime=None):
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany('INSERT OR IGNORE INTO formulas (hash, formula) VALUES (?, ?)', items)
+            added = self.conn.total_changes - before
+            # Источник отмечается в той же транзакции — после сбоя он будет обработан заново
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sources (source, found, added, size, mtime) VALUES (?, ?, ?, ?, ?)',
+                (source, len(items), added, size, mtime)
+            )
+        return added
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM formulas').fetchone()[0]
+
+    def iter_formulas(self):
+        for (formula,) in self.conn.execute('SELECT formula FROM formulas ORDER BY rowid'):
+            yield formula
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Function to list ingestible sources under a folder
+# Input:
+#   root (str): Folder with .tex files and/or arXiv source archives, or a single file
+# Output:
+#   generator of paths (.tex files and archives), in a stable order
+def iter_sources(root):
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(_TEX_SUFFIXES + _ARCHIVE_SUFFIXES):
+                yield os.path.join(dirpath, name)
+
+def _iter_tex_texts(path):
+    if path.endswith(_TEX_SUFFIXES):
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            yield f.read()
+    elif tarfile.is_tarfile(path):
+        # Архив читаем потоково, по одному .tex за раз
+        with tarfile.open(path, 'r|*') as tar:
+            for member in tar:
+                if member.isfile() and member.name.endswith(_TEX_SUFFIXES):
+                    yield tar.extractfile(member).read().decode('utf-8', errors='replace')
+    elif path.endswith('.gz'):
+        # arXiv отдаёт однофайловые исходники как просто .gz
+        with gzip.open(path, 'rb') as f:
+            yield f.read().decode('utf-8', errors='replace')
+
+# Function to extract and normalize the formulas of one source (runs in a worker process)
+# Input:
+#   path (str): .tex file or archive
+# Output:
+#   (path, items, error): unique (hash, formula) pairs of the source, error message or None
+def extract_source(path):
+    items = {}
+    try:
+        for text in _iter_tex_texts(path):
+            for formula in extract_latex_formulas_from_string(text):
+                key, formula = normalize_formula(formula)
+                if formula:
+                    items.setdefault(key, formula)
+    # Обрезанный или битый gzip даёт zlib.error: это сбой одного источника, а не всего запуска
+    except (OSError, tarfile.TarError, EOFError, zlib.error, UnicodeError) as e:
+        return path, [], str(e)
+    return path, list(items.items()), None
+
+# Function to ingest formulas from a source tree into the store
+# Input:
+#   root (str): Folder (or single file) with .tex sources and archives
+#   store_path (str): Path to the SQLite formula store
+#   workers (int, optional): Number of extraction processes
+#   max_pending (int, optional): Max sources in flight, bounds memory use
+# Output:
+#   stats (dict): Number of processed/skipped/failed sources and added formulas
+def ingest(root, store_path, workers=None, max_pending=None):
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    stats = {'sources': 0, 'skipped': 0, 'failed': 0, 'added': 0}
+    with FormulaStore(store_path) as store, ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        bar = tqdm(unit='src')
+
+        def collect(done):
+            for future in done:
+                path, items, error = future.result()
+                stat = pending.pop(future)
+                if error is not None:
+                    stats['failed'] += 1
+                    tqdm.write(f"[ERROR] {path}: {error}")
+                    continue
+                stats['added'] += store.add(path, items, stat.st_size, stat.st_mtime_ns)
+                stats['sources'] += 1
+                bar.update(1)
+                bar.set_postfix(formulas=stats['added'])
+
+        for path in iter_sources(root):
+            # Уже обработанные и с тех пор не изменённые источники пропускаем —
+            # так продолжается прерванный запуск
+            stat = os.stat(path)
+            if store.is_done(path, stat.st_size, stat.st_mtime_ns):
+                stats['skipped'] += 1
+                continue
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[pool.submit(extract_source, path)] = stat
+        collect(wait(pending).done)
+        bar.close()
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract and deduplicate formulas from LaTeX sources')
+    parser.add_argument('--source', required=True, help='folder with .tex files or arXiv source archives')
+    parser.add_argument('--store', default='data/formulas.sqlite')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    stats = ingest(args.source, args.store, args.workers)
+    print(f"[DONE] {stats}")
+
+if __name__ == '__main__':
+    main()
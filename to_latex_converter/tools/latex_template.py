@@ -0,0 +1,42 @@
+import re
+
+# Общая преамбула всех сэмплов, которые пишет write_blocks_to_files
+PREAMBLE = (
+    '\\documentclass[preview]{standalone}\n'
+    '\\usepackage[utf8]{inputenc}\n'
+    '\\usepackage[T2A]{fontenc}\n'
+    '\\usepackage[russian]{babel}\n'
+    '\\usepackage{amssymb}\n'
+    '\\usepackage{amsmath}\n'
+    '\\usepackage{stmaryrd}\n'
+)
+
+# Та же преамбула, но каждый сэмпл в окружении sample становится отдельной страницей PDF
+BATCH_PREAMBLE = (
+    PREAMBLE.replace('[preview]', '[preview,multi=sample]', 1)
+    + '\\newenvironment{sample}{}{}\n'
+)
+
+_DOCUMENT_REGEX = re.compile(r'\\begin\{document\}(.*?)\\end\{document\}', re.DOTALL)
+
+# Function to wrap a LaTeX body into a full standalone document
+# Input:
+#   body (str): Content between \begin{document} and \end{document}
+#   preamble (str, optional): Preamble to put before \begin{document}
+# Output:
+#   document (str): Full .tex source
+def wrap_document(body, preamble=PREAMBLE):
+    return preamble + '\\begin{document}\n' + body + '\n\\end{document}\n'
+
+# Function to split a .tex source into its preamble and document body
+# Input:
+#   content (str): Full .tex source
+# Output:
+#   (preamble, body): preamble is everything before \begin{document},
+#   body is the raw text between \begin{document} and \end{document};
+#   (None, None) if the document environment is not found
+def split_document(content):
+    match = _DOCUMENT_REGEX.search(content)
+    if match is None:
+        return None, None
+    return content[:match.start()], match.group(1)
@@ -0,0 +1,193 @@
+import re
+from dataclasses import dataclass
+
+# Команда (обратный слеш + буквы, как str.isalpha в старых проверках) или одна из скобок
+_TOKEN_REGEX = re.compile(r'\\[^\W\d_]*|[{}()\[\]]')
+
+_DELIMITERS = {'(': 'inline_open', ')': 'inline_close', '[': 'display_open', ']': 'display_close'}
+
+_ARG_LETTER = r'\{[a-zA-Z]\}'
+_ARG_ANY = r'\{[^}]*\}'
+
+# Известные математические команды: (имя без слеша, регулярка для аргументов)
+MATH_COMMANDS = [
+    ('mathbb', _ARG_LETTER), ('mathcal', _ARG_LETTER), ('mathfrak', _ARG_LETTER),
+    ('mathrm', _ARG_LETTER), ('mathbf', _ARG_LETTER), ('mathit', _ARG_LETTER),
+    ('mathsf', _ARG_LETTER), ('mathtt', _ARG_LETTER), ('mathnormal', _ARG_LETTER),
+    ('mathscr', _ARG_LETTER),
+    ('text', _ARG_ANY), ('operatorname', _ARG_ANY),
+    ('lim', ''), ('sum', ''), ('prod', ''), ('int', ''),  # операторы
+    ('sin', ''), ('cos', ''), ('tan', ''), ('log', ''), ('ln', ''),  # функции
+    ('alpha', ''), ('beta', ''), ('gamma', ''), ('delta', ''),  # греческие буквы
+    ('infty', ''), ('partial', ''), ('nabla', ''),  # специальные символы
+    ('left', ''), ('right', ''),  # скобки
+    ('frac', _ARG_ANY + _ARG_ANY),  # дроби
+    ('sqrt', _ARG_ANY),  # корни
+    ('overline', _ARG_ANY), ('underline', _ARG_ANY),  # черты
+    ('hat', _ARG_ANY), ('bar', _ARG_ANY), ('vec', _ARG_ANY),  # акценты
+    ('dot', _ARG_ANY), ('ddot', _ARG_ANY),  # точки
+    ('prime', ''), ('backprime', ''),  # штрихи
+    ('langle', ''), ('rangle', ''),  # угловые скобки
+    ('lceil', ''), ('rceil', ''), ('lfloor', ''), ('rfloor', ''),  # потолок и пол
+    ('|', ''),  # двойные вертикальные линии
+    ('ldots', ''), ('cdots', ''), ('vdots', ''), ('ddots', ''),  # многоточия
+    ('boxed', _ARG_ANY),  # рамка
+    ('tag', _ARG_ANY),  # теги
+    ('label', _ARG_ANY),  # метки
+    ('ref', _ARG_ANY),  # ссылки
+    ('eqref', _ARG_ANY),  # ссылки на уравнения
+]
+
+# Окружения, которые fix_unclosed_environments закрывает автоматически
+ENVIRONMENTS = ['align*', 'align', 'array', 'gather*', 'gather', 'equation*', 'equation']
+
+class LatexTable:
+    """Known math commands and environments compiled into one regex each.
+
+    Extend it with add_command/add_environment for custom macros; DEFAULT_TABLE is used
+    when no table is passed explicitly.
+    """
+
+    def __init__(self, commands=MATH_COMMANDS, environments=ENVIRONMENTS):
+        self.commands = list(commands)
+        self.environments = list(environments)
+        self._compile()
+
+    def _compile(self):
+        self.command_regex = re.compile(
+            r'\\(?:' + '|'.join(re.escape(name) + args for name, args in self.commands) + ')'
+        )
+        self.environment_regex = re.compile(
+            r'\\(begin|end)\{(' + '|'.join(re.escape(env) for env in self.environments) + r')\}'
+        )
+
+    def add_command(self, name, args=''):
+        self.commands.append((name, args))
+        self._compile()
+
+    def add_environment(self, name):
+        self.environments.append(name)
+        self._compile()
+
+    # Один проход: сколько раз каждое окружение открыто и закрыто
+    def count_environments(self, s):
+        counts = {env: [0, 0] for env in self.environments}
+        for m in self.environment_regex.finditer(s):
+            counts[m.group(2)][m.group(1) == 'end'] += 1
+        return counts
+
+DEFAULT_TABLE = LatexTable()
+
+_MATH_SYMBOL_REGEX = re.compile(r'[\\^_{}]')
+
+def check_latex_math_commands(s, table=None):
+    # Проверяем корректность математических команд
+    table = table or DEFAULT_TABLE
+    if table.command_regex.search(s):
+        return True
+    # Если нет ни одной корректной команды, но есть математические символы
+    if _MATH_SYMBOL_REGEX.search(s):
+        return False
+    return True
+
+@dataclass(frozen=True)
+class Diagnostic:
+    rule: str
+    offset: int
+    message: str
+
+# Function to validate a LaTeX fragment in a single pass
+# Input:
+#   s (str): LaTeX content (document body or a group of blocks)
+#   check_math_commands (bool, optional): Also run check_latex_math_commands.
+#     Off by default: the old regex list contained r'\\|', which matches the empty
+#     string, so this rule never rejected anything on the write path.
+#   table (LatexTable, optional): Commands table, DEFAULT_TABLE by default
+# Output:
+#   diagnostics (list of Diagnostic): Empty if the content is valid; at most one entry per rule.
+# Covers check_braces_balance, check_parentheses_balance, check_latex_commands_and_braces
+# and check_latex_math_delimiters with the same semantics.
+def validate_latex(s, check_math_commands=False, table=None):
+    diagnostics = []
+    braces = []  # (позиция '{', это аргумент команды)
+    parens = []
+    extra_brace = extra_paren = None
+    command_brace = -1
+    counts = {'inline_open': 0, 'inline_close': 0, 'display_open': 0, 'display_close': 0}
+    last_inline_open = last_display_open = None
+    first_inline_close = first_display_close = None
+    first_lparen = first_lbracket = None
+    last_rparen = last_rbracket = -1
+
+    for m in _TOKEN_REGEX.finditer(s):
+        start = m.start()
+        c = s[start]
+        if c == '\\':
+            end = m.end()
+            nxt = s[end] if end < len(s) else ''
+            if end == start + 1 and nxt in _DELIMITERS:
+                kind = _DELIMITERS[nxt]
+                counts[kind] += 1
+                if kind == 'inline_open':
+                    last_inline_open = start
+                elif kind == 'display_open':
+                    last_display_open = start
+                elif kind == 'inline_close' and first_inline_close is None:
+                    first_inline_close = start
+                elif kind == 'display_close' and first_display_close is None:
+                    first_display_close = start
+            if nxt == '{':
+                command_brace = end
+        elif c == '{':
+            braces.append((start, start == command_brace))
+        elif c == '}':
+            if braces:
+                braces.pop()
+            elif extra_brace is None:
+                extra_brace = start
+        elif c == '(':
+            parens.append(start)
+            if first_lparen is None:
+                first_lparen = start
+        elif c == ')':
+            last_rparen = start
+            if parens:
+                parens.pop()
+            elif extra_paren is None:
+                extra_paren = start
+        elif c == '[':
+            if first_lbracket is None:
+                first_lbracket = start
+        elif c == ']':
+            last_rbracket = start
+
+    if extra_brace is not None:
+        diagnostics.append(Diagnostic('braces', extra_brace, 'unexpected closing brace'))
+    elif braces:
+        diagnostics.append(Diagnostic('braces', braces[0][0], 'unclosed brace'))
+    unclosed_args = [pos for pos, is_arg in braces if is_arg]
+    if unclosed_args:
+        diagnostics.append(Diagnostic('command_argument', unclosed_args[0], 'unclosed command argument'))
+    if extra_paren is not None:
+        diagnostics.append(Diagnostic('parentheses', extra_paren, 'unexpected closing parenthesis'))
+    elif parens:
+        diagnostics.append(Diagnostic('parentheses', parens[0], 'unclosed parenthesis'))
+
+    if counts['inline_open'] != counts['inline_close']:
+        diagnostics.append(Diagnostic('inline_math', last_inline_open if last_inline_open is not None
+                                      else first_inline_close, 'unbalanced \\( \\)'))
+    elif last_inline_open is not None and last_rparen < last_inline_open:
+        diagnostics.append(Diagnostic('inline_math', last_inline_open, 'unclosed \\('))
+    elif first_inline_close is not None and (first_lparen is None or first_lparen > first_inline_close):
+        diagnostics.append(Diagnostic('inline_math', first_inline_close, 'unopened \\)'))
+    if counts['display_open'] != counts['display_close']:
+        diagnostics.append(Diagnostic('display_math', last_display_open if last_display_open is not None
+                                      else first_display_close, 'unbalanced \\[ \\]'))
+    elif last_display_open is not None and last_rbracket < last_display_open:
+        diagnostics.append(Diagnostic('display_math', last_display_open, 'unclosed \\['))
+    elif first_display_close is not None and (first_lbracket is None or first_lbracket > first_display_close):
+        diagnostics.append(Diagnostic('display_math', first_display_close, 'unopened \\]'))
+
+    if check_math_commands and not check_latex_math_commands(s, table):
+        diagnostics.append(Diagnostic('math_commands', 0, 'math symbols without known commands'))
+    return diagnostics
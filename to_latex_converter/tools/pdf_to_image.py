@@ -0,0 +1,207 @@
+import os
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from omegaconf import OmegaConf
+from tqdm import tqdm
+
+try:
+    import pymupdf
+except ImportError:  # PyMuPDF не установлен — рендерим через pdf2image (poppler)
+    pymupdf = None
+
+from to_latex_converter.utils import load_config
+
+DEFAULT_CONFIG = {
+    'pdf_path': 'data/pdf/',
+    'output_dir': 'data/raw/raw_images/',
+    'dpi': 300,
+    'colorspace': 'rgb',
+    'backend': 'pymupdf',
+    'workers': None,
+    'pages_per_task': 16,
+}
+
+# Function to build the output path of one page
+# Input:
+#   output_dir (str): Root folder for page images
+#   pdf_file (str): Path to the source PDF
+#   page (int): Zero-based page number
+#   pdf_root (str, optional): Folder the PDFs were found in
+# Output:
+#   png_path (str): <output_dir>/<pdf path relative to pdf_root>/page-00001.png (pages are
+#       numbered from 1); without pdf_root the folder is named after the PDF file
+# Подпапки повторяют дерево входной папки: a/paper.pdf и b/paper.pdf не пишут в одну папку
+def page_image_path(output_dir, pdf_file, page, pdf_root=None):
+    if pdf_root is not None and os.path.isdir(pdf_root):
+        name = os.path.relpath(pdf_file, pdf_root)
+    else:
+        name = os.path.basename(pdf_file)
+    return os.path.join(output_dir, os.path.splitext(name)[0], f'page-{page + 1:05d}.png')
+
+# Function to count the pages of a PDF without loading them
+def pdf_page_count(pdf_file, backend='pymupdf'):
+    if backend == 'pymupdf' and pymupdf is not None:
+        with pymupdf.open(pdf_file) as doc:
+            return doc.page_count
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_file)['Pages'])
+
+# Function to split the pages of a PDF that are not rendered yet into tasks
+# Input:
+#   pdf_file (str): Path to the PDF
+#   output_dir (str): Root folder for page images
+#   pages_per_task (int): Maximum number of pages in one task
+#   backend (str): 'pymupdf' or 'pdf2image'
+#   pdf_root (str, optional): Folder the PDFs were found in, see page_image_path
+# Output:
+#   tasks (list): (pdf_file, [page, ...]) with consecutive missing pages
+#   skipped (int): Number of pages that already have an image
+def pending_page_tasks(pdf_file, output_dir, pages_per_task=16, backend='pymupdf', pdf_root=None):
+    page_count = pdf_page_count(pdf_file, backend)
+    missing = [
+        page for page in range(page_count)
+        if not os.path.exists(page_image_path(output_dir, pdf_file, page, pdf_root))
+    ]
+    tasks = []
+    for page in missing:
+        # Новая задача, если страница не продолжает текущий диапазон или он полон
+        if not tasks or page != tasks[-1][1][-1] + 1 or len(tasks[-1][1]) == pages_per_task:
+            tasks.append((pdf_file, []))
+        tasks[-1][1].append(page)
+    return tasks, page_count - len(missing)
+
+def _write_atomic(path, data):
+    # Через временный файл: оборванная запись не сойдёт за готовую страницу при перезапуске
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# Function to render a range of pages of one PDF (runs in a worker process)
+# Input:
+#   task (tuple): (pdf_file, pages) from pending_page_tasks
+#   output_dir (str): Root folder for page images
+#   dpi (int): Resolution
+#   colorspace (str): 'rgb' or 'gray'
+#   backend (str): 'pymupdf' or 'pdf2image'
+#   pdf_root (str, optional): Folder the PDFs were found in, see page_image_path
+# Output:
+#   rendered (int): Number of pages written
+# В памяти одновременно только одна страница: документ открывается лениво,
+# pdf2image получает first_page/last_page и отдаёт страницы по одной.
+def render_pages(task, output_dir, dpi=300, colorspace='rgb', backend='pymupdf', pdf_root=None):
+    pdf_file, pages = task
+    os.makedirs(os.path.dirname(page_image_path(output_dir, pdf_file, 0, pdf_root)), exist_ok=True)
+    if backend == 'pymupdf' and pymupdf is not None:
+        cs = pymupdf.csGRAY if colorspace == 'gray' else pymupdf.csRGB
+        with pymupdf.open(pdf_file) as doc:
+            for page in pages:
+                pixmap = doc[page].get_pixmap(dpi=dpi, colorspace=cs, alpha=False)
+                _write_atomic(page_image_path(output_dir, pdf_file, page, pdf_root), pixmap.tobytes('png'))
+                del pixmap
+        return len(pages)
+    from pdf2image import convert_from_path
+    for page in pages:
+        image = convert_from_path(
+            pdf_file, dpi=dpi, first_page=page + 1, last_page=page + 1,
+            grayscale=colorspace == 'gray',
+        )[0]
+        png_path = page_image_path(output_dir, pdf_file, page, pdf_root)
+        image.save(png_path + '.tmp', format='PNG')
+        os.replace(png_path + '.tmp', png_path)
+    return len(pages)
+
+# Function to iterate over the PDF files of a file or a folder (recursively)
+def iter_pdf_files(pdf_path):
+    if os.path.isfile(pdf_path):
+        yield pdf_path
+        return
+    for root, _, files in os.walk(pdf_path):
+        for filename in sorted(files):
+            if filename.lower().endswith('.pdf'):
+                yield os.path.join(root, filename)
+
+# Function to render all pages of all PDFs in parallel processes
+# Input:
+#   pdf_path (str): PDF file or folder with PDFs
+#   output_dir (str): Root folder for page images
+#   dpi, colorspace, backend: see render_pages
+#   workers (int, optional): Number of processes, os.cpu_count() by default
+#   pages_per_task (int): Pages rendered by a worker per task
+# Output:
+#   stats (dict): rendered / skipped / failed page counts and pages_per_s
+# PDF-файлы перебираются лениво, а в работе не больше 2 * workers задач,
+# поэтому память не растёт с числом и размером PDF.
+def pdf_to_images(pdf_path, output_dir, dpi=300, colorspace='rgb', backend='pymupdf',
+                  workers=None, pages_per_task=16):
+    workers = workers or os.cpu_count() or 1
+    stats = {'rendered': 0, 'skipped': 0, 'failed': 0, 'failed_files': 0}
+    start = time.perf_counter()
+    bar = tqdm(desc='pages', unit='page')
+
+    def iter_tasks():
+        for pdf_file in iter_pdf_files(pdf_path):
+            try:
+                tasks, skipped = pending_page_tasks(
+                    pdf_file, output_dir, pages_per_task, backend, pdf_path
+                )
+            except Exception as e:
+                print(f"[ERROR] {pdf_file}: {e}")
+                stats['failed_files'] += 1
+                continue
+            stats['skipped'] += skipped
+            yield from tasks
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        tasks = iter_tasks()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * workers:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                future = pool.submit(
+                    render_pages, task, output_dir, dpi, colorspace, backend, pdf_path
+                )
+                pending[future] = task
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pdf_file, pages = pending.pop(future)
+                try:
+                    stats['rendered'] += future.result()
+                except Exception as e:
+                    print(f"[ERROR] {pdf_file} pages {pages[0] + 1}-{pages[-1] + 1}: {e}")
+                    stats['failed'] += len(pages)
+                bar.update(len(pages))
+    bar.close()
+    elapsed = time.perf_counter() - start
+    stats['pages_per_s'] = stats['rendered'] / elapsed if elapsed > 0 else 0.0
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description='Render PDF pages to PNG images')
+    parser.add_argument('--config', type=Path, default=Path('configs/data_preprocess.yaml'))
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    config = OmegaConf.merge(OmegaConf.create(DEFAULT_CONFIG), load_config(args.config).pdf_to_image)
+    stats = pdf_to_images(
+        config.pdf_path,
+        config.output_dir,
+        dpi=config.dpi,
+        colorspace=config.colorspace,
+        backend=config.backend,
+        workers=args.workers or config.workers,
+        pages_per_task=config.pages_per_task,
+    )
+    print(f"[DONE] {stats['rendered']} pages ({stats['pages_per_s']:.1f} pages/s), "
+          f"{stats['skipped']} already rendered, {stats['failed']} failed, "
+          f"{stats['failed_files']} unreadable PDFs")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# Content-addressed cache of rendered PNGs
+# Layout: <cache_dir>/<key[:2]>/<key>.png, key = sha256(tex source + render settings).
+# The least recently used entries (by mtime, refreshed on every hit) are evicted
+# once the cache grows over max_bytes.
+class RenderCache:
+    VERSION = 1
+
+    def __init__(self, cache_dir, max_bytes=10 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.png'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_mtime, st.st_size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.png')
+
+    # Function to build a cache key
+    # Input:
+    #   tex_content (str): Full .tex source, preamble included
+    #   settings (dict): Everything that changes the picture (density, colorspace, backend, ...)
+    # Output:
+    #   key (str): Hex sha256 digest
+    def key(self, tex_content, settings):
+        h = hashlib.sha256()
+        h.update(json.dumps({'version': self.VERSION, **settings}, sort_keys=True).encode('utf-8'))
+        h.update(b'\0')
+        h.update(tex_content.encode('utf-8'))
+        return h.hexdigest()
+
+    # Function to serve a cached PNG
+    # Input:
+    #   key (str): Cache key
+    #   dest_path (str): Where the PNG should appear
+    # Output:
+    #   hit (bool): True if dest_path was created from the cache
+    def get(self, key, dest_path):
+        path = self._path(key)
+        try:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            try:
+                os.link(path, dest_path)
+            except OSError:
+                # Другая файловая система или нет поддержки жёстких ссылок
+                shutil.copyfile(path, dest_path)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    # Function to store a rendered PNG
+    # Input:
+    #   key (str): Cache key
+    #   src_path (str): Rendered PNG
+    # Output:
+    #   None
+    def put(self, key, src_path):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes += os.path.getsize(path)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Удаляем самые старые записи, пока не останется 90% лимита
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.total_bytes = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
@@ -0,0 +1,121 @@
+import io
+import os
+import json
+from PIL import Image
+
+try:
+    import pymupdf
+except ImportError:  # без PyMuPDF профили недоступны, tex2png рендерит по-старому
+    pymupdf = None
+
+# Расширение файла для каждого кодека
+IMAGE_EXTENSIONS = {'png': '.png', 'webp': '.webp'}
+
+# Function to read the model input size from an image processor config
+# Input:
+#   processor (str or dict): Folder with preprocessor_config.json, the file itself, a Hugging
+#       Face model id, or the config content
+# Output:
+#   (height, width): Size the processor resizes images to
+def processor_input_size(processor):
+    if isinstance(processor, str) and os.path.exists(processor):
+        path = os.path.join(processor, 'preprocessor_config.json') if os.path.isdir(processor) else processor
+        with open(path, 'r', encoding='utf-8') as f:
+            processor = json.load(f)
+    elif isinstance(processor, str):
+        from transformers import AutoImageProcessor
+        processor = AutoImageProcessor.from_pretrained(processor).to_dict()
+    size = processor.get('size', 224)
+    if isinstance(size, int):
+        return size, size
+    if 'height' in size and 'width' in size:
+        return size['height'], size['width']
+    if 'shortest_edge' in size:
+        return size['shortest_edge'], size['shortest_edge']
+    raise ValueError(f'Unsupported image processor size: {size}')
+
+# Function to build a render profile for a model
+# Input:
+#   processor (str or dict): Image processor config, see processor_input_size
+#   image_format (str, optional): 'png' or 'webp' (lossless)
+#   png_compress_level (int, optional): zlib level 0-9 for PNG
+#   fit (str, optional): 'contain' keeps the aspect ratio and fits the whole page inside
+#       the model input size (the long side matches it); 'exact' resizes to the model input
+#       size as the processor would
+#   trim (bool, optional): Crop the page to the bounding box of its content
+#   margin (int, optional): White margin around the trimmed content, in output pixels
+#   max_dpi (int, optional): Resolution cap, long formulas are not rendered above it
+# Output:
+#   profile (dict): Settings for render_page; also part of the render cache key
+def make_render_profile(processor, image_format='png', png_compress_level=6, fit='contain',
+                        trim=True, margin=4, max_dpi=300):
+    if image_format not in IMAGE_EXTENSIONS:
+        raise ValueError(f'Unknown image format: {image_format}')
+    if fit not in ('contain', 'exact'):
+        raise ValueError(f'Unknown fit: {fit}')
+    height, width = processor_input_size(processor)
+    return {
+        # Меняется вместе с выводом render_page: старые записи кэша рендера не подойдут
+        'revision': 2,
+        'height': height,
+        'width': width,
+        'fit': fit,
+        'trim': trim,
+        'margin': margin,
+        'max_dpi': max_dpi,
+        'image_format': image_format,
+        'png_compress_level': png_compress_level,
+    }
+
+# Function to find the area of a page covered by its content
+# Input:
+#   page (pymupdf.Page): Page
+# Output:
+#   rect (pymupdf.Rect): Union of all text, path and image boxes; the page itself if empty
+# Берём боксы из списка отрисовки, а не ищем белые поля по пикселям:
+# так не нужен лишний рендер страницы в полном разрешении.
+def content_rect(page):
+    rect = pymupdf.Rect()
+    for _, bbox in page.get_bboxlog():
+        box = pymupdf.Rect(bbox) & page.rect
+        if not box.is_empty:
+            rect |= box
+    return page.rect if rect.is_empty else rect
+
+# Function to encode an 8-bit image with the codec of a profile
+def encode_image(image, profile):
+    buffer = io.BytesIO()
+    if profile['image_format'] == 'webp':
+        image.save(buffer, format='WEBP', lossless=True, quality=100, method=4)
+    else:
+        image.save(buffer, format='PNG', compress_level=profile['png_compress_level'])
+    return buffer.getvalue()
+
+# Function to render one PDF page according to a profile
+# Input:
+#   page (pymupdf.Page): Page
+#   profile (dict): Render profile from make_render_profile
+# Output:
+#   data (bytes): Encoded grayscale image
+def render_page(page, profile):
+    clip = content_rect(page) if profile['trim'] else page.rect
+    height, width = profile['height'], profile['width']
+    # Поля добавляем в пикселях результата, поэтому считаем масштаб без них
+    inner_h = max(height - 2 * profile['margin'], 1)
+    inner_w = max(width - 2 * profile['margin'], 1)
+    if profile['fit'] == 'exact':
+        zoom = max(inner_w / clip.width, inner_h / clip.height)
+    else:
+        # Длинная сторона — по входу модели: широкая строка формулы не раздувается до max_dpi
+        zoom = max(inner_w, inner_h) / max(clip.width, clip.height)
+    zoom = min(zoom, profile['max_dpi'] / 72)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), clip=clip, colorspace=pymupdf.csGRAY,
+                          alpha=False)
+    image = Image.frombytes('L', (pix.width, pix.height), pix.samples)
+    if profile['fit'] == 'exact':
+        image = image.resize((inner_w, inner_h), Image.Resampling.BILINEAR)
+    if profile['margin']:
+        framed = Image.new('L', (image.width + 2 * profile['margin'], image.height + 2 * profile['margin']), 255)
+        framed.paste(image, (profile['margin'], profile['margin']))
+        image = framed
+    return encode_image(image, profile)
@@ -1,56 +1,730 @@
 import os
+import re
+import shutil
+import argparse
+import tempfile
+import time
+import threading
 import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, FIRST_COMPLETED, wait
+from tqdm import tqdm
 
-def tex_to_png(tex_dir):
-    for filename in os.listdir(tex_dir):
-        if filename.endswith('.tex'):
-            tex_path = os.path.join(tex_dir, filename)
-            base = os.path.splitext(tex_path)[0]
-            pdf_path = base + '.pdf'
-            png_path = base + '.png'
-            # 1. Компиляция в PDF
+try:
+    import pymupdf
+except ImportError:  # PyMuPDF не установлен — остаётся только ImageMagick
+    pymupdf = None
+
+from to_latex_converter.tools.latex_template import PREAMBLE, BATCH_PREAMBLE, split_document
+from to_latex_converter.tools.latex_validator import Diagnostic, validate_latex
+from to_latex_converter.metrics import METRICS
+from to_latex_converter.tools.render_cache import RenderCache
+from to_latex_converter.tools.render_profile import IMAGE_EXTENSIONS, make_render_profile, render_page
+from to_latex_converter.tools.extract_tex_text_from_tex_file import remove_tex_label, write_tex_label
+from to_latex_converter.tools.work_queue import WorkQueue, LeaseKeeper, default_owner
+
+def _remove_files(base, exts):
+    for ext in exts:
+        f = base + ext
+        if os.path.exists(f):
+            os.remove(f)
+
+# Function to dump a LaTeX preamble into a precompiled pdflatex format
+# Input:
+#   preamble (str): Preamble without \begin{document}
+#   out_dir (str): Folder to write the .fmt file into
+#   name (str, optional): Format (job) name
+#   timeout (int, optional): Timeout in seconds for pdflatex -ini
+# Output:
+#   fmt_path (str or None): Path to the format without the .fmt extension, None on failure
+def build_preamble_format(preamble, out_dir, name='preamble', timeout=120):
+    os.makedirs(out_dir, exist_ok=True)
+    src_path = os.path.join(out_dir, name + '.tex')
+    with open(src_path, 'w', encoding='utf-8') as f:
+        f.write(preamble + '\\dump\n')
+    try:
+        result = subprocess.run([
+            'pdflatex',
+            '-ini',
+            '-interaction=nonstopmode',
+            '-jobname=' + name,
+            '-output-directory', out_dir,
+            '&pdflatex', src_path
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, cwd=out_dir)
+    except Exception as e:
+        print(f"[FORMAT ERROR] {name}: {e}")
+        return None
+    fmt_path = os.path.join(out_dir, name)
+    if result.returncode != 0 or not os.path.exists(fmt_path + '.fmt'):
+        print(f"[FORMAT ERROR] {name}: see {fmt_path}.log")
+        return None
+    return fmt_path
+
+# Function to build the precompiled formats used by the render pool
+# Input:
+#   out_dir (str): Folder to write the .fmt files into
+#   batch (bool, optional): Also build the multi-page batch format
+# Output:
+#   formats (dict): {'single': fmt_path, 'batch': fmt_path}, missing keys if a build failed
+def build_formats(out_dir, batch=False):
+    formats = {}
+    fmt_path = build_preamble_format(PREAMBLE, out_dir, 'preamble')
+    if fmt_path:
+        formats['single'] = fmt_path
+    if batch:
+        fmt_path = build_preamble_format(BATCH_PREAMBLE, out_dir, 'batch_preamble')
+        if fmt_path:
+            formats['batch'] = fmt_path
+    return formats
+
+# Категории ошибок pdflatex: берётся та, что встретилась в логе первой
+_LOG_CATEGORIES = [
+    ('undefined_control_sequence', r'^! Undefined control sequence'),
+    ('missing_dollar', r'^! Missing \$ inserted'),
+    ('missing_brace', r'^! Missing [{}] inserted|^! Extra \}, or forgotten|^! Too many \}'),
+    ('left_right', r'^! Missing \\right|^! Extra \\right'),
+    ('runaway_argument', r'^Runaway argument'),
+    ('environment_mismatch', r'^! LaTeX Error: \\begin\{[^}]*\} on input line \d+ ended by'),
+    ('unknown_environment', r'^! LaTeX Error: Environment \S+ undefined'),
+    ('file_not_found', r"^! LaTeX Error: File `[^']*' not found"),
+    ('double_script', r'^! Double (?:sub|super)script'),
+    ('emergency_stop', r'^! Emergency stop'),
+]
+_LOG_REGEX = re.compile('|'.join(f'(?P<{name}>{regex})' for name, regex in _LOG_CATEGORIES),
+                        re.MULTILINE)
+
+# Function to classify a pdflatex failure by its .log
+# Input:
+#   log_text (str): Content of the .log file
+# Output:
+#   category (str): One of the _LOG_CATEGORIES names or 'other'
+def classify_pdflatex_log(log_text):
+    match = _LOG_REGEX.search(log_text)
+    return match.lastgroup if match else 'other'
+
+def _compile(source_path, work_dir, timeout, fmt=None, item=None, n_samples=1):
+    # Все побочные файлы pdflatex пишет в личную папку воркера
+    base = os.path.join(work_dir, os.path.splitext(os.path.basename(source_path))[0])
+    kind = 'batch' if n_samples > 1 else 'single'
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(
+            ['pdflatex']
+            + (['-fmt=' + fmt] if fmt else [])
+            + ['-interaction=nonstopmode', '-output-directory', work_dir, source_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, cwd=work_dir
+        )
+        ok = result.returncode == 0 and os.path.exists(base + '.pdf')
+        reason = None
+        if not ok:
+            # Лог разбираем сейчас: вызывающий код удалит его вместе с мусором
             try:
-                result = subprocess.run([
-                    'pdflatex',
-                    '-interaction=nonstopmode',
-                    '-output-directory', tex_dir,
-                    tex_path
-                ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
-                if result.returncode != 0 or not os.path.exists(pdf_path):
-                    # Ошибка — удаляем .tex и мусор
-                    for ext in ['.tex', '.pdf', '.aux', '.log']:
-                        f = base + ext
-                        if os.path.exists(f):
-                            os.remove(f)
-                    print(f"[ERROR] {filename} — удалён из-за ошибки компиляции.")
-                    continue
-            except Exception as e:
-                # Любая ошибка — удаляем .tex и мусор
-                for ext in ['.tex', '.pdf', '.aux', '.log']:
-                    f = base + ext
-                    if os.path.exists(f):
-                        os.remove(f)
-                print(f"[EXCEPTION] {filename} — удалён из-за исключения: {e}")
+                with open(base + '.log', 'r', encoding='utf-8', errors='replace') as f:
+                    reason = classify_pdflatex_log(f.read())
+            except OSError:
+                reason = 'no_log'
+    except subprocess.TimeoutExpired:
+        ok, reason = False, 'timeout'
+    METRICS.observe('pdflatex_seconds', time.perf_counter() - start, item, kind=kind)
+    if not ok:
+        METRICS.inc('pdflatex_failures_total', reason=reason, kind=kind)
+    return ok, reason
+
+# MuPDF не потокобезопасен: рендер внутри процесса идёт под общим замком
+_PYMUPDF_LOCK = threading.Lock()
+
+# Function to create the process pool that rasterizes PDFs with PyMuPDF
+# Input:
+#   workers (int): Number of processes
+#   backend (str, optional): Rasterizer backend, see rasterize_pdf
+# Output:
+#   pool (ProcessPoolExecutor or None): None if the backend does not need one
+# Под замком потоки рендерят по одной странице за раз; в процессах у каждого свой MuPDF.
+# spawn, а не fork: пул создаётся рядом с потоками, и fork мог бы унаследовать занятый замок.
+def make_raster_pool(workers, backend='pymupdf'):
+    if backend != 'pymupdf' or pymupdf is None:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def _rasterize_imagemagick(pdf_path, png_path, dpi, colorspace, timeout):
+    subprocess.run(
+        ['convert', '-density', str(dpi), pdf_path]
+        + (['-colorspace', 'Gray'] if colorspace == 'gray' else [])
+        + [png_path],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=timeout
+    )
+
+def _rasterize_pymupdf(pdf_path, png_path, dpi, colorspace, profile=None):
+    cs = pymupdf.csGRAY if colorspace == 'gray' else pymupdf.csRGB
+    with _PYMUPDF_LOCK, pymupdf.open(pdf_path) as doc:
+        # Как и convert: несколько страниц без %d в имени -> name-0.png, name-1.png, ...
+        if '%d' not in png_path and doc.page_count > 1:
+            base, ext = os.path.splitext(png_path)
+            png_path = base + '-%d' + ext
+        for i, page in enumerate(doc):
+            path = png_path.replace('%d', str(i)) if '%d' in png_path else png_path
+            if profile is not None:
+                with open(path, 'wb') as f:
+                    f.write(render_page(page, profile))
                 continue
-            # 2. Конвертация PDF в PNG
-            try:
-                subprocess.run([
-                    'convert',
-                    '-density', '300',
-                    pdf_path,
-                    png_path
-                ], check=True)
-                print(f"[OK] {filename} -> {os.path.basename(png_path)}")
-            except Exception as e:
-                print(f"[CONVERT ERROR] {filename}: {e}")
-            # 3. (Опционально) удаляем PDF и мусор
-            for ext in ['.pdf', '.aux', '.log']:
-                f = base + ext
-                if os.path.exists(f):
-                    os.remove(f)
+            pix = page.get_pixmap(dpi=dpi, colorspace=cs, alpha=False)
+            pix.save(path)
+
+# Function to build the image path of a sample
+# Input:
+#   tex_path (str): Path to the .tex file
+#   profile (dict, optional): Render profile; its image format sets the extension
+# Output:
+#   image_path (str): Path next to the .tex file, .png unless the profile asks for WebP
+def image_path(tex_path, profile=None):
+    ext = IMAGE_EXTENSIONS[profile['image_format']] if profile else '.png'
+    return os.path.splitext(tex_path)[0] + ext
+
+def _check_profile(profile, backend):
+    if profile is not None and (backend != 'pymupdf' or pymupdf is None):
+        raise ValueError('Render profiles need the pymupdf backend')
+
+# Function to rasterize the pages of a PDF into PNG files
+# Input:
+#   pdf_path (str): Path to the PDF
+#   png_path (str): Output path; '%d' in it is replaced with the page index
+#   dpi (int, optional): Rasterization density
+#   colorspace (str, optional): 'rgb' or 'gray'
+#   backend (str, optional): 'pymupdf' (in-process) or 'imagemagick' (convert subprocess)
+#   timeout (int, optional): Timeout in seconds for the convert subprocess
+#   profile (dict, optional): Render profile (render_profile.py); dpi and colorspace are then
+#       ignored and every page is trimmed and rendered at the model input size
+#   raster_pool (ProcessPoolExecutor, optional): Pool from make_raster_pool; without it PyMuPDF
+#       renders in the calling thread, one thread at a time
+# Output:
+#   None (raises on failure)
+def rasterize_pdf(pdf_path, png_path, dpi=300, colorspace='rgb', backend='pymupdf', timeout=30,
+                  profile=None, raster_pool=None):
+    _check_profile(profile, backend)
+    if backend == 'pymupdf' and pymupdf is not None:
+        with METRICS.timer('rasterize_seconds', backend='pymupdf'):
+            if raster_pool is not None:
+                raster_pool.submit(_rasterize_pymupdf, pdf_path, png_path, dpi, colorspace,
+                                   profile).result()
+            else:
+                _rasterize_pymupdf(pdf_path, png_path, dpi, colorspace, profile)
+    else:
+        with METRICS.timer('rasterize_seconds', backend='imagemagick'):
+            _rasterize_imagemagick(pdf_path, png_path, dpi, colorspace, timeout)
+
+def _render_pages_pymupdf(pdf_path, dpi, colorspace, profile=None):
+    cs = pymupdf.csGRAY if colorspace == 'gray' else pymupdf.csRGB
+    with _PYMUPDF_LOCK, pymupdf.open(pdf_path) as doc:
+        if profile is not None:
+            return [render_page(page, profile) for page in doc]
+        return [page.get_pixmap(dpi=dpi, colorspace=cs, alpha=False).tobytes('png') for page in doc]
+
+# Function to rasterize the pages of a PDF into in-memory PNG images
+# Input:
+#   pdf_path (str): Path to the PDF
+#   dpi, colorspace, backend, timeout, profile, raster_pool: see rasterize_pdf
+# Output:
+#   images (list): Encoded image of every page (PNG unless the profile asks for WebP)
+def rasterize_pdf_pages(pdf_path, dpi=300, colorspace='rgb', backend='pymupdf', timeout=30,
+                        profile=None, raster_pool=None):
+    _check_profile(profile, backend)
+    if backend == 'pymupdf' and pymupdf is not None:
+        with METRICS.timer('rasterize_seconds', backend='pymupdf'):
+            if raster_pool is not None:
+                return raster_pool.submit(_render_pages_pymupdf, pdf_path, dpi, colorspace,
+                                          profile).result()
+            return _render_pages_pymupdf(pdf_path, dpi, colorspace, profile)
+    base = os.path.splitext(pdf_path)[0]
+    with METRICS.timer('rasterize_seconds', backend='imagemagick'):
+        _rasterize_imagemagick(pdf_path, base + '-%d.png', dpi, colorspace, timeout)
+    images, i = [], 0
+    while os.path.exists(f'{base}-{i}.png'):
+        with open(f'{base}-{i}.png', 'rb') as f:
+            images.append(f.read())
+        os.remove(f'{base}-{i}.png')
+        i += 1
+    return images
+
+_PAGES_REGEX = re.compile(r'Output written on .*?\((\d+) pages?')
+
+# Function to count the pages of a PDF just produced by pdflatex
+# Число страниц берём из его .log, чтобы не открывать PDF в MuPDF под общим замком
+def _pdf_page_count(pdf_path):
+    try:
+        with open(os.path.splitext(pdf_path)[0] + '.log', 'r', encoding='utf-8', errors='replace') as f:
+            match = _PAGES_REGEX.search(f.read())
+    except OSError:
+        match = None
+    if match:
+        return int(match.group(1))
+    if pymupdf is not None:
+        with _PYMUPDF_LOCK, pymupdf.open(pdf_path) as doc:
+            return doc.page_count
+    return -1
+
+# Пачки собираются в подпапке: файлы сэмплов в work_dir всегда с расширением и не совпадут с ней
+BATCH_DIR = '.batch'
+
+# Function to compile document bodies as the pages of one PDF
+# Input:
+#   bodies (list): Bodies (text between \begin{document} and \end{document}) sharing PREAMBLE
+#   work_dir (str): Private scratch directory of the caller
+#   name (str): Job name; the PDF is written to work_dir/BATCH_DIR/name.pdf
+#   timeout (int, optional): Timeout in seconds per body
+#   formats (dict, optional): Precompiled formats from build_formats(batch=True)
+#   item (str, optional): Name of the batch in the slowest-compile metrics
+# Output:
+#   pdf_path (str or None): PDF whose page i is body i, None on failure
+def compile_bodies(bodies, work_dir, name, timeout=30, formats=None, item=None):
+    batch_dir = os.path.join(work_dir, BATCH_DIR)
+    os.makedirs(batch_dir, exist_ok=True)
+    scratch_base = os.path.join(batch_dir, name)
+    document = '\\begin{document}\n' + ''.join(
+        '\\begin{sample}' + body + '\\end{sample}\n' for body in bodies
+    ) + '\\end{document}\n'
+    fmt = formats.get('batch') if formats else None
+    with open(scratch_base + '.tex', 'w', encoding='utf-8') as f:
+        f.write(document if fmt else BATCH_PREAMBLE + document)
+    try:
+        ok, _ = _compile(scratch_base + '.tex', batch_dir, timeout * len(bodies), fmt,
+                         item or f'{name} ({len(bodies)} samples)', len(bodies))
+        ok = ok and _pdf_page_count(scratch_base + '.pdf') == len(bodies)
+    except Exception:
+        ok = False
+    finally:
+        _remove_files(scratch_base, ['.tex', '.aux', '.log'])
+    if not ok:
+        _remove_files(scratch_base, ['.pdf'])
+        return None
+    return scratch_base + '.pdf'
+
+# Function to render one .tex file into a PNG placed next to it
+# Input:
+#   tex_path (str): Path to the .tex file
+#   work_dir (str): Private scratch directory for pdflatex outputs (.aux/.log/.pdf)
+#   timeout (int, optional): Timeout in seconds for each subprocess
+#   density (int, optional): Rasterization density (DPI) for ImageMagick
+#   formats (dict, optional): Precompiled formats from build_formats
+#   backend (str, optional): Rasterizer backend, see rasterize_pdf
+#   colorspace (str, optional): 'rgb' or 'gray'
+#   profile (dict, optional): Render profile, see rasterize_pdf
+#   keep_failed (bool, optional): Keep the .tex file when it fails to compile (a work queue
+#       records the failure and can render it again), otherwise it is deleted
+#   raster_pool (ProcessPoolExecutor, optional): See rasterize_pdf
+# Output:
+#   (status, message): status is 'ok', 'compile_error' or 'convert_error'
+def render_tex_file(tex_path, work_dir, timeout=30, density=300, formats=None,
+                    backend='pymupdf', colorspace='rgb', profile=None, keep_failed=False,
+                    raster_pool=None):
+    tex_path = os.path.abspath(tex_path)
+    name = os.path.splitext(os.path.basename(tex_path))[0]
+    scratch_base = os.path.join(work_dir, name)
+    png_path = image_path(tex_path, profile)
+    source_path, fmt = tex_path, None
+    try:
+        # 1. Компиляция в PDF
+        try:
+            if formats and 'single' in formats:
+                with open(tex_path, 'r', encoding='utf-8') as f:
+                    preamble, body = split_document(f.read())
+                # Преамбула уже в формате — компилируем только тело документа
+                if preamble == PREAMBLE:
+                    source_path, fmt = scratch_base + '.tex', formats['single']
+                    with open(source_path, 'w', encoding='utf-8') as f:
+                        f.write('\\begin{document}' + body + '\\end{document}\n')
+            ok, reason = _compile(source_path, work_dir, timeout, fmt, os.path.basename(tex_path))
+            if not ok:
+                METRICS.inc('compile_errors_total', reason=reason)
+                if keep_failed:
+                    return 'compile_error', f'ошибка компиляции ({reason}).'
+                _remove_files(os.path.splitext(tex_path)[0], ['.tex'])
+                return 'compile_error', f'удалён из-за ошибки компиляции ({reason}).'
+        except Exception as e:
+            METRICS.inc('compile_errors_total', reason='exception')
+            if keep_failed:
+                return 'compile_error', f'исключение: {e}'
+            _remove_files(os.path.splitext(tex_path)[0], ['.tex'])
+            return 'compile_error', f'удалён из-за исключения: {e}'
+        # 2. Конвертация PDF в PNG
+        try:
+            rasterize_pdf(scratch_base + '.pdf', png_path, density, colorspace, backend, timeout,
+                          profile, raster_pool)
+        except Exception as e:
+            return 'convert_error', str(e)
+        return 'ok', os.path.basename(png_path)
+    finally:
+        # 3. Удаляем PDF и мусор из папки воркера
+        exts = ['.pdf', '.aux', '.log'] + (['.tex'] if source_path != tex_path else [])
+        _remove_files(scratch_base, exts)
+
+# Function to render several .tex files as pages of one PDF
+# Input:
+#   tex_paths (list): Paths to .tex files sharing PREAMBLE
+#   work_dir (str): Private scratch directory of the worker
+#   timeout (int, optional): Timeout in seconds for each subprocess
+#   density (int, optional): Rasterization density (DPI)
+#   formats (dict, optional): Precompiled formats from build_formats
+#   backend (str, optional): Rasterizer backend, see rasterize_pdf
+#   colorspace (str, optional): 'rgb' or 'gray'
+#   profile (dict, optional): Render profile, see rasterize_pdf
+#   keep_failed (bool, optional): See render_tex_file
+#   raster_pool (ProcessPoolExecutor, optional): See rasterize_pdf
+# Output:
+#   results (list): (tex_path, status, message) for every input file
+# If the batch fails to compile or yields a wrong number of pages it is split
+# in halves, so a broken sample is always isolated and handled by render_tex_file.
+def render_tex_batch(tex_paths, work_dir, timeout=30, density=300, formats=None,
+                     backend='pymupdf', colorspace='rgb', profile=None, keep_failed=False,
+                     raster_pool=None):
+    if len(tex_paths) == 1:
+        return [(tex_paths[0], *render_tex_file(tex_paths[0], work_dir, timeout, density, formats,
+                                                 backend, colorspace, profile, keep_failed,
+                                                 raster_pool))]
+    bodies = []
+    for tex_path in tex_paths:
+        with open(tex_path, 'r', encoding='utf-8') as f:
+            preamble, body = split_document(f.read())
+        if preamble != PREAMBLE:
+            # Нестандартная преамбула — такие файлы собираем по одному
+            bodies = None
+            break
+        bodies.append(body)
+    if bodies is None:
+        return [
+            (tex_path, *render_tex_file(tex_path, work_dir, timeout, density, formats,
+                                        backend, colorspace, profile, keep_failed, raster_pool))
+            for tex_path in tex_paths
+        ]
+
+    pdf_path = compile_bodies(bodies, work_dir, 'batch', timeout, formats,
+                              f'{os.path.basename(tex_paths[0])} (+{len(tex_paths) - 1})')
+    if pdf_path is not None:
+        base = os.path.splitext(pdf_path)[0]
+        ext = os.path.splitext(image_path(base, profile))[1]
+        pages = [f'{base}-{i}{ext}' for i in range(len(tex_paths))]
+        try:
+            rasterize_pdf(pdf_path, base + '-%d' + ext, density, colorspace, backend,
+                          timeout * len(tex_paths), profile, raster_pool)
+            if all(os.path.exists(page) for page in pages):
+                # Страница i — это сэмпл i
+                for tex_path, page in zip(tex_paths, pages):
+                    shutil.move(page, image_path(tex_path, profile))
+                return [(tex_path, 'ok', os.path.basename(image_path(tex_path, profile)))
+                        for tex_path in tex_paths]
+        except Exception:
+            pass
+        finally:
+            _remove_files(base, ['.pdf'])
+            for page in pages:
+                if os.path.exists(page):
+                    os.remove(page)
+    half = len(tex_paths) // 2
+    return (
+        render_tex_batch(tex_paths[:half], work_dir, timeout, density, formats, backend, colorspace,
+                         profile, keep_failed, raster_pool)
+        + render_tex_batch(tex_paths[half:], work_dir, timeout, density, formats, backend, colorspace,
+                           profile, keep_failed, raster_pool)
+    )
+
+def _read_tex(tex_path):
+    with open(tex_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+# Function to reject invalid .tex files before the expensive pdflatex call
+# Input:
+#   tex_paths (list): Paths to .tex files
+#   contents (dict, optional): Already read sources {tex_path: content}
+#   keep_invalid (bool, optional): Keep rejected files instead of deleting them
+# Output:
+#   (valid, results): valid paths and (tex_path, 'invalid', message) for rejected files
+def validate_tex_files(tex_paths, contents=None, keep_invalid=False):
+    valid, results = [], []
+    for tex_path in tex_paths:
+        _, body = split_document(contents[tex_path] if contents else _read_tex(tex_path))
+        if body is None:
+            diagnostics = [Diagnostic('document', 0, 'no document environment')]
+        else:
+            diagnostics = validate_latex(body)
+        if diagnostics:
+            METRICS.inc('invalid_total', rule=diagnostics[0].rule)
+            rules = ', '.join(f"{d.rule}@{d.offset}" for d in diagnostics)
+            if keep_invalid:
+                results.append((tex_path, 'invalid', f'отклонён валидатором: {rules}'))
+            else:
+                os.remove(tex_path)
+                results.append((tex_path, 'invalid', f'удалён валидатором: {rules}'))
+        else:
+            valid.append(tex_path)
+    return valid, results
+
+# Function to serve already rendered samples from the render cache
+# Input:
+#   cache (RenderCache): Render cache
+#   tex_paths (list): Paths to .tex files
+#   settings (dict): Render settings that are part of the cache key
+#   contents (dict, optional): Already read sources {tex_path: content}
+#   profile (dict, optional): Render profile, sets the image extension
+# Output:
+#   (misses, results, keys): paths to render, (tex_path, 'cached', message) for hits,
+#   and the cache key of every path
+def lookup_render_cache(cache, tex_paths, settings, contents=None, profile=None):
+    misses, results, keys = [], [], {}
+    for tex_path in tex_paths:
+        content = contents[tex_path] if contents else _read_tex(tex_path)
+        keys[tex_path] = cache.key(content, settings)
+        png_path = image_path(tex_path, profile)
+        if cache.get(keys[tex_path], png_path):
+            results.append((tex_path, 'cached', os.path.basename(png_path)))
+        else:
+            # Старый PNG может быть жёсткой ссылкой на запись кэша — не перезаписываем его на месте
+            if os.path.exists(png_path):
+                os.remove(png_path)
+            misses.append(tex_path)
+    return misses, results, keys
+
+# Function to render all .tex files in a folder with a pool of workers
+# Input:
+#   tex_dir (str): Folder with .tex files; PNGs are written next to them
+#   workers (int, optional): Number of parallel jobs, os.cpu_count() by default
+#   timeout (int, optional): Timeout in seconds for each pdflatex/convert call
+#   density (int, optional): Rasterization density (DPI)
+#   progress (bool, optional): Show a tqdm progress bar
+#   use_format (bool, optional): Precompile the shared preamble once and reuse it
+#   batch_size (int, optional): Number of samples compiled as pages of one PDF
+#   backend (str, optional): Rasterizer backend, see rasterize_pdf
+#   colorspace (str, optional): 'rgb' or 'gray'
+#   validate (bool, optional): Run validate_latex and drop invalid files before compiling
+#   cache_dir (str, optional): Render cache folder; unchanged samples are not rendered again
+#   cache_max_bytes (int, optional): Render cache size limit
+#   text_dir (str, optional): Write the .txt label of every rendered sample here from the
+#       source read before rendering, and remove labels of samples that failed
+#   queue_path (str, optional): SQLite work queue (see work_queue.py) shared by the workers
+#       of all nodes rendering tex_dir; batches are claimed from it instead of listed
+#   owner (str, optional): Worker id in the queue, <host>:<pid> by default
+#   lease_seconds (float, optional): Lease of a claimed batch, extended while it renders.
+#       With a queue, sources that fail are kept and recorded as failed, so retry-failed can
+#       render them again; `work_queue.py prune-failed` deletes them once given up on
+#   profile (dict, optional): Render profile (render_profile.make_render_profile): trimmed
+#       grayscale images at the model input size instead of density/colorspace pages
+# Output:
+#   stats (dict): Number of files per status
+def tex_to_png_parallel(tex_dir, workers=None, timeout=30, density=300, progress=True,
+                        use_format=False, batch_size=1, backend='pymupdf', colorspace='rgb',
+                        validate=False, cache_dir=None, cache_max_bytes=10 << 30, text_dir=None,
+                        queue_path=None, owner=None, lease_seconds=600, profile=None):
+    workers = workers or os.cpu_count() or 1
+    _check_profile(profile, backend)
+    tex_files = sorted(f for f in os.listdir(tex_dir) if f.endswith('.tex'))
+    work_queue = WorkQueue(queue_path) if queue_path else None
+    # С очередью исходник ошибки не удаляем: retry-failed должен найти его снова
+    keep_failed = work_queue is not None
+    if work_queue is not None:
+        # Регистрация идемпотентна: каждый узел добавляет то, что видит, состояние не сбрасывается
+        work_queue.add(tex_files)
+        owner = owner or default_owner()
+        counts = work_queue.counts()
+        total = counts['pending'] + counts['leased']
+        batches = []
+    else:
+        total = len(tex_files)
+        batches = [
+            [os.path.join(tex_dir, f) for f in tex_files[i:i + batch_size]]
+            for i in range(0, len(tex_files), batch_size)
+        ]
+    # pdflatex и convert — внешние процессы, поэтому хватает потоков;
+    # у каждого потока своя временная папка, чтобы .aux/.log не пересекались.
+    # PyMuPDF рендерит в пуле процессов: в потоках он работал бы по одному
+    raster_pool = make_raster_pool(workers, backend)
+    local = threading.local()
+    scratch_dirs = []
+    lock = threading.Lock()
+    fmt_dir = tempfile.mkdtemp(prefix='tex2png_fmt_') if use_format else None
+    scratch_dirs.extend([fmt_dir] if fmt_dir else [])
+    formats = build_formats(fmt_dir, batch=batch_size > 1) if use_format else None
+    cache = RenderCache(cache_dir, cache_max_bytes) if cache_dir else None
+    settings = {'density': density, 'colorspace': colorspace, 'backend': backend}
+    if profile is not None:
+        settings = {'backend': backend, 'profile': profile}
+    if text_dir:
+        os.makedirs(text_dir, exist_ok=True)
+
+    def job(batch):
+        if not hasattr(local, 'work_dir'):
+            local.work_dir = tempfile.mkdtemp(prefix='tex2png_')
+            with lock:
+                scratch_dirs.append(local.work_dir)
+        results = []
+        # Каждый .tex читаем один раз: валидация, ключ кэша и метка берутся из памяти
+        contents = {tex_path: _read_tex(tex_path) for tex_path in batch} \
+            if validate or cache is not None or text_dir else None
+        if validate:
+            batch, results = validate_tex_files(batch, contents, keep_failed)
+        if cache is not None:
+            batch, hits, keys = lookup_render_cache(cache, batch, settings, contents, profile)
+            results += hits
+        if batch:
+            rendered = render_tex_batch(batch, local.work_dir, timeout, density, formats, backend,
+                                        colorspace, profile, keep_failed, raster_pool)
+            results += rendered
+            if cache is not None:
+                for tex_path, status, _ in rendered:
+                    png_path = image_path(tex_path, profile)
+                    if status == 'ok' and os.path.exists(png_path):
+                        cache.put(keys[tex_path], png_path)
+            for tex_path, status, _ in rendered:
+                if status == 'ok':
+                    png_path = image_path(tex_path, profile)
+                    METRICS.inc('bytes_written_total', os.path.getsize(png_path),
+                                kind=os.path.splitext(png_path)[1][1:])
+        if text_dir:
+            # Метки только у сэмплов, которые действительно отрендерились
+            for tex_path, status, _ in results:
+                if status in ('ok', 'cached'):
+                    text_path = write_tex_label(tex_path, contents[tex_path], text_dir)
+                    if text_path:
+                        METRICS.inc('bytes_written_total', os.path.getsize(text_path), kind='txt')
+                else:
+                    remove_tex_label(tex_path, text_dir)
+        return results
+
+    stats = {'ok': 0, 'cached': 0, 'invalid': 0, 'compile_error': 0, 'convert_error': 0}
+    bar = tqdm(total=total, disable=not progress)
+
+    def record(results):
+        for tex_path, status, message in results:
+            filename = os.path.basename(tex_path)
+            stats[status] += 1
+            METRICS.inc('samples_total', stage='render', status=status)
+            if status in ('invalid', 'compile_error'):
+                tqdm.write(f"[ERROR] {filename} — {message}")
+            elif status == 'convert_error':
+                tqdm.write(f"[CONVERT ERROR] {filename}: {message}")
+            bar.update(1)
+        bar.set_postfix(ok=stats['ok'], cached=stats['cached'],
+                        failed=sum(stats.values()) - stats['ok'] - stats['cached'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            if work_queue is None:
+                futures = [pool.submit(job, batch) for batch in batches]
+                for future in as_completed(futures):
+                    record(future.result())
+            else:
+                _render_from_queue(work_queue, owner, lease_seconds, tex_dir, batch_size,
+                                   workers, pool, job, record)
+    finally:
+        bar.close()
+        if raster_pool is not None:
+            raster_pool.shutdown()
+        if work_queue is not None:
+            work_queue.close()
+        for work_dir in scratch_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return stats
+
+# Function to render batches claimed from a work queue until it has no work left
+# Input:
+#   work_queue (WorkQueue): Shared queue of .tex file names
+#   owner (str): Worker id
+#   lease_seconds (float): Lease duration, kept alive by a LeaseKeeper while batches render
+#   tex_dir (str): Folder with the .tex files
+#   batch_size (int): Number of ids claimed per batch
+#   workers (int): Pool size; at most 2 * workers batches are claimed at a time
+#   pool (ThreadPoolExecutor): Pool that runs job(batch)
+#   job (callable): Renders a batch of .tex paths, returns (tex_path, status, message)
+#   record (callable): Accounts the results of a batch
+# Output:
+#   None
+# Rendered and cached samples are marked done, all others failed with their status and
+# message, so an interrupted run resumes with the samples that were not finished.
+def _render_from_queue(work_queue, owner, lease_seconds, tex_dir, batch_size, workers, pool,
+                       job, record):
+    keeper = LeaseKeeper(work_queue, owner, lease_seconds)
+    pending = {}
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * workers:
+                ids = work_queue.claim(owner, batch_size, lease_seconds)
+                if not ids:
+                    exhausted = True
+                    break
+                batch = [os.path.join(tex_dir, item_id) for item_id in ids]
+                # Файл мог удалить другой запуск без очереди
+                missing = [(os.path.basename(p), False, 'missing: no .tex file')
+                           for p in batch if not os.path.exists(p)]
+                if missing:
+                    work_queue.finish(owner, missing)
+                    batch = [p for p in batch if os.path.exists(p)]
+                if batch:
+                    keeper.hold(ids)
+                    pending[pool.submit(job, batch)] = ids
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ids = pending.pop(future)
+                results = future.result()
+                work_queue.finish(owner, [
+                    (os.path.basename(tex_path), status in ('ok', 'cached'), f'{status}: {message}')
+                    for tex_path, status, message in results
+                ])
+                keeper.release(ids)
+                record(results)
+    finally:
+        keeper.stop()
 
 def main():
-    tex_to_png('data/raw/ru')
+    parser = argparse.ArgumentParser(description='Render .tex files to PNG')
+    parser.add_argument('--tex-dir', default='data/raw/ru')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of parallel render jobs (default: all cores)')
+    parser.add_argument('--timeout', type=int, default=30)
+    parser.add_argument('--density', type=int, default=300)
+    parser.add_argument('--use-format', action='store_true',
+                        help='precompile the shared preamble into a pdflatex format once')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='number of samples compiled as pages of one PDF')
+    parser.add_argument('--backend', choices=['pymupdf', 'imagemagick'], default='pymupdf',
+                        help='PDF rasterizer (imagemagick is used if PyMuPDF is not installed)')
+    parser.add_argument('--colorspace', choices=['rgb', 'gray'], default='rgb')
+    parser.add_argument('--validate', action='store_true',
+                        help='drop files rejected by latex_validator before compiling')
+    parser.add_argument('--cache-dir', default=None,
+                        help='content-addressed render cache; unchanged samples are served from it')
+    parser.add_argument('--cache-max-gb', type=float, default=10.0)
+    parser.add_argument('--metrics', default=None,
+                        help='write a metrics snapshot here (.prom for a Prometheus textfile, else JSON)')
+    parser.add_argument('--text-dir', default=None,
+                        help='write .txt labels of rendered samples here (replaces extract_tex_text_from_tex_file.py)')
+    parser.add_argument('--queue', default=None,
+                        help='SQLite work queue shared by workers on several nodes; resumes interrupted runs')
+    parser.add_argument('--owner', default=None, help='worker id in the queue (default: host:pid)')
+    parser.add_argument('--lease-seconds', type=float, default=600)
+    parser.add_argument('--processor', default=None,
+                        help='image processor (folder, preprocessor_config.json or model id): render '
+                             'trimmed grayscale images at its input size instead of --density pages')
+    parser.add_argument('--image-format', choices=sorted(IMAGE_EXTENSIONS), default='png',
+                        help='codec with --processor; webp is lossless')
+    parser.add_argument('--png-compress-level', type=int, default=6)
+    parser.add_argument('--fit', choices=['contain', 'exact'], default='contain',
+                        help="with --processor: fit inside the input size keeping the aspect ratio "
+                             "(contain) or resize to the input size (exact)")
+    parser.add_argument('--no-trim', action='store_true', help='with --processor: keep page margins')
+    args = parser.parse_args()
+    profile = make_render_profile(args.processor, args.image_format, args.png_compress_level,
+                                  args.fit, not args.no_trim) if args.processor else None
+    stats = tex_to_png_parallel(args.tex_dir, args.workers, args.timeout, args.density,
+                                use_format=args.use_format, batch_size=args.batch_size,
+                                backend=args.backend, colorspace=args.colorspace,
+                                validate=args.validate, cache_dir=args.cache_dir,
+                                cache_max_bytes=int(args.cache_max_gb * (1 << 30)),
+                                text_dir=args.text_dir, queue_path=args.queue, owner=args.owner,
+                                lease_seconds=args.lease_seconds, profile=profile)
+    print(f"[DONE] {stats}")
+    METRICS.log_summary()
+    if args.metrics:
+        METRICS.export(args.metrics)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,264 @@
+import os
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+# Function to build the default worker id
+# Output:
+#   owner (str): <host>:<pid>, unique across the nodes sharing a queue
+def default_owner():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+# Lease-based work manifest in SQLite, shared by render workers on several nodes
+# Every sample id is pending, leased (claimed by an owner until lease_until), done or failed.
+# A worker claims a batch, extends its leases with heartbeat() while it works and reports
+# every id as done or failed with a reason. Leases of a crashed worker expire and are
+# claimed again, so a restarted run continues where the previous one stopped.
+# The database uses the rollback journal rather than WAL: WAL needs shared memory and does
+# not work over network file systems, where the lock of the journal does.
+class WorkQueue:
+    def __init__(self, path, max_attempts=3, busy_timeout=60):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_attempts = max_attempts
+        # Соединение общее для потоков воркера, запросы сериализуем блокировкой
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None,
+                                    check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            ' id TEXT PRIMARY KEY,'
+            ' status TEXT NOT NULL,'
+            ' owner TEXT,'
+            ' lease_until REAL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' reason TEXT,'
+            ' updated REAL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_until)')
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: два узла не заберут одни и те же id
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn()
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+            return result
+
+    # Function to register sample ids; known ids keep their state
+    # Input:
+    #   ids (iterable): Sample ids
+    # Output:
+    #   added (int): Number of new ids
+    def add(self, ids):
+        now = time.time()
+
+        def run():
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO items (id, status, updated) VALUES (?, ?, ?)',
+                ((item_id, PENDING, now) for item_id in ids)
+            )
+            return self.conn.total_changes - before
+        return self._transaction(run)
+
+    # Function to claim a batch of pending ids or ids with expired leases
+    # Input:
+    #   owner (str): Worker id
+    #   n (int): Maximum number of ids
+    #   lease_seconds (float): Lease duration
+    # Output:
+    #   ids (list): Claimed ids, empty when there is no work left
+    # An id whose lease expired max_attempts times is marked failed instead: it most likely
+    # crashes the worker that renders it.
+    def claim(self, owner, n, lease_seconds=600):
+        now = time.time()
+
+        def run():
+            self.conn.execute(
+                'UPDATE items SET status = ?, owner = NULL, lease_until = NULL,'
+                ' reason = ?, updated = ? WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                (FAILED, 'lease expired too many times', now, LEASED, now, self.max_attempts)
+            )
+            rows = self.conn.execute(
+                'SELECT id FROM items WHERE status = ? OR (status = ? AND lease_until < ?)'
+                ' ORDER BY id LIMIT ?',
+                (PENDING, LEASED, now, n)
+            ).fetchall()
+            ids = [item_id for (item_id,) in rows]
+            self.conn.executemany(
+                'UPDATE items SET status = ?, owner = ?, lease_until = ?,'
+                ' attempts = attempts + 1, updated = ? WHERE id = ?',
+                ((LEASED, owner, now + lease_seconds, now, item_id) for item_id in ids)
+            )
+            return ids
+        return self._transaction(run)
+
+    # Function to extend the leases of ids the owner still holds
+    # Input:
+    #   owner (str): Worker id
+    #   ids (iterable): Ids being worked on
+    #   lease_seconds (float): New lease duration from now
+    # Output:
+    #   extended (int): Number of leases extended; less than len(ids) means some were lost
+    def heartbeat(self, owner, ids, lease_seconds=600):
+        now = time.time()
+
+        def run():
+            before = self.conn.total_changes
+            self.conn.executemany(
+                'UPDATE items SET lease_until = ?, updated = ? WHERE id = ? AND owner = ? AND status = ?',
+                ((now + lease_seconds, now, item_id, owner, LEASED) for item_id in ids)
+            )
+            return self.conn.total_changes - before
+        return self._transaction(run)
+
+    # Function to report finished ids
+    # Input:
+    #   owner (str): Worker id
+    #   results (iterable): (id, ok, reason) triples; reason is stored for failures
+    # Output:
+    #   None
+    # Ids whose lease was lost to another worker are left to that worker.
+    def finish(self, owner, results):
+        now = time.time()
+
+        def run():
+            self.conn.executemany(
+                'UPDATE items SET status = ?, owner = NULL, lease_until = NULL, reason = ?,'
+                ' updated = ? WHERE id = ? AND owner = ? AND status = ?',
+                ((DONE if ok else FAILED, None if ok else reason, now, item_id, owner, LEASED)
+                 for item_id, ok, reason in results)
+            )
+        self._transaction(run)
+
+    def done(self, owner, ids):
+        self.finish(owner, [(item_id, True, None) for item_id in ids])
+
+    def fail(self, owner, item_id, reason):
+        self.finish(owner, [(item_id, False, reason)])
+
+    # Function to return expired leases to the pending state right away
+    # Output:
+    #   reclaimed (int): Number of ids made pending again
+    def reclaim_expired(self):
+        now = time.time()
+
+        def run():
+            before = self.conn.total_changes
+            self.conn.execute(
+                'UPDATE items SET status = ?, owner = NULL, lease_until = NULL, updated = ?'
+                ' WHERE status = ? AND lease_until < ?',
+                (PENDING, now, LEASED, now)
+            )
+            return self.conn.total_changes - before
+        return self._transaction(run)
+
+    # Function to list the ids that failed
+    def failed_ids(self):
+        with self.lock:
+            return [item_id for (item_id,) in self.conn.execute(
+                'SELECT id FROM items WHERE status = ?', (FAILED,)
+            )]
+
+    # Function to put failed ids back into the queue
+    def retry_failed(self):
+        def run():
+            before = self.conn.total_changes
+            self.conn.execute(
+                'UPDATE items SET status = ?, reason = NULL, attempts = 0, updated = ? WHERE status = ?',
+                (PENDING, time.time(), FAILED)
+            )
+            return self.conn.total_changes - before
+        return self._transaction(run)
+
+    def counts(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT status, COUNT(*) FROM items GROUP BY status').fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def failures(self, limit=20):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT id, reason FROM items WHERE status = ? ORDER BY updated DESC LIMIT ?',
+                (FAILED, limit)
+            ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Heartbeat thread that keeps the leases of the ids a worker holds alive
+# Usage: hold(ids) after claim, release(ids) after finish; stop() at the end.
+class LeaseKeeper:
+    def __init__(self, queue, owner, lease_seconds=600):
+        self.queue = queue
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+        self.thread.start()
+
+    def hold(self, ids):
+        with self.lock:
+            self.held.update(ids)
+
+    def release(self, ids):
+        with self.lock:
+            self.held.difference_update(ids)
+
+    def _run(self):
+        # Продлеваем каждую треть срока: один пропущенный такт не теряет аренду
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.lock:
+                ids = list(self.held)
+            if ids:
+                self.queue.heartbeat(self.owner, ids, self.lease_seconds)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or repair a render work queue')
+    parser.add_argument('--queue', default='data/render_queue.sqlite')
+    parser.add_argument('--tex-dir', default='data/raw/ru', help='folder of the ids, for prune-failed')
+    parser.add_argument('command', choices=['status', 'reclaim', 'retry-failed', 'prune-failed'])
+    args = parser.parse_args()
+    with WorkQueue(args.queue) as queue:
+        if args.command == 'reclaim':
+            print(f'[DONE] {queue.reclaim_expired()} expired leases reclaimed')
+        elif args.command == 'retry-failed':
+            print(f'[DONE] {queue.retry_failed()} failed ids queued again')
+        elif args.command == 'prune-failed':
+            # Рендер с очередью оставляет исходники ошибок; удаляем их, когда повторять уже не будем
+            removed = 0
+            for item_id in queue.failed_ids():
+                path = os.path.join(args.tex_dir, item_id)
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed += 1
+            print(f'[DONE] {removed} sources of failed ids removed')
+        print(queue.counts())
+        for item_id, reason in queue.failures():
+            print(f'  {item_id}: {reason}')
+
+if __name__ == '__main__':
+    main()
@@ -1,96 +1,111 @@
-from transformers import AutoTokenizer, VisionEncoderDecoderModel, AutoImageProcessor
-from PIL import Image
-import requests
 import os
+from pathlib import Path
 
-from transformers import Seq2SeqTrainer, Seq2SeqTrainingArguments
-from datasets import load_dataset
-from PIL import Image
-import torch
-
-feature_extractor = AutoImageProcessor.from_pretrained("MixTex/ZhEn-Latex-OCR")
-tokenizer = AutoTokenizer.from_pretrained("MixTex/ZhEn-Latex-OCR")
-model = VisionEncoderDecoderModel.from_pretrained("MixTex/ZhEn-Latex-OCR")
-
-# --- Добавляем русские символы в токенизатор ---
-russian_chars = [chr(code) for code in range(ord('а'), ord('я')+1)] + \
-                [chr(code) for code in range(ord('А'), ord('Я')+1)] + ['ё', 'Ё']
-
-added_tokens = []
-for char in russian_chars:
-    if tokenizer.convert_tokens_to_ids(char) == tokenizer.unk_token_id:
-        added_tokens.append(char)
-
-if added_tokens:
-    tokenizer.add_tokens(added_tokens)
-    print(f"Добавлено токенов: {len(added_tokens)}")
-    model.decoder.resize_token_embeddings(len(tokenizer))
-else:
-    print("Все русские символы уже есть в токенизаторе.")
-
-# --- Новый класс датасета для локальных файлов ---
-from torch.utils.data import Dataset
-class MyDataset(Dataset):
-    def __init__(self, img_dir, text_dir, tokenizer, feature_extractor, max_length=296):
-        self.img_dir = img_dir
-        self.text_dir = text_dir
-        self.tokenizer = tokenizer
-        self.feature_extractor = feature_extractor
-        self.max_length = max_length
-        self.img_files = sorted([f for f in os.listdir(img_dir) if f.endswith('.png')])
-
-    def __len__(self):
-        return len(self.img_files)
-
-    def __getitem__(self, idx):
-        img_name = self.img_files[idx]
-        img_path = os.path.join(self.img_dir, img_name)
-        text_path = os.path.join(self.text_dir, img_name.replace('.png', '.txt'))
-
-        image = Image.open(img_path).convert("RGB")
-        with open(text_path, 'r', encoding='utf-8') as f:
-            target_text = f.read().strip()
-
-        pixel_values = self.feature_extractor(image, return_tensors="pt").pixel_values
-        target = self.tokenizer(target_text, padding="max_length", max_length=self.max_length, truncation=True).input_ids
-        labels = [label if label != self.tokenizer.pad_token_id else -100 for label in target]
-        return {"pixel_values": pixel_values.squeeze(), "labels": torch.tensor(labels)}
-
-traindataset = MyDataset(
-    img_dir="data/img",
-    text_dir="data/txt",
-    tokenizer=tokenizer,
-    feature_extractor=feature_extractor
-)
-
-training_args = Seq2SeqTrainingArguments(
-    output_dir="./results",
-    per_device_train_batch_size=32,
-    predict_with_generate=True,
-    logging_dir='./logs',
-    learning_rate=2e-5,
-    weight_decay=0.01,
-    save_total_limit=2,
-    logging_steps=50,
-    save_steps=1000,
-    num_train_epochs=5,
-    warmup_steps=500,
-    # evaluation_strategy="steps",
-    # eval_steps=1000,
-    # load_best_model_at_end=True,
-    # metric_for_best_model="loss",
-    # greater_is_better=False,
-    # fp16=True,
-    gradient_accumulation_steps=4,
-    gradient_checkpointing=True,
-    optim="adamw_torch",
-    # lr_scheduler_type="cosine",
-)
-
-trainer = Seq2SeqTrainer(
-    model=model,
-    args=training_args,
-    train_dataset=traindataset,
-)
-trainer.train()
-tokenizer.save_pretrained("./results/tokenizer")
\ No newline at end of file
+from to_latex_converter.utils import load_config
+
+
+# --- Датасет: шарды, если они собраны, иначе отдельные файлы ---
+def load_train_dataset(tokenizer, feature_extractor, cache=None):
+    from to_latex_converter.dataset import MyDataset, ShardDataset
+
+    # Кэш предобработки включается блоком train.cache в configs/train.yaml
+    cache_kwargs = {}
+    if cache is not None and cache.enabled:
+        cache_kwargs = {"cache_dir": cache.dir, "cache_dtype": cache.dtype}
+    if os.path.exists("data/shards/index.json"):
+        return ShardDataset(
+            shard_dir="data/shards",
+            tokenizer=tokenizer,
+            feature_extractor=feature_extractor,
+            **cache_kwargs
+        )
+    return MyDataset(
+        img_dir="data/img",
+        text_dir="data/txt",
+        tokenizer=tokenizer,
+        feature_extractor=feature_extractor,
+        **cache_kwargs
+    )
+
+
+def make_trainer(config, model, traindataset):
+    import torch
+    from transformers import Seq2SeqTrainer, Seq2SeqTrainingArguments
+
+    from to_latex_converter.dataset import DynamicPaddingCollator, LengthGroupedSampler
+
+    class LengthGroupedSeq2SeqTrainer(Seq2SeqTrainer):
+        # Длины берём из датасета (предпосчитаны по меткам), а не из input_ids, как group_by_length
+        def _get_train_sampler(self, train_dataset=None):
+            train_dataset = train_dataset if train_dataset is not None else self.train_dataset
+            return LengthGroupedSampler(
+                train_dataset.target_lengths(),
+                self.args.per_device_train_batch_size,
+                mega_batch_mult=config.mega_batch_mult,
+                seed=self.args.seed,
+            )
+
+    # prefetch_factor и persistent_workers допустимы только с процессами-воркерами
+    loader = config.dataloader
+    workers = loader.num_workers
+    training_args = Seq2SeqTrainingArguments(
+        output_dir="./results",
+        per_device_train_batch_size=config.per_device_train_batch_size,
+        dataloader_num_workers=workers,
+        dataloader_pin_memory=loader.pin_memory and torch.cuda.is_available(),
+        dataloader_prefetch_factor=loader.prefetch_factor if workers else None,
+        dataloader_persistent_workers=loader.persistent_workers and workers > 0,
+        predict_with_generate=True,
+        logging_dir='./logs',
+        learning_rate=2e-5,
+        weight_decay=0.01,
+        save_total_limit=2,
+        logging_steps=50,
+        save_steps=1000,
+        num_train_epochs=5,
+        warmup_steps=500,
+        # evaluation_strategy="steps",
+        # eval_steps=1000,
+        # load_best_model_at_end=True,
+        # metric_for_best_model="loss",
+        # greater_is_better=False,
+        # fp16=True,
+        gradient_accumulation_steps=4,
+        gradient_checkpointing=True,
+        optim="adamw_torch",
+        # lr_scheduler_type="cosine",
+    )
+
+    trainer_class = LengthGroupedSeq2SeqTrainer if config.group_by_length else Seq2SeqTrainer
+    return trainer_class(
+        model=model,
+        args=training_args,
+        train_dataset=traindataset,
+        data_collator=DynamicPaddingCollator(config.pad_to_multiple_of) if config.dynamic_padding else None,
+    )
+
+
+def main():
+    config = load_config(Path(os.environ.get("TRAIN_CONFIG", "configs/train.yaml"))).train
+    # Всё берётся из локального артефакта (make prepare), в сеть не ходим
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    from to_latex_converter.prepare import load_model, load_tokenizer_and_processor, read_manifest
+
+    artifact = Path(config.artifact)
+    read_manifest(artifact, config.base_model)
+    tokenizer, feature_extractor = load_tokenizer_and_processor(artifact)
+    traindataset = load_train_dataset(tokenizer, feature_extractor, config.get("cache"))
+    # Модель — самое тяжёлое, грузим последней, когда датасет уже готов
+    model = load_model(artifact)
+
+    trainer = make_trainer(config, model, traindataset)
+    trainer.train()
+    tokenizer.save_pretrained("./results/tokenizer")
+    # Полный комплект для to_latex_converter/inference.py
+    trainer.save_model("./results/model")
+    tokenizer.save_pretrained("./results/model")
+    feature_extractor.save_pretrained("./results/model")
+
+
+if __name__ == "__main__":
+    main()